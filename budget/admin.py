@@ -1,51 +1,162 @@
 # admin.py
 from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Count, OuterRef, Subquery
+from django.utils.functional import cached_property
+
+from .exchange import own_family_amount
 from .models import (
-    Family, FamilyMember, Category, PaymentMethod,
-    Transaction, CashSaving, Budget, RecurringTemplate, EmailNotificationSettings
+    Currency, ExchangeRate, Family, FamilyMember, Category, PaymentMethod,
+    Transaction, CashSaving, Budget, RecurringTemplate, EmailNotificationSettings,
+    SpendingAnomaly
 )
+from .money import MinorSum, format_amount, from_minor
+
+
+class EstimatedCountPaginator(Paginator):
+    """件数の多いテーブル用: 絞り込みのない一覧は DB の推定件数を使う"""
+    # Below this estimate the table is small enough to count exactly
+    count_limit = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        # Filtered lists are counted exactly so every page stays reachable
+        if not queryset.query.where:
+            estimate = self.estimate(queryset.model, queryset.db)
+            if estimate and estimate > self.count_limit:
+                return estimate
+        return super().count
+
+    @staticmethod
+    def estimate(model, using):
+        connection = connections[using]
+        table = model._meta.db_table
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE relname = %s', [table])
+            elif connection.vendor == 'mysql':
+                cursor.execute(
+                    'SELECT table_rows FROM information_schema.tables '
+                    'WHERE table_schema = DATABASE() AND table_name = %s', [table]
+                )
+            elif connection.vendor == 'sqlite':
+                # Filled in by ANALYZE; the first number is the row count
+                cursor.execute(
+                    "SELECT name FROM sqlite_master WHERE name = 'sqlite_stat1'"
+                )
+                if cursor.fetchone() is None:
+                    return None
+                cursor.execute('SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1', [table])
+            else:
+                return None
+            row = cursor.fetchone()
+        if row is None or row[0] is None:
+            return None
+        return int(str(row[0]).split()[0])
+
+
+def related_filter(field_name, title):
+    """選択中の1件だけを表示する外部キーのフィルター（全件をサイドバーに読み込まない）"""
+
+    class RelatedFilter(admin.SimpleListFilter):
+        parameter_name = f'{field_name}__id__exact'
+
+        def lookups(self, request, model_admin):
+            value = self.value()
+            if not value or not value.isdigit():
+                return []
+            model = model_admin.model._meta.get_field(field_name).related_model
+            obj = model._default_manager.filter(pk=value).first()
+            return [(value, str(obj))] if obj else []
+
+        def queryset(self, request, queryset):
+            if self.value():
+                return queryset.filter(**{f'{field_name}_id': self.value()})
+            return queryset
+
+    RelatedFilter.title = title
+    return RelatedFilter
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """行数の多いテーブルの一覧（件数の推定・全件数を数えない）"""
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+@admin.register(Currency)
+class CurrencyAdmin(admin.ModelAdmin):
+    list_display = ['code', 'name', 'symbol', 'exchange_rate']
+    search_fields = ['code', 'name']
+
+@admin.register(ExchangeRate)
+class ExchangeRateAdmin(LargeTableAdmin):
+    list_display = ['date', 'currency', 'rate']
+    list_filter = ['currency']
+    list_select_related = ['currency']
+    ordering = ['-date']
 
 @admin.register(Family)
 class FamilyAdmin(admin.ModelAdmin):
     list_display = ['name', 'created_at', 'member_count']
     search_fields = ['name']
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(member_total=Count('members'))
+
     def member_count(self, obj):
-        return obj.members.count()
+        return obj.member_total
     member_count.short_description = 'メンバー数'
+    member_count.admin_order_field = 'member_total'
 
 @admin.register(FamilyMember)
 class FamilyMemberAdmin(admin.ModelAdmin):
     list_display = ['nickname', 'user', 'family']
-    list_filter = ['family']
-    search_fields = ['nickname', 'user__username']
+    list_filter = [related_filter('family', '家族')]
+    list_select_related = ['user', 'family']
+    search_fields = ['nickname', 'user__username', 'family__name']
+    autocomplete_fields = ['family']
+    raw_id_fields = ['user']
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
     list_display = ['name', 'category_type', 'is_insurance_saving', 'family', 'icon']
-    list_filter = ['category_type', 'is_insurance_saving', 'family']
-    search_fields = ['name']
+    list_filter = ['category_type', 'is_insurance_saving', related_filter('family', '家族')]
+    list_select_related = ['family']
+    search_fields = ['name', 'family__name']
+    autocomplete_fields = ['family']
 
 @admin.register(PaymentMethod)
 class PaymentMethodAdmin(admin.ModelAdmin):
     list_display = ['name', 'method_type', 'family']
-    list_filter = ['method_type', 'family']
-    search_fields = ['name']
+    list_filter = ['method_type', related_filter('family', '家族')]
+    list_select_related = ['family']
+    search_fields = ['name', 'family__name']
+    autocomplete_fields = ['family']
 
 @admin.register(Transaction)
-class TransactionAdmin(admin.ModelAdmin):
+class TransactionAdmin(LargeTableAdmin):
     list_display = ['date', 'transaction_type', 'category', 'amount', 'member', 'family', 'is_recurring']
-    list_filter = ['transaction_type', 'date', 'family', 'category', 'is_recurring']
+    # A date filter with fixed choices instead of date_hierarchy, which reads
+    # the distinct dates of the whole table
+    list_filter = [
+        'transaction_type', 'date', related_filter('family', '家族'),
+        related_filter('category', 'カテゴリー'), 'is_recurring',
+    ]
+    list_select_related = ['category', 'member__family', 'family']
     search_fields = ['description', 'category__name']
-    date_hierarchy = 'date'
+    autocomplete_fields = ['family', 'member', 'category', 'payment_method', 'currency']
     readonly_fields = ['created_at', 'updated_at']
+    ordering = ['-id']
 
     fieldsets = (
         ('基本情報', {
             'fields': ('family', 'member', 'transaction_type', 'date')
         }),
         ('金額・カテゴリー', {
-            'fields': ('amount', 'category', 'payment_method')
+            'fields': ('amount', 'currency', 'category', 'payment_method')
         }),
         ('詳細', {
             'fields': ('description', 'receipt_image', 'is_recurring')
@@ -66,38 +177,68 @@ class TransactionAdmin(admin.ModelAdmin):
         super().save_model(request, obj, form, change)
 
 @admin.register(CashSaving)
-class CashSavingAdmin(admin.ModelAdmin):
+class CashSavingAdmin(LargeTableAdmin):
     list_display = ['date', 'amount', 'member', 'family', 'description']
-    list_filter = ['date', 'family']
+    list_filter = ['date', related_filter('family', '家族')]
+    list_select_related = ['member__family', 'family']
     search_fields = ['description']
-    date_hierarchy = 'date'
+    autocomplete_fields = ['family', 'member']
     readonly_fields = ['created_at']
+    ordering = ['-id']
 
 @admin.register(Budget)
 class BudgetAdmin(admin.ModelAdmin):
     list_display = ['year', 'month', 'category', 'amount', 'family', 'usage_display']
-    list_filter = ['year', 'month', 'family', 'category']
+    list_filter = ['year', 'month', related_filter('family', '家族'), related_filter('category', 'カテゴリー')]
+    list_select_related = ['category', 'family__currency']
     search_fields = ['category__name']
+    autocomplete_fields = ['family', 'category']
+
+    def get_queryset(self, request):
+        # Spend of the budget's category and month, in the same query as the list
+        used = Transaction.objects.filter(
+            family=OuterRef('family'),
+            category=OuterRef('category'),
+            year_month=OuterRef('year') * 100 + OuterRef('month'),
+        ).order_by().values('category').annotate(
+            total=MinorSum(own_family_amount())
+        ).values('total')
+        return super().get_queryset(request).annotate(used_minor=Subquery(used))
 
     def usage_display(self, obj):
-        used = obj.get_used_amount()
-        percentage = obj.get_usage_percentage()
-        return f"¥{used:,} / ¥{obj.amount:,} ({percentage:.1f}%)"
+        used = from_minor(obj.used_minor or 0)
+        percentage = used / obj.amount * 100 if obj.amount else 0
+        symbol, code = obj.family.get_currency_symbol(), obj.family.get_currency_code()
+        return (f"{symbol}{format_amount(used, code)} / {symbol}{format_amount(obj.amount, code)} "
+                f"({percentage:.1f}%)")
     usage_display.short_description = '使用状況'
 
 @admin.register(RecurringTemplate)
 class RecurringTemplateAdmin(admin.ModelAdmin):
     list_display = ['category', 'amount', 'frequency', 'start_date', 'last_generated', 'is_active', 'family']
-    list_filter = ['frequency', 'is_active', 'family']
+    list_filter = ['frequency', 'is_active', related_filter('family', '家族')]
+    list_select_related = ['category', 'family']
     search_fields = ['category__name', 'description']
+    autocomplete_fields = ['family', 'member', 'category', 'payment_method']
     readonly_fields = ['last_generated', 'created_at']
 
+@admin.register(SpendingAnomaly)
+class SpendingAnomalyAdmin(admin.ModelAdmin):
+    list_display = ['period_start', 'kind', 'category', 'amount', 'baseline', 'score', 'family']
+    list_filter = ['kind', related_filter('family', '家族')]
+    list_select_related = ['category', 'family']
+    autocomplete_fields = ['family', 'category']
+    raw_id_fields = ['transaction']
+    readonly_fields = ['detected_at']
+
 @admin.register(EmailNotificationSettings)
 class EmailNotificationSettingsAdmin(admin.ModelAdmin):
     list_display = ['family', 'enable_notifications', 'days_without_log', 'last_notification_sent']
     list_filter = ['enable_notifications']
+    list_select_related = ['family']
+    autocomplete_fields = ['family']
 
 # Django Admin カスタマイズ
 admin.site.site_header = '家計簿アプリ 管理画面'
 admin.site.site_title = '家計簿アプリ'
-admin.site.index_title = 'データ管理'
\ No newline at end of file
+admin.site.index_title = 'データ管理'
@@ -0,0 +1,174 @@
+"""AI spending analysis (backend chosen by settings.AI_BACKEND, see ai_backends.py).
+
+The Gemini client library (gRPC/protobuf) and markdown are imported on first use,
+not when the app loads, so workers and management commands that never run an
+analysis don't pay for them (see ``manage.py bench_startup``).
+"""
+from django.utils.safestring import mark_safe
+from django.utils.translation import gettext as _, get_language
+
+from .ai_backends import get_backend
+from .ai_limits import AIBusy, run_limited
+
+# Map Django language code to a language name for the AI prompt
+RESPONSE_LANGUAGES = {'ja': 'Japanese', 'en': 'English', 'it': 'Italian'}
+
+
+def build_prompt(family, category_totals, months, analysis_type='general',
+                 focus_category='', custom_question=''):
+    """家計データから分析用プロンプトを作成"""
+    currency_symbol = family.get_currency_symbol()
+    days = months * 30
+
+    total_income = sum(v['total'] for v in category_totals.values() if v['type'] == 'income')
+    total_expense = sum(v['total'] for v in category_totals.values() if v['type'] == 'expense')
+    balance = total_income - total_expense
+    savings_rate = (balance / total_income * 100) if total_income > 0 else 0
+    monthly_income = total_income / months
+    monthly_expense = total_expense / months
+
+    response_lang = RESPONSE_LANGUAGES.get(get_language() or 'ja', 'Japanese')
+
+    # Build base data section of prompt
+    prompt = f"""
+You are an experienced financial planner (FP).
+Based on the following household budget data (actual results for the past {months} months), please provide specific and actionable advice in {response_lang}.
+
+## 📊 家計概要（{months}ヶ月合計）
+- **期間:** {days}日間
+- **通貨:** {family.get_currency_code()}
+- **総収入:** {currency_symbol}{total_income:,.0f}
+- **総支出:** {currency_symbol}{total_expense:,.0f}
+- **収支バランス:** {currency_symbol}{balance:,.0f}
+- **貯蓄率:** {savings_rate:.1f}%
+
+## 📅 月平均換算（目安）
+- **月収:** 約 {currency_symbol}{monthly_income:,.0f}
+- **月支出:** 約 {currency_symbol}{monthly_expense:,.0f}
+
+## 📂 カテゴリー別支出詳細（金額順）
+"""
+    sorted_expenses = sorted(
+        [(k, v) for k, v in category_totals.items() if v['type'] == 'expense'],
+        key=lambda x: x[1]['total'],
+        reverse=True
+    )
+    for cat_name, data in sorted_expenses:
+        monthly_avg = data['total'] / months
+        percent_of_total = (data['total'] / total_expense * 100) if total_expense > 0 else 0
+        prompt += f"- **{cat_name}**: 総額 {currency_symbol}{data['total']:,.0f} (月平均 {currency_symbol}{monthly_avg:,.0f}) | 支出全体の{percent_of_total:.1f}% | {data['count']}回\n"
+
+    # Build the instruction section based on analysis_type
+    if analysis_type == 'savings':
+        prompt += """
+
+## 📝 分析依頼内容
+貯蓄の最適化に特化した分析をMarkdown形式で出力してください。
+
+### 1. 💰 現在の貯蓄状況の評価
+貯蓄率や金額が理想的かどうかを、年齢別・収入別の一般的な目安と比較して評価してください。
+
+### 2. 🎯 貯蓄を増やす具体的な方法（3つ）
+家計データに基づき、今すぐ実践できる貯蓄増加のアクションを3つ提案してください。
+
+### 3. 📈 短期・長期の貯蓄目標
+現在のペースを続けた場合の1年後・5年後の貯蓄見通しと、改善した場合との比較を示してください。
+
+### 4. ⚠️ 注意すべきリスク
+家計バランスを見て、将来の貯蓄を脅かす可能性のある支出パターンを指摘してください。
+"""
+    elif analysis_type == 'budget':
+        prompt += """
+
+## 📝 分析依頼内容
+予算計画に特化した分析をMarkdown形式で出力してください。
+
+### 1. 📊 カテゴリー別予算配分の評価
+各カテゴリーの支出比率が家計の理想的な配分（50-30-20ルール等）と比較してどうかを評価してください。
+
+### 2. 💡 推奨予算配分（月額）
+現在の収入に基づき、各カテゴリーの推奨月次予算を具体的な金額で提示してください。
+
+### 3. 🔧 予算管理の改善ポイント
+支出パターンから読み取れる予算管理上の課題と、改善するための具体的なアドバイスを3つ提示してください。
+
+### 4. 🌟 うまくできていること
+現在の予算管理で評価できる点を挙げてください。
+"""
+    elif analysis_type == 'focus' and focus_category:
+        prompt += f"""
+
+## 📝 分析依頼内容
+「**{focus_category}**」カテゴリーに特化した深掘り分析をMarkdown形式で出力してください。
+
+### 1. 🔍 このカテゴリーの支出パターン分析
+金額・頻度・割合から見た現状の詳細な評価をしてください。
+
+### 2. 💡 このカテゴリーを改善する具体的な方法（3つ）
+実際に削減・最適化できる具体的なアクションを提案してください。
+
+### 3. 💰 削減目標と期待効果
+翌月の具体的な目標金額と、それを達成した場合の年間での貯蓄改善効果を計算してください。
+
+### 4. 🌟 このカテゴリーで評価できる点
+ポジティブな面も忘れずに指摘してください。
+"""
+    elif analysis_type == 'custom' and custom_question:
+        prompt += f"""
+
+## 📝 ユーザーからの質問
+以下の質問に、上記の家計データを参考にしながら、Markdown形式で丁寧に回答してください。
+
+**質問:** {custom_question}
+
+回答には以下を含めてください：
+- データに基づいた具体的な数字や根拠
+- 実行可能な具体的なアドバイス
+- ポジティブな視点とリスクの両面からの評価
+"""
+    else:
+        # Default: general analysis
+        prompt += """
+
+## 📝 分析依頼内容
+以下のフォーマットに従って、Markdown形式で出力してください。
+トーンは「親身で、かつ論理的」にお願いします。
+
+### 1. 🔍 現状分析（3つのポイント）
+数字に基づいた客観的な分析を3点挙げてください。
+
+### 2. 💡 具体的な改善提案（3つのステップ）
+「少し頑張れば実行できる」レベルの具体的なアクションを3つ提案してください。
+
+### 3. 💰 今すぐ見直すべき項目（節約ターゲット）
+最も削減効果が高いカテゴリーを1つ選び、翌月の具体的な削減目標金額とその理由を提示してください。
+
+### 4. 🌟 素晴らしい点（Goodポイント）
+家計管理の中で評価できる点を1つ褒めてください。
+"""
+
+    return prompt
+
+
+def generate_analysis(prompt, api_key, family_id, backend=None):
+    """AI で分析し、Markdown を HTML に変換して返す（失敗時はエラー表示）
+
+    混雑・回数制限で実行できない場合は AIBusy を送出する。
+    """
+    try:
+        backend = backend or get_backend()
+        ai_raw = run_limited(family_id, api_key, prompt, lambda: backend.generate(prompt, api_key))
+    except AIBusy:
+        raise
+    except Exception as e:
+        return mark_safe(f"<p class='text-red-600'>⚠️ {_('AI分析エラー')}: {str(e)}</p>")
+
+    if not ai_raw:
+        ai_raw = _("⚠️ AIが有効なテキストを返しませんでした。（safety / 空の応答）")
+    return render_markdown(ai_raw)
+
+
+def render_markdown(text):
+    import markdown
+
+    return mark_safe(markdown.markdown(text))
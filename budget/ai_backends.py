@@ -0,0 +1,147 @@
+"""Pluggable backends for the AI analysis.
+
+settings.AI_BACKEND names the class (default: GeminiBackend). FakeBackend is a
+deterministic, offline stand-in for load tests and development: it answers
+with markdown shaped like a real analysis after a configurable delay, can
+stream, and can inject failures and timeouts (settings.AI_FAKE_BACKEND).
+"""
+import hashlib
+import random
+import re
+import threading
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .ai_clients import get_client
+from .ai_limits import CALL_TIMEOUT
+
+DEFAULT_BACKEND = 'budget.ai_backends.GeminiBackend'
+MODEL_NAME = "gemini-2.5-flash"
+
+
+class AIBackend:
+    """generate() returns the markdown answer; stream() yields it in chunks"""
+
+    def generate(self, prompt, api_key):
+        return ''.join(self.stream(prompt, api_key))
+
+    def stream(self, prompt, api_key):
+        yield self.generate(prompt, api_key)
+
+
+class GeminiBackend(AIBackend):
+
+    def _request(self, prompt):
+        from google.ai import generativelanguage as glm
+
+        return glm.GenerateContentRequest(
+            model=f"models/{MODEL_NAME}",
+            contents=[glm.Content(role="user", parts=[glm.Part(text=prompt)])],
+        )
+
+    def generate(self, prompt, api_key):
+        response = get_client(api_key).generate_content(self._request(prompt), timeout=CALL_TIMEOUT)
+        return extract_text(response)
+
+    def stream(self, prompt, api_key):
+        for response in get_client(api_key).stream_generate_content(self._request(prompt), timeout=CALL_TIMEOUT):
+            text = extract_text(response)
+            if text:
+                yield text
+
+
+class FakeBackendError(Exception):
+    pass
+
+
+class FakeBackend(AIBackend):
+    """Offline stand-in for Gemini
+
+    Options (settings.AI_FAKE_BACKEND or keyword arguments):
+        latency       seconds before the first chunk
+        jitter        +/- random variation of the latency, in seconds
+        chunk_delay   seconds between streamed chunks
+        failure_rate  share of calls that raise FakeBackendError
+        timeout_rate  share of calls that hang until AI_CALL_TIMEOUT, then raise TimeoutError
+        seed          makes latency and failures reproducible
+    """
+
+    DEFAULTS = {
+        'latency': 1.0,
+        'jitter': 0.0,
+        'chunk_delay': 0.02,
+        'failure_rate': 0.0,
+        'timeout_rate': 0.0,
+        'seed': 0,
+    }
+
+    def __init__(self, **options):
+        self.options = {**self.DEFAULTS, **getattr(settings, 'AI_FAKE_BACKEND', {}), **options}
+        self._random = random.Random(self.options['seed'])
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def _draw(self):
+        with self._lock:
+            self.calls += 1
+            return self._random.random(), self._random.uniform(-1, 1)
+
+    def stream(self, prompt, api_key):
+        roll, variation = self._draw()
+        options = self.options
+        latency = max(0.0, options['latency'] + variation * options['jitter'])
+
+        if roll < options['timeout_rate']:
+            time.sleep(CALL_TIMEOUT)
+            raise TimeoutError('Fake AI backend: deadline exceeded')
+        time.sleep(latency)
+        if roll < options['timeout_rate'] + options['failure_rate']:
+            raise FakeBackendError('Fake AI backend: injected failure')
+
+        for i, chunk in enumerate(fake_markdown(prompt).split('\n\n')):
+            if i:
+                time.sleep(options['chunk_delay'])
+            yield chunk + '\n\n'
+
+
+def fake_markdown(prompt):
+    """Deterministic markdown answer shaped after the sections the prompt asks for"""
+    rng = random.Random(hashlib.sha256(prompt.encode()).digest())
+    headings = re.findall(r'^### (.+)$', prompt, re.MULTILINE) or ['Analysis']
+    categories = re.findall(r'^- \*\*(.+?)\*\*:', prompt, re.MULTILINE) or ['-']
+
+    parts = []
+    for heading in headings:
+        parts.append(f'### {heading}')
+        lines = []
+        for _ in range(rng.randint(2, 4)):
+            category = rng.choice(categories)
+            share = rng.randint(5, 40)
+            lines.append(f'- **{category}**: {share}% ({rng.choice(["↑", "↓", "→"])})')
+        parts.append('\n'.join(lines))
+    return '\n\n'.join(parts)
+
+
+@lru_cache(maxsize=None)
+def get_backend(path=None):
+    """settings.AI_BACKEND のバックエンド（プロセス内で共有）"""
+    return import_string(path or getattr(settings, 'AI_BACKEND', DEFAULT_BACKEND))()
+
+
+# --- Safe extraction of Gemini response ---
+def extract_text(resp):
+    if not resp:
+        return ""
+    if hasattr(resp, "text") and resp.text:
+        return resp.text
+    # Fallback: extract from candidates manually
+    if resp.candidates:
+        for c in resp.candidates:
+            if c.content and c.content.parts:
+                return "".join(
+                    p.text for p in c.content.parts if hasattr(p, "text") and p.text
+                )
+    return ""
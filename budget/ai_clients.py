@@ -0,0 +1,69 @@
+"""Gemini API clients, one per API key.
+
+genai.configure() sets process-wide state, so under a threaded server two
+members analysing at the same time could send each other's personal key. Each
+key gets its own GenerativeServiceClient instead. Clients are thread-safe and
+keep their gRPC channel open, so they are shared by all requests and reused
+until evicted (least recently used first).
+"""
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+# Distinct API keys kept open per process
+POOL_SIZE = getattr(settings, 'GEMINI_CLIENT_POOL_SIZE', 32)
+
+
+def _make_client(api_key):
+    from google.ai import generativelanguage as glm
+
+    return glm.GenerativeServiceClient(client_options={'api_key': api_key})
+
+
+class ClientPool:
+    """LRU pool of clients keyed by API key"""
+
+    def __init__(self, maxsize=POOL_SIZE, factory=_make_client):
+        self.maxsize = maxsize
+        self.factory = factory
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, api_key=None):
+        api_key = api_key or settings.GEMINI_API_KEY
+        if not api_key:
+            raise ValueError('No Gemini API key configured')
+
+        with self._lock:
+            client = self._clients.get(api_key)
+            if client is not None:
+                self._clients.move_to_end(api_key)
+                return client
+
+        # Building a client opens a channel; don't hold the lock meanwhile.
+        # If two threads race, the first one stored wins.
+        client = self.factory(api_key)
+        with self._lock:
+            client = self._clients.setdefault(api_key, client)
+            self._clients.move_to_end(api_key)
+            # Evicted clients are not closed here: a request may still be
+            # using one. The channel closes once the last reference is gone.
+            while len(self._clients) > self.maxsize:
+                self._clients.popitem(last=False)
+        return client
+
+    def clear(self):
+        with self._lock:
+            self._clients.clear()
+
+    def __len__(self):
+        return len(self._clients)
+
+
+client_pool = ClientPool()
+
+
+def get_client(api_key=None):
+    """API キーに対応するクライアント（未指定なら settings.GEMINI_API_KEY）"""
+    return client_pool.get(api_key)
@@ -0,0 +1,177 @@
+"""Admission control for Gemini calls.
+
+An analysis may hold a worker for the length of the upstream call, so before
+calling out:
+
+1. a recent result for the same prompt is reused (AI_RESULT_CACHE_SECONDS);
+2. an identical analysis already in flight in this process is joined instead
+   of being sent again;
+3. per-family and per-API-key token buckets, kept in the Django cache so they
+   hold across worker processes, must each have a token;
+4. a slot on the per-process semaphore (AI_MAX_CONCURRENT_CALLS) must free up
+   within AI_QUEUE_TIMEOUT seconds.
+
+Anything that cannot be admitted raises AIBusy with the number of seconds to
+wait, which the view turns into a 429 with Retry-After.
+"""
+import hashlib
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+MAX_CONCURRENT_CALLS = getattr(settings, 'AI_MAX_CONCURRENT_CALLS', 4)
+QUEUE_TIMEOUT = getattr(settings, 'AI_QUEUE_TIMEOUT', 5)
+CALL_TIMEOUT = getattr(settings, 'AI_CALL_TIMEOUT', 60)
+RESULT_CACHE_SECONDS = getattr(settings, 'AI_RESULT_CACHE_SECONDS', 10 * 60)
+# (requests, per seconds)
+FAMILY_RATE = getattr(settings, 'AI_FAMILY_RATE', (5, 60 * 60))
+KEY_RATE = getattr(settings, 'AI_KEY_RATE', (30, 60 * 60))
+
+
+class AIBusy(Exception):
+    """Not admitted now; retry after ``retry_after`` seconds"""
+
+    def __init__(self, retry_after):
+        self.retry_after = max(1, math.ceil(retry_after))
+        super().__init__(f'AI analysis busy, retry in {self.retry_after}s')
+
+
+def _digest(*parts):
+    return hashlib.sha256('\x00'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+class TokenBucket:
+    """Token bucket stored in the Django cache (shared by all processes using it)
+
+    Updates are serialized with a short cache.add() lock, which is atomic on
+    the shared backends (Redis, Memcached, database).
+    """
+
+    LOCK_TIMEOUT = 5
+    LOCK_ATTEMPTS = 50
+
+    def __init__(self, name, capacity, per_seconds):
+        self.name = name
+        self.capacity = capacity
+        self.rate = capacity / per_seconds
+
+    def _key(self, key):
+        return f'ai:bucket:{self.name}:{key}'
+
+    def _update(self, key, change):
+        cache_key = self._key(key)
+        lock_key = f'{cache_key}:lock'
+        for _ in range(self.LOCK_ATTEMPTS):
+            if cache.add(lock_key, 1, self.LOCK_TIMEOUT):
+                break
+            time.sleep(0.01)
+        else:
+            # Lock contention is itself a sign of overload
+            raise AIBusy(1)
+
+        try:
+            now = time.time()
+            tokens, stamp = cache.get(cache_key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - stamp) * self.rate)
+            tokens, result = change(tokens)
+            # Keep the state until the bucket would be full again anyway
+            timeout = math.ceil((self.capacity - tokens) / self.rate) + 1
+            cache.set(cache_key, (tokens, now), timeout)
+            return result
+        finally:
+            cache.delete(lock_key)
+
+    def take(self, key):
+        """Take a token; returns 0 if admitted, otherwise seconds until one is available"""
+        def change(tokens):
+            if tokens >= 1:
+                return tokens - 1, 0
+            return tokens, (1 - tokens) / self.rate
+        return self._update(key, change)
+
+    def give_back(self, key):
+        self._update(key, lambda tokens: (min(self.capacity, tokens + 1), None))
+
+
+family_bucket = TokenBucket('family', *FAMILY_RATE)
+key_bucket = TokenBucket('key', *KEY_RATE)
+
+_slots = threading.BoundedSemaphore(MAX_CONCURRENT_CALLS)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def _coalesce(key, func):
+    """Run func once for concurrent callers with the same key; the others wait for its result"""
+    with _inflight_lock:
+        call = _inflight.get(key)
+        leader = call is None
+        if leader:
+            call = _inflight[key] = _Call()
+
+    if not leader:
+        if not call.done.wait(CALL_TIMEOUT + QUEUE_TIMEOUT):
+            raise AIBusy(QUEUE_TIMEOUT)
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    try:
+        call.result = func()
+        return call.result
+    except Exception as e:
+        call.error = e
+        raise
+    finally:
+        with _inflight_lock:
+            del _inflight[key]
+        call.done.set()
+
+
+def _admit(family_id, api_key_digest, func):
+    retry_after = family_bucket.take(family_id)
+    if retry_after:
+        raise AIBusy(retry_after)
+    retry_after = key_bucket.take(api_key_digest)
+    if retry_after:
+        family_bucket.give_back(family_id)
+        raise AIBusy(retry_after)
+
+    if not _slots.acquire(timeout=QUEUE_TIMEOUT):
+        family_bucket.give_back(family_id)
+        key_bucket.give_back(api_key_digest)
+        raise AIBusy(QUEUE_TIMEOUT)
+    try:
+        return func()
+    finally:
+        _slots.release()
+
+
+def run_limited(family_id, api_key, prompt, func):
+    """func() を流量制御付きで実行（同じプロンプトの結果は共有・再利用）"""
+    prompt_digest = _digest(prompt)
+    result_key = f'ai:result:{family_id}:{prompt_digest}'
+
+    result = cache.get(result_key)
+    if result is not None:
+        return result
+
+    def call():
+        result = _admit(family_id, _digest(api_key), func)
+        if result:
+            cache.set(result_key, result, RESULT_CACHE_SECONDS)
+        return result
+
+    return _coalesce(result_key, call)
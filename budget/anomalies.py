@@ -0,0 +1,214 @@
+"""Spending anomaly detection, run in batch by ``manage.py detect_anomalies``.
+
+For every expense category the monthly and weekly totals, and the amounts of
+single transactions, are compared with a robust baseline: the median and the
+median absolute deviation (MAD) of the preceding periods. A value whose
+robust z-score 0.6745 * (x - median) / MAD passes Z_THRESHOLD, and which is
+also well above the median, is stored as a SpendingAnomaly. Entries that
+repeat the same day, category, amount, memo and member are flagged as
+possible duplicates.
+
+Amounts are compared as integer minor units. Everything is computed from one
+query per family, and only when the family's data_version moved since the
+last run, so the dashboard just reads the table.
+"""
+import math
+import statistics
+from collections import defaultdict
+from datetime import timedelta
+
+from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.utils import timezone
+
+from .exchange import family_amount
+from .models import Family, SpendingAnomaly, Transaction
+from .money import from_minor, to_minor
+
+# Robust z-score from which a value counts as an outlier (Iglewicz & Hoaglin)
+Z_THRESHOLD = getattr(settings, 'ANOMALY_Z_THRESHOLD', 3.5)
+# A spike must also be this many times the baseline median...
+SPIKE_RATIO = 1.5
+# ...and a single transaction this many times its category's median amount
+LARGE_RATIO = 3
+
+# Baseline length and the minimum history needed to judge at all
+BASELINE_MONTHS = 12
+BASELINE_WEEKS = 26
+MIN_PERIODS = 6
+MIN_TRANSACTIONS = 8
+
+# Only anomalies this recent are stored
+RECENT_MONTHS = 3
+RECENT_WEEKS = 8
+RECENT_DAYS = 90
+
+# MAD of a normal distribution is 0.6745 standard deviations
+MAD_SCALE = 0.6745
+# Mean absolute deviation of a normal distribution is 0.7979 standard deviations
+MEAN_AD_SCALE = 0.7979
+
+
+def robust_z(values, baseline):
+    """(中央値, 各値の robust z-score)"""
+    median = statistics.median(baseline)
+    deviations = [abs(v - median) for v in baseline]
+    mad = statistics.median(deviations)
+    if mad:
+        scale = mad / MAD_SCALE
+    else:
+        # More than half of the baseline is the same value
+        scale = statistics.fmean(deviations) / MEAN_AD_SCALE
+    if not scale:
+        return median, [math.inf if v > median else 0.0 for v in values]
+    return median, [(v - median) / scale for v in values]
+
+
+def _month_start(d):
+    return d.replace(day=1)
+
+
+def _week_start(d):
+    return d - timedelta(days=d.weekday())
+
+
+def _add_months(d, n):
+    return d + relativedelta(months=n)
+
+
+def _add_weeks(d, n):
+    return d + timedelta(weeks=n)
+
+
+def _spikes(kind, rows, period_of, shift, baseline_length, recent):
+    """カテゴリー別の期間合計の急増"""
+    totals = defaultdict(lambda: defaultdict(int))
+    first_seen = {}
+    for _, category_id, amount, day, *_rest in rows:
+        period = period_of(day)
+        totals[category_id][period] += amount
+        first_seen[category_id] = min(first_seen.get(category_id, period), period)
+
+    found = []
+    for category_id, by_period in totals.items():
+        for period in recent:
+            if period not in by_period:
+                continue
+            # Preceding periods since the category was first used; empty ones count as 0
+            history = [shift(period, -i) for i in range(baseline_length, 0, -1)]
+            baseline = [by_period.get(p, 0) for p in history if p >= first_seen[category_id]]
+            if len(baseline) < MIN_PERIODS:
+                continue
+            median, (score,) = robust_z([by_period[period]], baseline)
+            # Categories not used in most periods have no "usual" total to spike from
+            if median <= 0:
+                continue
+            if score >= Z_THRESHOLD and by_period[period] >= median * SPIKE_RATIO:
+                found.append(SpendingAnomaly(
+                    kind=kind, category_id=category_id, period_start=period,
+                    amount=from_minor(by_period[period]), baseline=from_minor(round(median)),
+                    score=min(score, 99.0),
+                ))
+    return found
+
+
+def detect(family, today=None):
+    """家族の異常な支出を検出（未保存の SpendingAnomaly のリスト）"""
+    today = today or timezone.now().date()
+    this_month = _month_start(today)
+    this_week = _week_start(today)
+    since = min(
+        this_month - relativedelta(months=BASELINE_MONTHS + RECENT_MONTHS),
+        this_week - timedelta(weeks=BASELINE_WEEKS + RECENT_WEEKS),
+    )
+
+    # Amounts in the family's currency, as integer minor units
+    rows = list(Transaction.objects.filter(
+        family=family,
+        transaction_type='expense',
+        date__gte=since,
+        date__lte=today
+    ).annotate(minor=family_amount(family)).order_by('date', 'id').values_list(
+        'id', 'category_id', 'minor', 'date', 'description', 'member_id', 'is_recurring'
+    ))
+    if not rows:
+        return []
+
+    found = []
+    found += _spikes(
+        'monthly_spike', rows, _month_start, _add_months, BASELINE_MONTHS,
+        [_add_months(this_month, -i) for i in range(RECENT_MONTHS)],
+    )
+    found += _spikes(
+        'weekly_spike', rows, _week_start, _add_weeks, BASELINE_WEEKS,
+        [_add_weeks(this_week, -i) for i in range(RECENT_WEEKS)],
+    )
+
+    recent_since = today - timedelta(days=RECENT_DAYS)
+    amounts = defaultdict(list)
+    for _, category_id, amount, day, *_rest in rows:
+        if day >= today - relativedelta(months=BASELINE_MONTHS):
+            amounts[category_id].append(amount)
+
+    # Unusually large single transactions
+    for pk, category_id, amount, day, _description, _member_id, is_recurring in rows:
+        baseline = amounts[category_id]
+        if day < recent_since or is_recurring or len(baseline) < MIN_TRANSACTIONS:
+            continue
+        median, (score,) = robust_z([amount], baseline)
+        if score >= Z_THRESHOLD and amount >= median * LARGE_RATIO:
+            found.append(SpendingAnomaly(
+                kind='large_transaction', category_id=category_id, transaction_id=pk,
+                period_start=day, amount=from_minor(amount), baseline=from_minor(round(median)),
+                score=min(score, 99.0),
+            ))
+
+    # Entries that look entered twice
+    seen = {}
+    for pk, category_id, amount, day, description, member_id, is_recurring in rows:
+        if day < recent_since or is_recurring:
+            continue
+        key = (day, category_id, amount, description.strip(), member_id)
+        if key in seen:
+            seen[key] += 1
+            found.append(SpendingAnomaly(
+                kind='duplicate', category_id=category_id, transaction_id=pk,
+                period_start=day, amount=from_minor(amount), baseline=from_minor(amount), score=seen[key],
+            ))
+        else:
+            seen[key] = 1
+
+    for anomaly in found:
+        anomaly.family = family
+    return found
+
+
+def _key(anomaly):
+    return (anomaly.kind, anomaly.category_id, anomaly.transaction_id,
+            anomaly.period_start, to_minor(anomaly.amount))
+
+
+def refresh(family, force=False, today=None):
+    """データが変わっていれば再検出して保存（保存した件数、未変更なら None）"""
+    versions = Family.objects.filter(pk=family.pk).values_list('data_version', 'anomaly_version').first()
+    if versions is None:
+        return None
+    version, anomaly_version = versions
+    if version == anomaly_version and not force:
+        return None
+
+    found = detect(family, today)
+
+    with db_transaction.atomic():
+        existing = SpendingAnomaly.objects.filter(family=family)
+        if {_key(a) for a in existing} != {_key(a) for a in found}:
+            existing.delete()
+            SpendingAnomaly.objects.bulk_create(found)
+            # Pages showing anomalies must not be answered from caches or with 304
+            Family.bump_data_version(family.pk)
+            version += 1
+        # If the family changed meanwhile the version no longer matches and
+        # the next run detects again
+        Family.objects.filter(pk=family.pk, data_version=version).update(anomaly_version=version)
+    return len(found)
@@ -0,0 +1,380 @@
+"""JSON API (v1) for the PWA.
+
+Rows are sent as column lists (``{"fields": [...], "rows": [[...], ...]}``)
+instead of one object per row, which keeps payloads small and compresses well.
+"""
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.db.models import Q
+from django.db.models.functions import TruncMonth
+from django.http import JsonResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import require_GET
+from dateutil.relativedelta import relativedelta
+
+from . import classifier, contributions, heatmap as heatmap_service, reports, timeline as timeline_service, trends as trends_service
+from .conditional import conditional_page
+from .exchange import family_amount
+from .family_context import get_family_member
+from .models import Transaction, CashSaving, Category, PaymentMethod, Budget, Tombstone
+from .money import MinorSum, to_minor, to_number
+
+API_VERSION = 1
+
+# Longest range /api/v1/summaries/ will expand
+MAX_SUMMARY_MONTHS = 120
+
+# Categories returned by /api/v1/categories/suggest/, and the least probability shown
+SUGGESTED_CATEGORIES = 3
+MIN_SUGGESTION_PROBABILITY = 0.05
+
+# Clients whose cursor is older than this get a full resync (tombstones are pruned)
+TOMBSTONE_RETENTION_DAYS = getattr(settings, 'SYNC_TOMBSTONE_RETENTION_DAYS', 90)
+
+
+def api_response(data, status=200):
+    """Compact JSON response"""
+    return JsonResponse(
+        data,
+        status=status,
+        json_dumps_params={'separators': (',', ':'), 'ensure_ascii': False},
+    )
+
+
+def _json_value(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        # Amounts: whole numbers stay integers, cents become a float
+        return to_number(to_minor(value))
+    return value
+
+
+def _table(queryset, fields):
+    """Serialize a queryset as a column list + rows"""
+    return {
+        'fields': list(fields),
+        'rows': [[_json_value(v) for v in row] for row in queryset.values_list(*fields)],
+    }
+
+
+# Fields sent per resource, in row order
+SYNC_RESOURCES = {
+    'transactions': (
+        Transaction,
+        ('id', 'transaction_type', 'category_id', 'amount', 'currency_id', 'payment_method_id',
+         'date', 'description', 'member_id', 'is_recurring', 'updated_at'),
+    ),
+    'cash_savings': (
+        CashSaving,
+        ('id', 'amount', 'date', 'description', 'member_id', 'updated_at'),
+    ),
+    'categories': (
+        Category,
+        ('id', 'name', 'category_type', 'is_insurance_saving', 'icon', 'updated_at'),
+    ),
+    'payment_methods': (
+        PaymentMethod,
+        ('id', 'name', 'method_type', 'updated_at'),
+    ),
+    'budgets': (
+        Budget,
+        ('id', 'category_id', 'year', 'month', 'amount', 'updated_at'),
+    ),
+}
+
+# Tombstone model names -> resource names
+TOMBSTONE_RESOURCES = {
+    'transaction': 'transactions',
+    'cash_saving': 'cash_savings',
+    'category': 'categories',
+    'payment_method': 'payment_methods',
+    'budget': 'budgets',
+}
+
+
+@login_required
+@require_GET
+@gzip_page
+@conditional_page
+def sync(request):
+    """差分同期: updated_since 以降に変更・削除された行だけを返す"""
+    member = get_family_member(request)
+    if member is None:
+        return api_response({'error': 'no_family'}, status=403)
+    family = member.family
+
+    # Cursor for the next call is taken before reading, so nothing written
+    # during this request is skipped (rows may be sent twice; clients upsert).
+    cursor = timezone.now()
+
+    since = None
+    raw_since = request.GET.get('updated_since')
+    if raw_since:
+        since = parse_datetime(raw_since)
+        if since is None:
+            return api_response({'error': 'invalid_updated_since'}, status=400)
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since)
+
+    full = since is None or since < cursor - timedelta(days=TOMBSTONE_RETENTION_DAYS)
+    if full:
+        since = None
+
+    data = {
+        'version': API_VERSION,
+        'cursor': cursor.isoformat(),
+        'full': full,
+        'currency': {'code': family.get_currency_code(), 'symbol': family.get_currency_symbol()},
+    }
+
+    for resource, (model, fields) in SYNC_RESOURCES.items():
+        queryset = model.objects.filter(family=family).order_by()
+        if since is not None:
+            queryset = queryset.filter(updated_at__gte=since)
+        data[resource] = _table(queryset, fields)
+
+    deleted = {resource: [] for resource in SYNC_RESOURCES}
+    if since is not None:
+        tombstones = Tombstone.objects.filter(
+            family=family, deleted_at__gte=since
+        ).values_list('model_name', 'object_id')
+        for model_name, object_id in tombstones:
+            deleted[TOMBSTONE_RESOURCES[model_name]].append(object_id)
+    data['deleted'] = deleted
+
+    return api_response(data)
+
+
+def _parse_month(value, default):
+    try:
+        year, month = value.split('-')
+        return date(int(year), int(month), 1)
+    except (AttributeError, ValueError):
+        return default
+
+
+@login_required
+@require_GET
+@gzip_page
+@conditional_page
+def monthly_summaries(request):
+    """月次サマリー（from/to: YYYY-MM、既定は直近12ヶ月）"""
+    member = get_family_member(request)
+    if member is None:
+        return api_response({'error': 'no_family'}, status=403)
+    family = member.family
+
+    this_month = timezone.now().date().replace(day=1)
+    end_month = _parse_month(request.GET.get('to'), this_month)
+    start_month = _parse_month(request.GET.get('from'), end_month - relativedelta(months=11))
+    if start_month > end_month or start_month < end_month - relativedelta(months=MAX_SUMMARY_MONTHS - 1):
+        return api_response({'error': 'invalid_range'}, status=400)
+    end_date = end_month + relativedelta(months=1)
+
+    amount = family_amount(family)
+    transaction_totals = Transaction.objects.filter(
+        family=family,
+        date__gte=start_month,
+        date__lt=end_date
+    ).annotate(month=TruncMonth('date')).values('month').annotate(
+        income=MinorSum(amount, filter=Q(transaction_type='income')),
+        expense=MinorSum(amount, filter=Q(transaction_type='expense')),
+        insurance_saving=MinorSum(amount, filter=Q(is_insurance_saving=True)),
+    ).order_by()
+
+    cash_saving_totals = CashSaving.objects.filter(
+        family=family,
+        date__gte=start_month,
+        date__lt=end_date
+    ).annotate(month=TruncMonth('date')).values('month').annotate(
+        cash_saving=MinorSum('amount'),
+    ).order_by()
+
+    totals = {}
+    for row in transaction_totals:
+        totals[row['month']] = row
+    for row in cash_saving_totals:
+        totals.setdefault(row['month'], {})['cash_saving'] = row['cash_saving']
+
+    rows = []
+    month = start_month
+    while month <= end_month:
+        values = totals.get(month, {})
+        income = values.get('income') or 0
+        expense = values.get('expense') or 0
+        cash_saving = values.get('cash_saving') or 0
+        insurance_saving = values.get('insurance_saving') or 0
+        rows.append([
+            month.strftime('%Y-%m'),
+            to_number(income),
+            to_number(expense),
+            to_number(cash_saving),
+            to_number(insurance_saving),
+            to_number(income - expense - cash_saving),
+        ])
+        month += relativedelta(months=1)
+
+    return api_response({
+        'version': API_VERSION,
+        'fields': ['month', 'income', 'expense', 'cash_saving', 'insurance_saving', 'balance'],
+        'rows': rows,
+    })
+
+
+def _parse_day(value, default):
+    try:
+        return parse_date(value) or default
+    except (TypeError, ValueError):
+        return default
+
+
+@login_required
+@require_GET
+@gzip_page
+@conditional_page
+def timeline(request):
+    """日別の残高推移（from/to: YYYY-MM-DD、既定は直近1年、points: 最大点数）"""
+    member = get_family_member(request)
+    if member is None:
+        return api_response({'error': 'no_family'}, status=403)
+
+    today = timezone.now().date()
+    end = _parse_day(request.GET.get('to'), today)
+    start = _parse_day(request.GET.get('from'), end - timedelta(days=364))
+    if start > end:
+        return api_response({'error': 'invalid_range'}, status=400)
+
+    try:
+        points = int(request.GET.get('points', timeline_service.DEFAULT_POINTS))
+    except ValueError:
+        return api_response({'error': 'invalid_points'}, status=400)
+    points = max(1, min(points, timeline_service.MAX_POINTS))
+
+    data = timeline_service.timeline(member.family, start, end, points)
+    return api_response({'version': API_VERSION, **data})
+
+
+@login_required
+@require_GET
+@gzip_page
+@conditional_page
+def annual_report(request):
+    """年間レポート（カテゴリー×月の実績・予算・差異・前年比、year: YYYY）"""
+    member = get_family_member(request)
+    if member is None:
+        return api_response({'error': 'no_family'}, status=403)
+
+    try:
+        year = int(request.GET.get('year', timezone.now().year))
+    except ValueError:
+        return api_response({'error': 'invalid_year'}, status=400)
+
+    report = reports.get_annual_report(request, member.family, year)
+    return api_response({
+        'version': API_VERSION,
+        'year': report['year'],
+        'months': report['months'],
+        'rows': report['rows'],
+        'income': report['income'],
+        'expense': report['expense'],
+        'net': report['net'],
+        'net_total': report['net_total'],
+    })
+
+
+@login_required
+@require_GET
+@gzip_page
+@conditional_page
+def members(request):
+    """メンバー別の月次収入・支出・貯蓄とカテゴリー構成（year: YYYY）"""
+    member = get_family_member(request)
+    if member is None:
+        return api_response({'error': 'no_family'}, status=403)
+
+    try:
+        year = int(request.GET.get('year', timezone.now().year))
+    except ValueError:
+        return api_response({'error': 'invalid_year'}, status=400)
+
+    data = contributions.get_member_breakdown(request, member.family, year)
+    return api_response({'version': API_VERSION, **data})
+
+
+@login_required
+@require_GET
+@gzip_page
+@conditional_page
+def heatmap(request):
+    """日×カテゴリー・曜日×時刻のヒートマップ（from/to: YYYY-MM-DD、既定は直近90日、type: expense/income）"""
+    member = get_family_member(request)
+    if member is None:
+        return api_response({'error': 'no_family'}, status=403)
+
+    today = timezone.now().date()
+    end = _parse_day(request.GET.get('to'), today)
+    start = _parse_day(request.GET.get('from'), end - timedelta(days=89))
+    if start > end or (end - start).days >= heatmap_service.MAX_DAYS:
+        return api_response({'error': 'invalid_range'}, status=400)
+
+    transaction_type = request.GET.get('type', 'expense')
+    if transaction_type not in ('expense', 'income'):
+        return api_response({'error': 'invalid_type'}, status=400)
+
+    data = heatmap_service.get_heatmaps(request, member.family, start, end, transaction_type)
+    return api_response({'version': API_VERSION, **data})
+
+
+@login_required
+@require_GET
+@gzip_page
+@conditional_page
+def trends(request):
+    """カテゴリー別の月次推移・移動平均（3/6/12ヶ月）・傾き・季節指数（type: expense/income）"""
+    member = get_family_member(request)
+    if member is None:
+        return api_response({'error': 'no_family'}, status=403)
+
+    transaction_type = request.GET.get('type', 'expense')
+    if transaction_type not in ('expense', 'income'):
+        return api_response({'error': 'invalid_type'}, status=400)
+
+    data = trends_service.get_category_trends(request, member.family, transaction_type)
+    return api_response({'version': API_VERSION, **data})
+
+
+@login_required
+@require_GET
+@gzip_page
+@conditional_page
+def category_suggestions(request):
+    """メモ（q）から推定したカテゴリー（type: expense/income、確率の高い順）"""
+    member = get_family_member(request)
+    if member is None:
+        return api_response({'error': 'no_family'}, status=403)
+
+    transaction_type = request.GET.get('type', 'expense')
+    if transaction_type not in ('expense', 'income'):
+        return api_response({'error': 'invalid_type'}, status=400)
+
+    text = request.GET.get('q', '')[:classifier.MAX_TEXT]
+    data = {'version': API_VERSION, 'suggestions': []}
+    if not classifier.tokens(text):
+        return api_response(data)
+
+    names = dict(Category.objects.filter(
+        family=member.family, category_type=transaction_type
+    ).values_list('id', 'name'))
+    ranked = classifier.suggest(classifier.get_model(member.family_id), text, names)
+    data['suggestions'] = [
+        {'id': category_id, 'name': names[category_id], 'probability': round(probability, 3)}
+        for category_id, probability in ranked[:SUGGESTED_CATEGORIES]
+        if probability >= MIN_SUGGESTION_PROBABILITY
+    ]
+    return api_response(data)
@@ -8,6 +8,7 @@ from django import forms
 from django.core.exceptions import ValidationError
 from .models import FamilyInvite, FamilyMember
 from .forms import JoinFamilyForm
+from .family_context import get_family_member
 from django.utils import timezone
 # Import translation utilities
 from django.utils.translation import gettext_lazy as _
@@ -152,12 +153,9 @@ def join_family_confirm(request, code):
         return redirect('setup_profile')
 
     # すでに家族に所属している場合
-    try:
-        existing_member = request.user.familymember
+    if get_family_member(request) is not None:
         messages.info(request, gettext('すでに家族に所属しています'))
         return redirect('dashboard')
-    except FamilyMember.DoesNotExist:
-        pass
 
     if request.method == 'POST':
         form = JoinFamilyForm(request.POST)
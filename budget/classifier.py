@@ -0,0 +1,265 @@
+"""Category suggestions from the memo, learnt per family.
+
+A multinomial naive Bayes model over the character bigrams of the memo
+(NFKC-normalised, lower case; a one-character memo is its own token), which
+works the same for Japanese memos without word breaks and for Latin ones.
+The model is a plain dict:
+
+* docs: memos learnt per category id;
+* tokens: token counts per category id;
+* totals: tokens learnt per category id;
+* vocabulary: how many categories use each token (its size is V).
+
+The counts are stored one row per category (ClassifierCategory, docs) and
+per category and token (ClassifierToken). Every new transaction with a memo
+adds to them with F() updates, so saving a transaction touches only its own
+tokens; a transaction whose memo or category changes, or which is deleted,
+is subtracted again. A deleted category's rows go with it (CASCADE). The
+dict is rebuilt from the rows when the cached one was dropped by a change.
+A family without a CategoryClassifier row is seeded once from its last
+SEED_TRANSACTIONS memos. Each category keeps at most MAX_TOKENS tokens;
+beyond that the tokens seen only once are dropped, so unlearning skips
+tokens that are no longer there.
+
+suggest() scores every category with add-one smoothing in a few dict
+lookups per token and returns probabilities, so it can run on every
+keystroke.
+"""
+import math
+import unicodedata
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction as db_transaction
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+
+from .models import CategoryClassifier, ClassifierCategory, ClassifierToken, Transaction
+
+CLASSIFIER_TIMEOUT = getattr(settings, 'CLASSIFIER_CACHE_SECONDS', 60 * 60 * 24)
+
+SEED_TRANSACTIONS = 1000
+MAX_TOKENS = 2000
+MAX_TEXT = 100
+
+
+def _cache_key(family_id):
+    return f'classifier:{family_id}'
+
+
+def tokens(text):
+    """メモ → 文字 bigram のリスト"""
+    text = ' '.join(unicodedata.normalize('NFKC', text or '').lower().split())[:MAX_TEXT]
+    if len(text) < 2:
+        return [text] if text.strip() else []
+    return [text[i:i + 2] for i in range(len(text) - 1) if not text[i:i + 2].isspace()]
+
+
+def empty():
+    return {'docs': {}, 'tokens': {}, 'totals': {}, 'vocabulary': {}}
+
+
+def _drop_token(model, token):
+    model['vocabulary'][token] -= 1
+    if not model['vocabulary'][token]:
+        del model['vocabulary'][token]
+
+
+def _prune(model, key):
+    counts = model['tokens'][key]
+    for token in [token for token, count in counts.items() if count == 1]:
+        del counts[token]
+        model['totals'][key] -= 1
+        _drop_token(model, token)
+
+
+def learn(model, text, category_id):
+    """1件のメモを model に反映"""
+    found = tokens(text)
+    if not found:
+        return model
+    key = str(category_id)
+    model['docs'][key] = model['docs'].get(key, 0) + 1
+    counts = model['tokens'].setdefault(key, {})
+    for token in found:
+        if token not in counts:
+            counts[token] = 0
+            model['vocabulary'][token] = model['vocabulary'].get(token, 0) + 1
+        counts[token] += 1
+    model['totals'][key] = model['totals'].get(key, 0) + len(found)
+    if len(counts) > MAX_TOKENS:
+        _prune(model, key)
+    return model
+
+
+def suggest(model, text, category_ids=None):
+    """[(カテゴリー id, 確率)]（確率の高い順、category_ids で候補を絞る）"""
+    vocabulary = model['vocabulary']
+    found = [token for token in tokens(text) if token in vocabulary]
+    if not found:
+        return []
+
+    docs = model['docs']
+    if category_ids is not None:
+        allowed = {str(category_id) for category_id in category_ids}
+        docs = {key: count for key, count in docs.items() if key in allowed}
+    if not docs:
+        return []
+
+    size = len(vocabulary)
+    total_docs = sum(docs.values())
+    scores = {}
+    for key, count in docs.items():
+        counts = model['tokens'].get(key, {})
+        denominator = model['totals'].get(key, 0) + size
+        score = math.log(count / total_docs)
+        for token in found:
+            score += math.log((counts.get(token, 0) + 1) / denominator)
+        scores[key] = score
+
+    # Softmax, shifted by the best score to stay in range
+    best = max(scores.values())
+    weights = {key: math.exp(score - best) for key, score in scores.items()}
+    total = sum(weights.values())
+    ranked = sorted(weights.items(), key=lambda item: item[1], reverse=True)
+    return [(int(key), weight / total) for key, weight in ranked]
+
+
+def _seed(family_id):
+    model = empty()
+    rows = Transaction.objects.filter(family_id=family_id).exclude(description='').order_by(
+        '-created_at'
+    ).values_list('description', 'category_id')[:SEED_TRANSACTIONS]
+    for description, category_id in reversed(rows):
+        learn(model, description, category_id)
+    return model
+
+
+def _save(family_id, model):
+    """_seed() のモデルを行として保存"""
+    ClassifierCategory.objects.bulk_create([
+        ClassifierCategory(category_id=int(key), family_id=family_id, docs=docs)
+        for key, docs in model['docs'].items()
+    ])
+    ClassifierToken.objects.bulk_create([
+        ClassifierToken(category_id=int(key), token=token, count=count)
+        for key, counts in model['tokens'].items() for token, count in counts.items()
+    ], batch_size=1000)
+
+
+def _load(family_id):
+    """保存済みの行 → モデル"""
+    model = empty()
+    model['docs'] = {
+        str(category_id): docs
+        for category_id, docs in ClassifierCategory.objects.filter(family_id=family_id).values_list(
+            'category_id', 'docs'
+        )
+    }
+    rows = ClassifierToken.objects.filter(category__family_id=family_id).values_list(
+        'category_id', 'token', 'count'
+    )
+    for category_id, token, count in rows:
+        key = str(category_id)
+        model['tokens'].setdefault(key, {})[token] = count
+        model['totals'][key] = model['totals'].get(key, 0) + count
+        model['vocabulary'][token] = model['vocabulary'].get(token, 0) + 1
+    return model
+
+
+def _by_count(found):
+    """トークン → 回数 を 回数 → トークン に（F() の更新を回数ごとに1回で済ませる）"""
+    groups = {}
+    for token, count in Counter(found).items():
+        groups.setdefault(count, []).append(token)
+    return groups.items()
+
+
+def _learn(family_id, found, category_id):
+    ClassifierCategory.objects.bulk_create(
+        [ClassifierCategory(category_id=category_id, family_id=family_id)], ignore_conflicts=True
+    )
+    ClassifierCategory.objects.filter(pk=category_id).update(docs=F('docs') + 1)
+    rows = ClassifierToken.objects.filter(category_id=category_id)
+    ClassifierToken.objects.bulk_create(
+        [ClassifierToken(category_id=category_id, token=token) for token in set(found)], ignore_conflicts=True
+    )
+    for count, group in _by_count(found):
+        rows.filter(token__in=group).update(count=F('count') + count)
+    if rows.count() > MAX_TOKENS:
+        rows.filter(count=1).delete()
+
+
+def _unlearn(found, category_id):
+    if not ClassifierCategory.objects.filter(pk=category_id).update(docs=F('docs') - 1):
+        return
+    # The last memo of the category: its tokens go with it
+    if ClassifierCategory.objects.filter(pk=category_id, docs=0).delete()[0]:
+        return
+    rows = ClassifierToken.objects.filter(category_id=category_id)
+    for count, group in _by_count(found):
+        rows.filter(token__in=group).update(count=Greatest(F('count') - count, Value(0)))
+    rows.filter(count=0).delete()
+
+
+def _ensure(family_id):
+    """行がなければ履歴から作成（作成したら True）"""
+    _, created = CategoryClassifier.objects.get_or_create(family_id=family_id)
+    if created:
+        _save(family_id, _seed(family_id))
+    return created
+
+
+def get_model(family_id):
+    """キャッシュ済みのモデル（なければ DB の行から、それもなければ履歴から作成）"""
+    key = _cache_key(family_id)
+    model = cache.get(key)
+    if model is None:
+        with db_transaction.atomic():
+            _ensure(family_id)
+        model = _load(family_id)
+        cache.set(key, model, CLASSIFIER_TIMEOUT)
+    return model
+
+
+def _update(family_id, change):
+    """保存済みの件数に change を適用（行がなければ履歴から作成）"""
+    with db_transaction.atomic():
+        # The history already includes this change
+        if not _ensure(family_id):
+            change()
+    cache.delete(_cache_key(family_id))
+
+
+def record(instance):
+    """新しい取引のメモを学習"""
+    found = tokens(instance.description)
+    if found:
+        _update(instance.family_id, lambda: _learn(instance.family_id, found, instance.category_id))
+
+
+def relearn(instance, old_text, old_category_id):
+    """メモ・カテゴリーを変更した取引を学習し直す"""
+    old, found = tokens(old_text), tokens(instance.description)
+    if not old and not found:
+        return
+
+    def change():
+        if old:
+            _unlearn(old, old_category_id)
+        if found:
+            _learn(instance.family_id, found, instance.category_id)
+    _update(instance.family_id, change)
+
+
+def forget(instance, text, category_id):
+    """削除した取引のメモを取り消す"""
+    found = tokens(text)
+    if found:
+        _update(instance.family_id, lambda: _unlearn(found, category_id))
+
+
+def forget_deleted_category(category):
+    """削除したカテゴリーの件数は CASCADE で消えるので、キャッシュだけ捨てる"""
+    cache.delete(_cache_key(category.family_id))
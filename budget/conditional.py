@@ -0,0 +1,87 @@
+"""Conditional GET for family pages.
+
+ETag and Last-Modified come from the family's data version (bumped on every
+write, see signals.py) so an unchanged page is answered with 304 before the
+view runs any aggregate query or renders a template.
+"""
+import hashlib
+from datetime import datetime, time
+
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.utils import timezone
+from django.utils.translation import get_language
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
+
+from .family_context import get_family_member
+
+
+def _family_state(request):
+    """(pk, data_version, last_modified) of the user's family, looked up once per request"""
+    if not hasattr(request, '_family_state'):
+        state = None
+        member = get_family_member(request)
+        if member is not None:
+            # get_family_member has checked the version against the database
+            family = member.family
+            state = (family.pk, family.data_version, family.get_last_modified())
+        request._family_state = state
+    return request._family_state
+
+
+def _has_pending_messages(request):
+    # A flash message must be rendered, never hidden behind a 304
+    return len(get_messages(request)) > 0
+
+
+def family_etag(request, *args, **kwargs):
+    state = _family_state(request)
+    if state is None or _has_pending_messages(request):
+        return None
+
+    family_id, version, last_modified = state
+    parts = [
+        family_id,
+        version,
+        last_modified.isoformat(),
+        request.user.pk,
+        get_language(),
+        request.path,
+        sorted(request.GET.lists()),
+        # Defaults such as "this month" depend on the date
+        timezone.localdate().isoformat(),
+        # Cached pages embed a CSRF token; a new secret needs a new page
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''),
+    ]
+    return hashlib.md5(repr(parts).encode(), usedforsecurity=False).hexdigest()
+
+
+def family_last_modified(request, *args, **kwargs):
+    state = _family_state(request)
+    if state is None or _has_pending_messages(request):
+        return None
+
+    candidates = [
+        state[2],
+        timezone.make_aware(datetime.combine(timezone.localdate(), time.min)),
+    ]
+    if request.user.last_login:
+        candidates.append(request.user.last_login)
+    return max(candidates)
+
+
+def family_cache_key(request, *parts):
+    """Cache key tied to the family's data version, so any write invalidates it"""
+    state = _family_state(request)
+    if state is None:
+        return None
+    family_id, version, _ = state
+    return ':'.join(str(part) for part in ('family', family_id, version, *parts))
+
+
+def conditional_page(view_func):
+    """家族データが変わっていなければ 304 Not Modified を返す"""
+    return cache_control(private=True, no_cache=True)(
+        condition(etag_func=family_etag, last_modified_func=family_last_modified)(view_func)
+    )
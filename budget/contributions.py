@@ -0,0 +1,165 @@
+"""Per-member contributions for a year.
+
+Transactions are grouped by (member, month, category) in one query and cash
+savings by (member, month) in another, so the cost does not grow with the
+number of members. From those rows every member gets monthly income, spend
+and savings arrays, their share of the family's spend and their category
+mix; the category mix per member and month is sent as sparse column arrays
+like the heatmap.
+
+Rows are classified by the transaction's own transaction_type and
+is_insurance_saving, as on the dashboard. Spend leaves out insurance
+savings, which count as savings along with cash savings. Entries of members who left the family are kept under a
+name of None (the cache is shared by all languages, so the label is left to
+the page). Sums are integer minor units until they are returned.
+"""
+from datetime import date
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+from django.db.models.functions import TruncMonth
+
+from .conditional import family_cache_key
+from .exchange import family_amount
+from .models import CashSaving, FamilyMember, Transaction
+from .money import MinorSum, to_number
+
+CONTRIBUTIONS_TIMEOUT = getattr(settings, 'CONTRIBUTIONS_CACHE_SECONDS', 60 * 60)
+
+# Categories listed per member
+TOP_CATEGORIES = 5
+
+
+def _share(part, whole):
+    return round(part / whole * 100, 1) if whole else 0
+
+
+def _member(member_id, name):
+    return {
+        'member_id': member_id,
+        'name': name,
+        'income': [0] * 12,
+        'expense': [0] * 12,
+        'savings': [0] * 12,
+        'categories': {},
+    }
+
+
+def member_breakdown(family, year):
+    """メンバー別の月次収入・支出・貯蓄とカテゴリー構成（3クエリ）"""
+    start, end = date(year, 1, 1), date(year + 1, 1, 1)
+
+    members = {
+        member_id: _member(member_id, nickname)
+        for member_id, nickname in FamilyMember.objects.filter(
+            family=family
+        ).order_by('id').values_list('id', 'nickname')
+    }
+
+    def member_entry(member_id):
+        if member_id not in members:
+            members[member_id] = _member(member_id, None)
+        return members[member_id]
+
+    rows = Transaction.objects.filter(
+        family=family,
+        date__gte=start,
+        date__lt=end
+    ).annotate(month=TruncMonth('date')).values(
+        'member_id', 'month', 'category_id', 'category__name',
+        'transaction_type', 'is_insurance_saving'
+    ).annotate(
+        total=MinorSum(family_amount(family)),
+        count=Count('id'),
+    ).order_by('member_id', 'month')
+
+    categories = {}
+    cells = {'member': [], 'month': [], 'category': [], 'total': [], 'count': []}
+    member_index = {member_id: i for i, member_id in enumerate(members)}
+    for row in rows:
+        entry = member_entry(row['member_id'])
+        month = row['month'].month - 1
+        total = row['total']
+        # Classified like the dashboard, by the transaction's own fields
+        if row['transaction_type'] == 'income':
+            entry['income'][month] += total
+        elif row['is_insurance_saving']:
+            entry['savings'][month] += total
+        else:
+            entry['expense'][month] += total
+
+        name = row['category__name']
+        category = entry['categories'].setdefault(name, {
+            'category': name, 'type': row['transaction_type'], 'total': 0,
+        })
+        category['total'] += total
+
+        index = categories.setdefault(row['category_id'], (
+            len(categories), name, row['transaction_type'],
+        ))[0]
+        cells['member'].append(member_index.setdefault(row['member_id'], len(member_index)))
+        cells['month'].append(month)
+        cells['category'].append(index)
+        cells['total'].append(to_number(total))
+        cells['count'].append(row['count'])
+
+    savings = CashSaving.objects.filter(
+        family=family,
+        date__gte=start,
+        date__lt=end
+    ).annotate(month=TruncMonth('date')).values('member_id', 'month').annotate(
+        total=MinorSum('amount')
+    ).order_by()
+    for row in savings:
+        member_entry(row['member_id'])['savings'][row['month'].month - 1] += row['total']
+
+    result = []
+    for entry in members.values():
+        for name in ('income', 'expense', 'savings'):
+            entry[f'{name}_total'] = sum(entry[name])
+        result.append(entry)
+
+    family_expense = sum(entry['expense_total'] for entry in result)
+    family_income = sum(entry['income_total'] for entry in result)
+    family_savings = sum(entry['savings_total'] for entry in result)
+    for entry in result:
+        entry['expense_share'] = _share(entry['expense_total'], family_expense)
+        entry['income_share'] = _share(entry['income_total'], family_income)
+        entry['savings_share'] = _share(entry['savings_total'], family_savings)
+        mix = sorted(
+            (c for c in entry['categories'].values() if c['type'] == 'expense'),
+            key=lambda c: c['total'], reverse=True
+        )
+        mix_total = sum(category['total'] for category in mix)
+        for category in mix:
+            category['share'] = _share(category['total'], mix_total)
+            category['total'] = to_number(category['total'])
+        entry['categories'] = mix[:TOP_CATEGORIES]
+        for name in ('income', 'expense', 'savings'):
+            entry[name] = [to_number(value) for value in entry[name]]
+            entry[f'{name}_total'] = to_number(entry[f'{name}_total'])
+
+    return {
+        'year': year,
+        'months': [f'{year}-{month:02d}' for month in range(1, 13)],
+        'members': result,
+        'totals': {
+            'income': to_number(family_income),
+            'expense': to_number(family_expense),
+            'savings': to_number(family_savings),
+        },
+        'categories': [[category_id, name, category_type]
+                       for category_id, (_index, name, category_type) in categories.items()],
+        'cells': cells,
+    }
+
+
+def get_member_breakdown(request, family, year):
+    """member_breakdown() をデータバージョン単位でキャッシュ"""
+    cache_key = family_cache_key(request, 'contributions', year)
+    data = cache.get(cache_key)
+    if data is None:
+        data = member_breakdown(family, year)
+        cache.set(cache_key, data, CONTRIBUTIONS_TIMEOUT)
+    return data
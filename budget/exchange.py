@@ -0,0 +1,180 @@
+"""Historical exchange rates.
+
+Rates are stored per currency and day in ExchangeRate, in the unit of
+Currency.exchange_rate (units of the currency per 1 JPY). A currency with no
+history falls back to its static Currency.exchange_rate.
+
+* RateTable holds every rate in memory as sorted day/rate arrays per
+  currency. A lookup is a bisect; days between two known rates are
+  interpolated linearly and days outside the history take the nearest rate.
+  The table is kept in process memory, so lookups don't unpickle the whole
+  history. Saving rates bumps a version number in the cache (see
+  signals.py); a process reloads its table when that version moved, and at
+  the latest after EXCHANGE_RATES_CACHE_SECONDS.
+* family_amount() is a SQL expression for a transaction's amount in the
+  family's currency, so grouped sums convert every row in the same query.
+  Every aggregate over Transaction amounts goes through it (MinorSum(
+  family_amount(family))); rows in the family's currency, or without one,
+  are summed as they are. own_family_amount() does the same for queries
+  over several families, such as the admin changelists.
+  It takes the last rate on or before the transaction date;
+  load_exchange_rates stores a rate for every day of the feed, which makes
+  that match RateTable's interpolation within the loaded range.
+"""
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import (
+    BigIntegerField, Case, ExpressionWrapper, F, FloatField, OuterRef, Q, Subquery, Value, When,
+)
+from django.db.models.functions import Cast, Coalesce, Round
+
+from .models import Currency, ExchangeRate
+from .money import from_minor, to_minor
+
+BASE_CURRENCY = 'JPY'
+
+RATES_VERSION_KEY = 'exchange:version'
+RATES_TIMEOUT = getattr(settings, 'EXCHANGE_RATES_CACHE_SECONDS', 60 * 60)
+
+
+class RateTable:
+    """通貨ごとの日次レート（日付の二分探索と線形補間）"""
+
+    def __init__(self, static, history):
+        # static: {code: rate}; history: {code: ([day ordinal, ...], [rate, ...])}
+        self.static = static
+        self.history = history
+
+    @classmethod
+    def load(cls):
+        """DB から全レートを読み込む（2クエリ）"""
+        static = {
+            code: float(rate)
+            for code, rate in Currency.objects.values_list('code', 'exchange_rate')
+        }
+        history = {}
+        rows = ExchangeRate.objects.order_by('currency_id', 'date').values_list(
+            'currency__code', 'date', 'rate'
+        )
+        for code, day, rate in rows:
+            days, rates = history.setdefault(code, ([], []))
+            days.append(day.toordinal())
+            rates.append(float(rate))
+        return cls(static, history)
+
+    def rate(self, code, day=None):
+        """JPY 1 あたりの code のレート（day の時点、省略時は現在の固定レート）"""
+        if code == BASE_CURRENCY:
+            return 1.0
+        series = self.history.get(code)
+        if day is None or series is None:
+            try:
+                return self.static[code]
+            except KeyError:
+                raise ValueError(f"Unknown currency: {code}")
+
+        days, rates = series
+        ordinal = day.toordinal()
+        i = bisect_left(days, ordinal)
+        if i < len(days) and days[i] == ordinal:
+            return rates[i]
+        if i == 0:
+            return rates[0]
+        if i == len(days):
+            return rates[-1]
+        before, after = days[i - 1], days[i]
+        weight = (ordinal - before) / (after - before)
+        return rates[i - 1] + (rates[i] - rates[i - 1]) * weight
+
+    def convert_minor(self, minor, source, target, day=None):
+        """最小単位の金額を source から target に換算"""
+        if source == target:
+            return minor
+        return round(minor * self.rate(target, day) / self.rate(source, day))
+
+    def convert(self, amount, source, target, day=None):
+        """金額（Decimal）を source から target に換算"""
+        return from_minor(self.convert_minor(to_minor(amount), source, target, day))
+
+
+# (table, version, loaded at) of this process
+_loaded = (None, None, 0.0)
+
+
+def get_rate_table():
+    """プロセス内の RateTable（レートのバージョンが変わったら読み直す）"""
+    global _loaded
+    table, version, loaded_at = _loaded
+    current = cache.get_or_set(RATES_VERSION_KEY, 0, None)
+    if table is None or version != current or time.monotonic() - loaded_at > RATES_TIMEOUT:
+        table = RateTable.load()
+        _loaded = (table, current, time.monotonic())
+    return table
+
+
+def invalidate_rate_table():
+    """レートのバージョンを進める（全プロセスの RateTable が読み直される）"""
+    try:
+        cache.incr(RATES_VERSION_KEY)
+    except ValueError:
+        # Not set yet, or evicted: any new value differs from the loaded ones
+        cache.set(RATES_VERSION_KEY, time.time_ns(), None)
+
+
+def _rate(currency):
+    """currency（pk の式）の取引日時点のレート"""
+    history = ExchangeRate.objects.filter(currency=currency).order_by()
+    return Coalesce(
+        Subquery(history.filter(date__lte=OuterRef('date')).order_by('-date').values('rate')[:1]),
+        Subquery(history.order_by('date').values('rate')[:1]),
+        Subquery(Currency.objects.filter(pk=currency).values('exchange_rate')[:1]),
+        output_field=FloatField(),
+    )
+
+
+def _base_currency():
+    """JPY の pk（式、クエリごとに SQL の中で引く）"""
+    return Subquery(Currency.objects.filter(code=BASE_CURRENCY).values('pk')[:1])
+
+
+def _amount(field, target, outer_target):
+    # target: the family currency's pk in the Transaction query, outer_target
+    # the same seen from the rate subqueries
+    home = Q(currency__isnull=True) | Q(currency=target)
+    converted = ExpressionWrapper(
+        F(field) * _rate(outer_target) / _rate(OuterRef('currency')),
+        output_field=FloatField(),
+    )
+    return Case(
+        When(home, then=F(field)),
+        default=Cast(Round(converted), BigIntegerField()),
+        output_field=BigIntegerField(),
+    )
+
+
+def family_amount(family, field='amount'):
+    """Transaction の金額を家族の通貨で表す式（最小単位の整数）"""
+    # A family without a currency keeps JPY
+    target = Value(family.currency_id) if family.currency_id else _base_currency()
+    return _amount(field, target, target)
+
+
+def own_family_amount(field='amount'):
+    """Transaction の金額をその取引の家族の通貨で表す式（家族をまたぐ集計用）"""
+    base = _base_currency()
+    return _amount(
+        field, Coalesce(F('family__currency'), base), Coalesce(OuterRef('family__currency'), base)
+    )
+
+
+def transaction_minor(transaction, family):
+    """1件の取引の金額を家族の通貨で（最小単位の整数、family_amount と同じ換算）"""
+    minor = to_minor(transaction.amount)
+    if transaction.currency_id is None or transaction.currency_id == family.currency_id:
+        return minor
+    return get_rate_table().convert_minor(
+        minor, transaction.currency.code, family.get_currency_code(), transaction.date
+    )
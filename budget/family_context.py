@@ -0,0 +1,82 @@
+"""Family context for the logged-in user.
+
+The member, family and currency are loaded with one select_related query and
+cached per user, so views no longer pay for ``user.familymember`` and
+``member.family`` (and ``family.currency``) on every request.
+
+A cached entry is checked on every request against the membership row and the
+family's ``data_version`` in one small query. Membership, family and currency
+changes all bump that version (see signals.py), so a removed member loses
+access at once on every worker, even with a per-process cache; the signals
+also drop the entries of the process that made the change. The fresh version
+is kept on ``member.family`` for conditional.py.
+"""
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.shortcuts import redirect
+
+from .models import FamilyMember
+
+FAMILY_CONTEXT_TIMEOUT = getattr(settings, 'FAMILY_CONTEXT_CACHE_SECONDS', 5 * 60)
+
+
+def _cache_key(user_id):
+    return f'family-context:{user_id}'
+
+
+def get_family_member(request):
+    """ログインユーザーの家族メンバー（家族・通貨を含む）。未設定なら None"""
+    if not hasattr(request, '_family_member'):
+        request._family_member = _load_member(request.user)
+    return request._family_member
+
+
+def _load_member(user):
+    if not user.is_authenticated:
+        return None
+
+    member = cache.get(_cache_key(user.pk))
+    if member is not None and not _refresh(member, user):
+        member = None
+    if member is None:
+        member = FamilyMember.objects.select_related('family__currency').filter(user=user).first()
+        if member is None:
+            # Not cached: the profile is usually created on the very next request
+            return None
+        cache.set(_cache_key(user.pk), member, FAMILY_CONTEXT_TIMEOUT)
+
+    # The user object of this request, not a pickled copy
+    member.user = user
+    return member
+
+
+def _refresh(member, user):
+    """キャッシュした member がまだ有効か確認し、家族のバージョンを最新にする"""
+    row = FamilyMember.objects.filter(
+        pk=member.pk, user_id=user.pk, family_id=member.family_id
+    ).values_list('family__data_version', 'family__data_updated_at').first()
+    if row is None or row[0] != member.family.data_version:
+        # Removed, moved to another family, or the family changed elsewhere
+        return False
+    member.family.data_updated_at = row[1]
+    return True
+
+
+def invalidate_family_context(user_ids):
+    """指定ユーザーのキャッシュを削除"""
+    cache.delete_many([_cache_key(user_id) for user_id in user_ids])
+
+
+def family_required(view_func):
+    """request.member / request.family をセット。家族未設定ならプロフィール設定へ"""
+    @wraps(view_func)
+    def _wrapped_view(request, *args, **kwargs):
+        member = get_family_member(request)
+        if member is None:
+            return redirect('setup_profile')
+        request.member = member
+        request.family = member.family
+        return view_func(request, *args, **kwargs)
+    return _wrapped_view
@@ -1,5 +1,6 @@
 from django import forms
 from .models import Transaction, CashSaving, Category, PaymentMethod
+from .money import amount_step, validate_currency_decimals
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 import json
@@ -33,7 +34,28 @@ class CategorySelect(Select):
 
         return option
 
-class QuickTransactionForm(forms.ModelForm):
+class CurrencyAmountMixin:
+    """amount を家族の通貨の小数桁で検証（JPY・KRW は整数のみ）"""
+
+    def __init__(self, *args, family=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.currency_code = family.get_currency_code() if family else None
+        if self.currency_code:
+            self.fields['amount'].widget.attrs['step'] = amount_step(self.currency_code)
+
+    def clean_amount(self):
+        amount = self.cleaned_data['amount']
+        if amount is not None and self.currency_code:
+            validate_currency_decimals(amount, self.currency_code)
+        return amount
+
+
+class AmountForm(CurrencyAmountMixin, forms.Form):
+    """金額だけの入力（プリセット入力・予算の POST）"""
+    amount = Transaction._meta.get_field('amount').formfield(min_value=0)
+
+
+class QuickTransactionForm(CurrencyAmountMixin, forms.ModelForm):
     # 3. Translate field labels using the 'labels' attribute in Meta
     class Meta:
         model = Transaction
@@ -57,7 +79,7 @@ class QuickTransactionForm(forms.ModelForm):
             'amount': forms.NumberInput(attrs={
                 'class': 'w-full p-4 text-2xl font-bold border-2 border-gray-300 rounded-lg focus:border-blue-500 focus:outline-none',
                 'placeholder': '0',
-                'inputmode': 'numeric'
+                'inputmode': 'decimal'
             }),
             'payment_method': forms.Select(attrs={
                 'class': 'w-full p-4 text-lg border-2 border-gray-300 rounded-lg focus:border-blue-500 focus:outline-none'
@@ -75,7 +97,7 @@ class QuickTransactionForm(forms.ModelForm):
 
     def __init__(self, *args, **kwargs):
         family = kwargs.pop('family', None)
-        super().__init__(*args, **kwargs)
+        super().__init__(*args, family=family, **kwargs)
 
         if family:
             categories = Category.objects.filter(family=family)
@@ -98,7 +120,7 @@ class QuickTransactionForm(forms.ModelForm):
             self.fields['transaction_type'].initial = 'expense'
 
 
-class CashSavingForm(forms.ModelForm):
+class CashSavingForm(CurrencyAmountMixin, forms.ModelForm):
     """現金貯蓄フォーム"""
     # 6. Translate field labels using the 'labels' attribute in Meta
     class Meta:
@@ -113,7 +135,7 @@ class CashSavingForm(forms.ModelForm):
             'amount': forms.NumberInput(attrs={
                 'class': 'w-full p-4 text-2xl font-bold border-2 border-gray-300 rounded-lg focus:border-blue-500 focus:outline-none',
                 'placeholder': '0',
-                'inputmode': 'numeric'
+                'inputmode': 'decimal'
             }),
             'date': forms.DateInput(attrs={
                 'type': 'date',
@@ -0,0 +1,91 @@
+"""Spending heatmaps.
+
+Two grids, each from one grouped query over the requested range:
+
+* day x category: per-day totals for every category, sent as parallel
+  column arrays of the non-empty cells (day index, category index, total,
+  count) since most days touch only a few categories;
+* weekday x hour of entry: when transactions are entered (``created_at`` in
+  the active time zone), sent as dense 7 x 24 arrays.
+
+Results are cached under the family's data version.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+from django.db.models.functions import ExtractHour, ExtractIsoWeekDay
+
+from .conditional import family_cache_key
+from .exchange import family_amount
+from .models import Transaction
+from .money import MinorSum, to_number
+
+HEATMAP_TIMEOUT = getattr(settings, 'HEATMAP_CACHE_SECONDS', 60 * 60)
+
+# Longest range, in days, a heatmap is built for
+MAX_DAYS = 731
+
+
+def day_category(family, start, end, transaction_type='expense'):
+    """日×カテゴリーの合計（空でないセルのみ、列ごとの配列）"""
+    rows = Transaction.objects.filter(
+        family=family,
+        transaction_type=transaction_type,
+        date__gte=start,
+        date__lte=end
+    ).values('date', 'category_id', 'category__name').annotate(
+        total=MinorSum(family_amount(family)),
+        count=Count('id'),
+    ).order_by('date', 'category_id')
+
+    categories = {}
+    cells = {'day': [], 'category': [], 'total': [], 'count': []}
+    for row in rows:
+        index = categories.setdefault(row['category_id'], (len(categories), row['category__name']))[0]
+        cells['day'].append((row['date'] - start).days)
+        cells['category'].append(index)
+        cells['total'].append(to_number(row['total']))
+        cells['count'].append(row['count'])
+
+    return {
+        'start': start.isoformat(),
+        'days': (end - start).days + 1,
+        'categories': [[category_id, name] for category_id, (_, name) in categories.items()],
+        'cells': cells,
+    }
+
+
+def weekday_hour(family, start, end, transaction_type='expense'):
+    """入力した曜日×時刻の件数・合計（7×24、月曜始まり）"""
+    rows = Transaction.objects.filter(
+        family=family,
+        transaction_type=transaction_type,
+        date__gte=start,
+        date__lte=end
+    ).annotate(
+        weekday=ExtractIsoWeekDay('created_at'),
+        hour=ExtractHour('created_at'),
+    ).values('weekday', 'hour').annotate(
+        total=MinorSum(family_amount(family)),
+        count=Count('id'),
+    ).order_by()
+
+    count = [[0] * 24 for _ in range(7)]
+    total = [[0] * 24 for _ in range(7)]
+    for row in rows:
+        count[row['weekday'] - 1][row['hour']] = row['count']
+        total[row['weekday'] - 1][row['hour']] = to_number(row['total'])
+    return {'count': count, 'total': total}
+
+
+def get_heatmaps(request, family, start, end, transaction_type='expense'):
+    """両方のヒートマップ（データバージョン単位でキャッシュ）"""
+    cache_key = family_cache_key(request, 'heatmap', start, end, transaction_type)
+    data = cache.get(cache_key)
+    if data is None:
+        data = {
+            'day_category': day_category(family, start, end, transaction_type),
+            'weekday_hour': weekday_hour(family, start, end, transaction_type),
+        }
+        cache.set(cache_key, data, HEATMAP_TIMEOUT)
+    return data
@@ -0,0 +1,252 @@
+"""Local, rule-based spending insights.
+
+Computed from the same category totals as the Gemini prompt, in a few
+queries and without any network call, so the analysis page shows results at
+once and the AI narrative is an optional extra on top. Budget suggestions
+start from the trend-based expectation for the coming month (see trends.py)
+where a category has enough history. Amounts are Decimal throughout.
+"""
+import math
+from decimal import Decimal
+
+from dateutil.relativedelta import relativedelta
+from django.db.models import Count
+from django.db.models.functions import TruncMonth
+
+from . import trends
+from .exchange import family_amount
+from .models import Budget, CashSaving, Transaction
+from .money import MinorSum, from_minor
+
+# Expense categories counted as needs for the 50-30-20 rule (default category
+# names plus common additions); other non-saving expenses count as wants.
+NEEDS_CATEGORY_NAMES = frozenset({
+    '食費', '日用品', '交通費', '光熱費', '通信費', '医療費',
+    '住居費', '家賃', '住宅ローン', '水道光熱費', '保険', '教育費', '税金',
+    'Food', 'Groceries', 'Rent', 'Mortgage', 'Utilities', 'Transport',
+    'Medical', 'Phone', 'Insurance', 'Education', 'Taxes',
+})
+
+# 50-30-20 rule: target share of income in percent
+RULE_TARGETS = {'needs': 50, 'wants': 30, 'savings': 20}
+
+# Percentage points a share may differ from its target and still count as on target
+RULE_TOLERANCE = 5
+
+# Cut suggested for a "wants" category when wants are already on target
+DEFAULT_CUT_RATE = Decimal('0.1')
+
+# Saving targets and month-over-month rows shown
+TOP_TARGETS = 3
+TOP_CHANGES = 5
+
+
+def category_totals(family, since_date):
+    """期間内のカテゴリー別合計（{名前: {total, count, type, is_insurance_saving}}、金額順）"""
+    rows = Transaction.objects.filter(
+        family=family,
+        date__gte=since_date
+    ).values(
+        'category__name', 'category__category_type', 'category__is_insurance_saving'
+    ).annotate(
+        total=MinorSum(family_amount(family)),
+        count=Count('id'),
+    ).order_by('-total')
+
+    totals = {}
+    for row in rows:
+        entry = totals.setdefault(row['category__name'], {
+            'total': 0,
+            'count': 0,
+            'type': row['category__category_type'],
+            'is_insurance_saving': row['category__is_insurance_saving'],
+        })
+        entry['total'] += from_minor(row['total'])
+        entry['count'] += row['count']
+    return totals
+
+
+def _round_budget(value):
+    """Round up to two significant digits (12,345 -> 13,000)"""
+    if value <= 0:
+        return 0
+    step = 10 ** max(0, int(math.log10(value)) - 1)
+    return math.ceil(value / step) * step
+
+
+def _is_need(name):
+    return name in NEEDS_CATEGORY_NAMES
+
+
+def rule_50_30_20(totals, months, cash_saving_total):
+    """50-30-20 ルールとの比較（月額と収入比）"""
+    income = sum((v['total'] for v in totals.values() if v['type'] == 'income'), Decimal(0)) / months
+    amounts = {'needs': Decimal(0), 'wants': Decimal(0), 'savings': cash_saving_total / months}
+    for name, data in totals.items():
+        if data['type'] != 'expense':
+            continue
+        if data['is_insurance_saving']:
+            amounts['savings'] += data['total'] / months
+        elif _is_need(name):
+            amounts['needs'] += data['total'] / months
+        else:
+            amounts['wants'] += data['total'] / months
+
+    rows = []
+    for key, target in RULE_TARGETS.items():
+        percent = amounts[key] / income * 100 if income > 0 else 0
+        if key == 'savings':
+            status = 'under' if percent < target - RULE_TOLERANCE else 'ok'
+        else:
+            status = 'over' if percent > target + RULE_TOLERANCE else 'ok'
+        rows.append({
+            'key': key,
+            'amount': amounts[key],
+            'percent': percent,
+            'target': target,
+            'target_amount': income * target / 100,
+            'status': status,
+        })
+    return rows
+
+
+def saving_targets(totals, months, rule_rows):
+    """節約ターゲット: 支出の大きい「欲しいもの」カテゴリーと月額の削減目安"""
+    wants = sorted(
+        ((name, data['total'] / months) for name, data in totals.items()
+         if data['type'] == 'expense' and not data['is_insurance_saving'] and not _is_need(name)),
+        key=lambda item: item[1],
+        reverse=True,
+    )
+    wants_total = sum(monthly for _, monthly in wants)
+    wants_row = next(row for row in rule_rows if row['key'] == 'wants')
+    # Over target: share the excess out by size; otherwise a flat cut
+    excess = max(Decimal(0), wants_row['amount'] - wants_row['target_amount'])
+
+    targets = []
+    for name, monthly in wants[:TOP_TARGETS]:
+        if excess and wants_total:
+            cut = excess * monthly / wants_total
+        else:
+            cut = monthly * DEFAULT_CUT_RATE
+        targets.append({
+            'category': name,
+            'monthly': monthly,
+            'cut': cut,
+            'yearly_effect': cut * 12,
+        })
+    return targets
+
+
+def month_over_month(family, today):
+    """直近2ヶ月（完了月）のカテゴリー別支出の増減"""
+    current_month = today.replace(day=1) - relativedelta(months=1)
+    previous_month = current_month - relativedelta(months=1)
+
+    rows = Transaction.objects.filter(
+        family=family,
+        transaction_type='expense',
+        date__gte=previous_month,
+        date__lt=current_month + relativedelta(months=1)
+    ).annotate(month=TruncMonth('date')).values('month', 'category__name').annotate(
+        total=MinorSum(family_amount(family))
+    ).order_by()
+
+    amounts = {}
+    for row in rows:
+        key = 'current' if row['month'] == current_month else 'previous'
+        amounts.setdefault(row['category__name'], {'current': Decimal(0), 'previous': Decimal(0)})[key] = (
+            from_minor(row['total'])
+        )
+
+    changes = []
+    for name, values in amounts.items():
+        delta = values['current'] - values['previous']
+        changes.append({
+            'category': name,
+            'previous': values['previous'],
+            'current': values['current'],
+            'delta': delta,
+            'percent': delta / values['previous'] * 100 if values['previous'] else None,
+        })
+    changes.sort(key=lambda change: abs(change['delta']), reverse=True)
+
+    return {
+        'current_month': current_month,
+        'previous_month': previous_month,
+        'total_previous': sum(v['previous'] for v in amounts.values()),
+        'total_current': sum(v['current'] for v in amounts.values()),
+        'changes': changes,
+        'top_changes': changes[:TOP_CHANGES],
+    }
+
+
+def budget_suggestions(family, totals, months, targets, today, category_trends=None):
+    """カテゴリー別の推奨月次予算（傾向からの見込みを基準に、今月の予算設定と比較）"""
+    cuts = {target['category']: target['cut'] for target in targets}
+    current_budgets = dict(Budget.objects.filter(
+        family=family,
+        year=today.year,
+        month=today.month
+    ).values_list('category__name', 'amount'))
+
+    by_name = {entry['category']: entry for entry in (category_trends or {}).get('categories', [])}
+
+    suggestions = []
+    for name, data in totals.items():
+        if data['type'] != 'expense':
+            continue
+        monthly = data['total'] / months
+        current = current_budgets.get(name)
+        trend = by_name.get(name)
+        # Expected spend for the coming month: moving average and seasonality,
+        # once the category has a few complete months of history
+        expected = trend['expected'] if trend and trend['history_months'] >= 3 else None
+        base = Decimal(str(expected)) if expected is not None else monthly
+        suggestions.append({
+            'category': name,
+            'monthly': monthly,
+            'expected': expected,
+            'trend_percent': trend['trend_percent'] if trend else None,
+            'suggested': _round_budget(base - cuts.get(name, 0)),
+            'current_budget': current,
+        })
+    suggestions.sort(key=lambda suggestion: suggestion['suggested'], reverse=True)
+    return suggestions
+
+
+def analyze(family, totals, months, since_date, today, focus_category=''):
+    """ローカル分析一式"""
+    cash_saving_total = from_minor(CashSaving.objects.filter(
+        family=family,
+        date__gte=since_date
+    ).aggregate(total=MinorSum('amount'))['total'] or 0)
+
+    rule_rows = rule_50_30_20(totals, months, cash_saving_total)
+    targets = saving_targets(totals, months, rule_rows)
+    changes = month_over_month(family, today)
+    suggestions = budget_suggestions(
+        family, totals, months, targets, today, trends.category_trends(family, today)
+    )
+
+    focus = None
+    if focus_category and focus_category in totals:
+        data = totals[focus_category]
+        total_expense = sum(v['total'] for v in totals.values() if v['type'] == 'expense')
+        focus = {
+            'category': focus_category,
+            'monthly': data['total'] / months,
+            'count': data['count'],
+            'share': data['total'] / total_expense * 100 if total_expense else 0,
+            'change': next((c for c in changes['changes'] if c['category'] == focus_category), None),
+            'suggestion': next((s for s in suggestions if s['category'] == focus_category), None),
+        }
+
+    return {
+        'rule': rule_rows,
+        'cash_saving_monthly': cash_saving_total / months,
+        'targets': targets,
+        'month_over_month': changes,
+        'budget_suggestions': suggestions,
+        'focus': focus,
+    }
@@ -0,0 +1,107 @@
+import json
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Loads the WSGI application and every view module, like a worker serving its
+# first request, then reports what was imported and the peak memory.
+WORKER_SCRIPT = """
+import json, os, resource, sys
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', {settings_module!r})
+from django.utils.module_loading import import_string
+import django
+django.setup()
+import_string({wsgi_application!r})
+from django.urls import get_resolver
+get_resolver().url_patterns
+maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+if sys.platform == 'darwin':
+    maxrss //= 1024
+print(json.dumps({{'modules': sorted(sys.modules), 'maxrss_kb': maxrss}}))
+"""
+
+# Loaded on demand by the AI analysis; a worker must not import them at startup
+LAZY_MODULES = ('google.generativeai', 'google.ai.generativelanguage', 'grpc', 'markdown')
+
+
+def _parse_importtime(stderr):
+    """-X importtime output -> [(cumulative_us, self_us, module)] for top-level imports"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        # Nested imports are indented further; only top-level ones add up to the total
+        if not name.startswith('  '):
+            rows.append((int(cumulative_us), int(self_us), name.strip()))
+    return rows
+
+
+class Command(BaseCommand):
+    help = 'Measure worker cold start (python -X importtime) and peak memory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=15,
+                            help='Number of slowest top-level imports to list')
+        parser.add_argument('--max-ms', type=float,
+                            help='Fail if total import time exceeds this many milliseconds')
+        parser.add_argument('--max-rss', type=float,
+                            help='Fail if peak memory exceeds this many MiB')
+        parser.add_argument('--json', action='store_true',
+                            help='Print the results as JSON')
+
+    def handle(self, *args, **options):
+        script = WORKER_SCRIPT.format(
+            settings_module=settings.SETTINGS_MODULE,
+            wsgi_application=settings.WSGI_APPLICATION,
+        )
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', script],
+            capture_output=True,
+            text=True,
+            cwd=settings.BASE_DIR,
+        )
+        if result.returncode != 0:
+            raise CommandError(f'Worker failed to start:\n{result.stderr[-2000:]}')
+
+        report = json.loads(result.stdout.strip().splitlines()[-1])
+        imports = _parse_importtime(result.stderr)
+        total_ms = sum(row[0] for row in imports) / 1000
+        rss_mb = report['maxrss_kb'] / 1024
+        lazy_loaded = [
+            name for name in report['modules']
+            if any(name == lazy or name.startswith(lazy + '.') for lazy in LAZY_MODULES)
+        ]
+        slowest = sorted(imports, reverse=True)[:options['top']]
+
+        if options['json']:
+            self.stdout.write(json.dumps({
+                'import_ms': round(total_ms, 1),
+                'rss_mb': round(rss_mb, 1),
+                'modules': len(report['modules']),
+                'lazy_modules_loaded': lazy_loaded,
+                'slowest': [
+                    {'module': name, 'cumulative_ms': round(cumulative / 1000, 1)}
+                    for cumulative, _, name in slowest
+                ],
+            }, indent=2))
+        else:
+            self.stdout.write(f'Import time: {total_ms:.0f} ms ({len(report["modules"])} modules)')
+            self.stdout.write(f'Peak memory: {rss_mb:.1f} MiB')
+            self.stdout.write('Slowest imports:')
+            for cumulative, _, name in slowest:
+                self.stdout.write(f'  {cumulative / 1000:8.1f} ms  {name}')
+
+        errors = []
+        if lazy_loaded:
+            errors.append(f'Imported at startup but should load lazily: {", ".join(sorted(lazy_loaded)[:10])}')
+        if options['max_ms'] is not None and total_ms > options['max_ms']:
+            errors.append(f'Import time {total_ms:.0f} ms exceeds {options["max_ms"]:.0f} ms')
+        if options['max_rss'] is not None and rss_mb > options['max_rss']:
+            errors.append(f'Peak memory {rss_mb:.1f} MiB exceeds {options["max_rss"]:.1f} MiB')
+        if errors:
+            raise CommandError('\n'.join(errors))
+
+        self.stdout.write(self.style.SUCCESS('✓ Startup within limits'))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from budget import anomalies
+from budget.models import Family
+
+
+class Command(BaseCommand):
+    help = 'Detect unusual spending for families whose data changed since the last run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--family', type=int, help='Only this family id')
+        parser.add_argument('--force', action='store_true',
+                            help='Detect again even if the data has not changed')
+
+    def handle(self, *args, **options):
+        families = Family.objects.all()
+        if options['family']:
+            families = families.filter(pk=options['family'])
+        if not options['force']:
+            families = families.exclude(anomaly_version=F('data_version'))
+
+        checked = flagged = 0
+        for family in families.iterator():
+            found = anomalies.refresh(family, force=options['force'])
+            if found is None:
+                continue
+            checked += 1
+            flagged += found
+
+        self.stdout.write(f'✓ Checked {checked} families, {flagged} anomalies flagged')
@@ -0,0 +1,90 @@
+import csv
+from datetime import date, timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from budget.exchange import BASE_CURRENCY, RateTable, invalidate_rate_table
+from budget.models import Currency, ExchangeRate, Family
+
+
+class Command(BaseCommand):
+    help = ('Load daily exchange rates from a CSV file with date,currency,rate columns '
+            '(units of the currency per 1 JPY); days between two rates are interpolated')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV file (header: date,currency,rate)')
+        parser.add_argument('--no-fill', action='store_true',
+                            help='Store only the days in the file')
+
+    def handle(self, *args, **options):
+        currencies = dict(Currency.objects.values_list('code', 'pk'))
+        points = self.read(options['path'], currencies)
+
+        rows = []
+        for code, series in points.items():
+            days = sorted(series)
+            if not options['no_fill']:
+                table = RateTable({}, {code: (
+                    [day.toordinal() for day in days], [float(series[day]) for day in days]
+                )})
+                day = days[0]
+                while day <= days[-1]:
+                    if day not in series:
+                        series[day] = Decimal(str(round(table.rate(code, day), 8)))
+                    day += timedelta(days=1)
+            rows.extend(
+                ExchangeRate(currency_id=currencies[code], date=day, rate=rate)
+                for day, rate in series.items()
+            )
+
+        with transaction.atomic():
+            ExchangeRate.objects.bulk_create(
+                rows, batch_size=1000, update_conflicts=True,
+                unique_fields=['currency', 'date'], update_fields=['rate'],
+            )
+            # The static rate follows the latest known one
+            for code in points:
+                latest = ExchangeRate.objects.filter(
+                    currency_id=currencies[code]
+                ).order_by('-date').values_list('rate', flat=True).first()
+                Currency.objects.filter(pk=currencies[code]).update(
+                    exchange_rate=round(latest, 4)
+                )
+            # Reports converting to or from these currencies are now stale
+            codes = list(points)
+            changed = Family.objects.filter(
+                Q(currency__code__in=codes) | Q(transactions__currency__code__in=codes)
+            ).values('pk').distinct()
+            Family.objects.filter(pk__in=changed).update(
+                data_version=F('data_version') + 1,
+                data_updated_at=timezone.now(),
+            )
+        invalidate_rate_table()
+
+        self.stdout.write(f'✓ Loaded {len(rows)} rates for {len(points)} currencies')
+
+    def read(self, path, currencies):
+        """{通貨コード: {日付: レート}}"""
+        points = {}
+        try:
+            with open(path, newline='', encoding='utf-8') as f:
+                for line, record in enumerate(csv.DictReader(f), start=2):
+                    try:
+                        day = date.fromisoformat(record['date'].strip())
+                        code = record['currency'].strip().upper()
+                        rate = Decimal(record['rate'].strip())
+                    except (KeyError, AttributeError, ValueError, InvalidOperation):
+                        raise CommandError(f'{path}:{line}: expected date,currency,rate')
+                    if code not in currencies:
+                        raise CommandError(f'{path}:{line}: unknown currency {code}')
+                    if rate <= 0:
+                        raise CommandError(f'{path}:{line}: rate must be positive')
+                    if code != BASE_CURRENCY:
+                        points.setdefault(code, {})[day] = rate
+        except OSError as e:
+            raise CommandError(f'Cannot read {path}: {e}')
+        return points
@@ -0,0 +1,78 @@
+import statistics
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+
+from budget import ai
+from budget.ai_limits import AIBusy
+
+
+class Command(BaseCommand):
+    help = 'Load-test the AI analysis path (admission control, coalescing, caching) offline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=100)
+        parser.add_argument('--concurrency', type=int, default=10)
+        parser.add_argument('--families', type=int, default=5,
+                            help='Distinct family ids the requests are spread over')
+        parser.add_argument('--distinct-prompts', type=int, default=3,
+                            help='Distinct prompts per family (fewer -> more coalescing and cache hits)')
+        parser.add_argument('--backend', default='budget.ai_backends.FakeBackend',
+                            help='Backend class to use (default: the offline fake)')
+        parser.add_argument('--latency', type=float, help='FakeBackend latency in seconds')
+        parser.add_argument('--jitter', type=float, help='FakeBackend latency jitter in seconds')
+        parser.add_argument('--failure-rate', type=float, help='FakeBackend injected failure rate')
+        parser.add_argument('--timeout-rate', type=float, help='FakeBackend injected timeout rate')
+        parser.add_argument('--seed', type=int, help='FakeBackend random seed')
+
+    def handle(self, *args, **options):
+        backend_class = import_string(options['backend'])
+        fake_options = {
+            name: options[name]
+            for name in ('latency', 'jitter', 'failure_rate', 'timeout_rate', 'seed')
+            if options[name] is not None
+        }
+        backend = backend_class(**fake_options) if fake_options else backend_class()
+
+        # A fresh run id keeps results cached by earlier runs out of the numbers
+        run_id = uuid.uuid4().hex[:8]
+        family_ids = [f'loadtest-{run_id}-{i}' for i in range(options['families'])]
+        jobs = [
+            (family_ids[i % len(family_ids)],
+             f'loadtest {run_id}\n### Prompt {i % options["distinct_prompts"]}\n- **Food**: 1\n')
+            for i in range(options['requests'])
+        ]
+
+        def run(job):
+            family_id, prompt = job
+            started = time.perf_counter()
+            try:
+                html = ai.generate_analysis(prompt, 'loadtest-key', family_id, backend=backend)
+                outcome = 'error' if 'text-red-600' in html else 'ok'
+            except AIBusy:
+                outcome = 'busy'
+            return outcome, time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            results = list(pool.map(run, jobs))
+        elapsed = time.perf_counter() - started
+
+        counts = {'ok': 0, 'busy': 0, 'error': 0}
+        for outcome, _ in results:
+            counts[outcome] += 1
+        latencies = sorted(duration for _, duration in results)
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+        self.stdout.write(f'Requests:       {len(results)} in {elapsed:.2f}s '
+                          f'({len(results) / elapsed:.1f} req/s, concurrency {options["concurrency"]})')
+        self.stdout.write(f'Outcomes:       ok {counts["ok"]}, busy {counts["busy"]}, error {counts["error"]}')
+        if hasattr(backend, 'calls'):
+            self.stdout.write(f'Upstream calls: {backend.calls}')
+        self.stdout.write(f'Latency (ms):   p50 {percentile(0.5):.0f}, p95 {percentile(0.95):.0f}, '
+                          f'max {latencies[-1] * 1000:.0f}, mean {statistics.mean(latencies) * 1000:.0f}')
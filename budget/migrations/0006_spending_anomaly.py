@@ -0,0 +1,38 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budget', '0005_family_data_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='family',
+            name='anomaly_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='SpendingAnomaly',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('large_transaction', '高額な取引'), ('monthly_spike', '月間支出の急増'), ('weekly_spike', '週間支出の急増'), ('duplicate', '重複の可能性')], max_length=20, verbose_name='種類')),
+                ('period_start', models.DateField(verbose_name='期間')),
+                ('amount', models.DecimalField(decimal_places=0, max_digits=12, verbose_name='金額')),
+                ('baseline', models.DecimalField(decimal_places=0, max_digits=12, verbose_name='通常の金額')),
+                ('score', models.FloatField(default=0)),
+                ('detected_at', models.DateTimeField(auto_now_add=True)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='budget.category', verbose_name='カテゴリー')),
+                ('family', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='anomalies', to='budget.family')),
+                ('transaction', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='budget.transaction')),
+            ],
+            options={
+                'verbose_name': '支出の異常',
+                'verbose_name_plural': '支出の異常',
+                'ordering': ['-period_start', '-score'],
+                'indexes': [models.Index(fields=['family', 'period_start'], name='budget_spen_family__0c260c_idx')],
+            },
+        ),
+    ]
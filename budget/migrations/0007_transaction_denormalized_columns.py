@@ -0,0 +1,39 @@
+from django.db import migrations, models
+from django.db.models.functions import ExtractMonth, ExtractYear
+
+
+def backfill(apps, schema_editor):
+    Transaction = apps.get_model('budget', 'Transaction')
+    Transaction.objects.update(year_month=ExtractYear('date') * 100 + ExtractMonth('date'))
+    Transaction.objects.filter(
+        transaction_type='expense', category__is_insurance_saving=True
+    ).update(is_insurance_saving=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budget', '0006_spending_anomaly'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='is_insurance_saving',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='year_month',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['family', 'year_month', 'transaction_type', 'is_insurance_saving', 'amount'], name='budget_tran_family__0a1c5a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['family', 'is_insurance_saving', 'date', 'amount'], name='budget_tran_family__f4f7b3_idx'),
+        ),
+    ]
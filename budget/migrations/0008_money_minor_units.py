@@ -0,0 +1,66 @@
+import budget.money
+from django.db import migrations
+from django.db.models import F
+
+# Amounts were whole units; they are stored as hundredths from now on
+SCALE = 100
+
+AMOUNT_FIELDS = {
+    'Budget': ['amount'],
+    'CashSaving': ['amount'],
+    'RecurringTemplate': ['amount'],
+    'SpendingAnomaly': ['amount', 'baseline'],
+    'Transaction': ['amount'],
+}
+
+
+def to_minor_units(apps, schema_editor):
+    for model_name, fields in AMOUNT_FIELDS.items():
+        apps.get_model('budget', model_name).objects.update(**{f: F(f) * SCALE for f in fields})
+
+
+def to_whole_units(apps, schema_editor):
+    # Fractions of a unit are dropped on the way back
+    for model_name, fields in AMOUNT_FIELDS.items():
+        apps.get_model('budget', model_name).objects.update(**{f: F(f) / SCALE for f in fields})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budget', '0007_transaction_denormalized_columns'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='budget',
+            name='amount',
+            field=budget.money.MoneyField(verbose_name='予算額'),
+        ),
+        migrations.AlterField(
+            model_name='cashsaving',
+            name='amount',
+            field=budget.money.MoneyField(verbose_name='金額'),
+        ),
+        migrations.AlterField(
+            model_name='recurringtemplate',
+            name='amount',
+            field=budget.money.MoneyField(verbose_name='金額'),
+        ),
+        migrations.AlterField(
+            model_name='spendinganomaly',
+            name='amount',
+            field=budget.money.MoneyField(verbose_name='金額'),
+        ),
+        migrations.AlterField(
+            model_name='spendinganomaly',
+            name='baseline',
+            field=budget.money.MoneyField(verbose_name='通常の金額'),
+        ),
+        migrations.AlterField(
+            model_name='transaction',
+            name='amount',
+            field=budget.money.MoneyField(verbose_name='金額'),
+        ),
+        migrations.RunPython(to_minor_units, to_whole_units),
+    ]
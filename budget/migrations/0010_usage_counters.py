@@ -0,0 +1,81 @@
+from datetime import datetime, timezone
+
+from django.db import migrations, models
+
+# Frozen copies of models.USAGE_EPOCH / USAGE_HALF_LIFE_DAYS
+USAGE_EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+USAGE_HALF_LIFE_DAYS = 30
+
+
+def usage_weight(moment):
+    return 2 ** ((moment - USAGE_EPOCH).total_seconds() / 86400 / USAGE_HALF_LIFE_DAYS)
+
+
+def backfill(apps, schema_editor):
+    Transaction = apps.get_model('budget', 'Transaction')
+    counters = {'Category': {}, 'PaymentMethod': {}}
+    rows = Transaction.objects.values_list('category_id', 'payment_method_id', 'created_at')
+    for category_id, payment_method_id, created_at in rows.iterator():
+        for model_name, pk in (('Category', category_id), ('PaymentMethod', payment_method_id)):
+            if pk is None:
+                continue
+            count, last_used_at, score = counters[model_name].get(pk, (0, created_at, 0.0))
+            counters[model_name][pk] = (
+                count + 1, max(last_used_at, created_at), score + usage_weight(created_at)
+            )
+
+    for model_name, values in counters.items():
+        model = apps.get_model('budget', model_name)
+        for pk, (count, last_used_at, score) in values.items():
+            model.objects.filter(pk=pk).update(
+                usage_count=count, last_used_at=last_used_at, usage_score=score
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budget', '0009_exchange_rates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='last_used_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='usage_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='usage_score',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='paymentmethod',
+            name='last_used_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='paymentmethod',
+            name='usage_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='paymentmethod',
+            name='usage_score',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(fields=['family', '-usage_score'], name='budget_cate_family__9fc238_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paymentmethod',
+            index=models.Index(fields=['family', '-usage_score'], name='budget_paym_family__f48eb9_idx'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def reseed(apps, schema_editor):
+    # The JSON models are not converted: each family is seeded again from its history
+    apps.get_model('budget', 'CategoryClassifier').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budget', '0012_category_classifier'),
+    ]
+
+    operations = [
+        migrations.RunPython(reseed, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='categoryclassifier',
+            name='data',
+        ),
+        migrations.CreateModel(
+            name='ClassifierCategory',
+            fields=[
+                ('category', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='+', serialize=False, to='budget.category')),
+                ('docs', models.PositiveIntegerField(default=0)),
+                ('family', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='budget.family')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ClassifierToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=2)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tokens', to='budget.classifiercategory')),
+            ],
+            options={
+                'unique_together': {('category', 'token')},
+            },
+        ),
+    ]
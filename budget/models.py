@@ -2,11 +2,14 @@ from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
+from django.db.models.functions import Coalesce, Greatest
 from decimal import Decimal
 import uuid
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone as dt_timezone
 from dateutil.relativedelta import relativedelta
 
+from .money import MinorSum, MoneyField, from_minor
+
 class Currency(models.Model):
     """通貨設定"""
     code = models.CharField(max_length=3, unique=True)  # JPY, EUR, USD
@@ -21,6 +24,21 @@ class Currency(models.Model):
     def __str__(self):
         return f"{self.code} ({self.symbol})"
 
+class ExchangeRate(models.Model):
+    """通貨の日次レート（基準通貨 JPY 1 あたり）"""
+    currency = models.ForeignKey(Currency, on_delete=models.CASCADE, related_name='rates')
+    date = models.DateField()
+    # Same unit as Currency.exchange_rate: units of the currency per 1 JPY
+    rate = models.DecimalField(max_digits=18, decimal_places=8)
+
+    class Meta:
+        verbose_name = "為替レート"
+        verbose_name_plural = "為替レート"
+        unique_together = ['currency', 'date']
+
+    def __str__(self):
+        return f"{self.currency.code} {self.date}: {self.rate}"
+
 class Family(models.Model):
     """家族グループ"""
     name = models.CharField(max_length=100, verbose_name=_("家族名"))
@@ -33,6 +51,32 @@ class Family(models.Model):
         verbose_name="通貨"
     )
     created_at = models.DateTimeField(auto_now_add=True)
+    # Bumped on every write to the family's data (see signals.py); used for
+    # ETag/Last-Modified and as a cache key
+    data_version = models.PositiveIntegerField(default=0, editable=False)
+    data_updated_at = models.DateTimeField(null=True, blank=True, editable=False)
+    # data_version the stored anomalies were detected at (see detect_anomalies)
+    anomaly_version = models.PositiveIntegerField(default=0, editable=False)
+
+    def save(self, *args, **kwargs):
+        # Never write back a stale in-memory data_version over a concurrent bump
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                f.name for f in self._meta.concrete_fields
+                if not f.primary_key and f.name not in ('data_version', 'data_updated_at', 'anomaly_version')
+            ]
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def bump_data_version(cls, family_id):
+        """家族データの変更を記録する"""
+        cls.objects.filter(pk=family_id).update(
+            data_version=models.F('data_version') + 1,
+            data_updated_at=timezone.now(),
+        )
+
+    def get_last_modified(self):
+        return self.data_updated_at or self.created_at
 
     def get_currency_symbol(self):
         if self.currency:
@@ -44,17 +88,15 @@ class Family(models.Model):
             return self.currency.code
         return 'JPY'
 
-    def convert_to_base(self, amount):
-        """Convert amount to base currency (JPY)"""
-        if self.currency:
-            return amount * self.currency.exchange_rate
-        return amount
-
-    def convert_from_base(self, amount):
-        """Convert from base currency to family currency"""
-        if self.currency and self.currency.exchange_rate:
-            return amount / self.currency.exchange_rate
-        return amount
+    def convert_to_base(self, amount, on=None):
+        """Convert amount to base currency (JPY), at the rate of `on` if given"""
+        from .exchange import get_rate_table
+        return get_rate_table().convert(amount, self.get_currency_code(), 'JPY', on)
+
+    def convert_from_base(self, amount, on=None):
+        """Convert from base currency to family currency, at the rate of `on` if given"""
+        from .exchange import get_rate_table
+        return get_rate_table().convert(amount, 'JPY', self.get_currency_code(), on)
     
     class Meta:
         verbose_name = _("家族")
@@ -103,7 +145,40 @@ class FamilyInvite(models.Model):
     def __str__(self):
         return f"{self.family.name} - {self.code}"
 
-class Category(models.Model):
+# Usage ranking with forward decay: each use adds
+# 2 ** (days since USAGE_EPOCH / USAGE_HALF_LIFE_DAYS), so ordering by the sum
+# orders by a score that halves every half-life, without rewriting old rows
+USAGE_EPOCH = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+USAGE_HALF_LIFE_DAYS = 30
+
+
+def usage_weight(moment):
+    return 2 ** ((moment - USAGE_EPOCH).total_seconds() / 86400 / USAGE_HALF_LIFE_DAYS)
+
+
+class UsageCounters(models.Model):
+    """取引での使用回数・最終使用日時・減衰スコア（signals.py が更新）"""
+    usage_count = models.PositiveIntegerField(default=0, editable=False)
+    last_used_at = models.DateTimeField(null=True, blank=True, editable=False)
+    usage_score = models.FloatField(default=0, editable=False)
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def record_usage(cls, pk, moment, uses=1):
+        """moment（取引の登録日時）の使用を加算（uses=-1 で取り消し）"""
+        if pk is None:
+            return
+        changes = {
+            'usage_count': Greatest(models.F('usage_count') + uses, 0),
+            'usage_score': Greatest(models.F('usage_score') + uses * usage_weight(moment), 0.0),
+        }
+        if uses > 0:
+            changes['last_used_at'] = Greatest(Coalesce('last_used_at', models.Value(moment)), models.Value(moment))
+        cls.objects.filter(pk=pk).update(**changes)
+
+class Category(UsageCounters):
     """カテゴリー"""
     CATEGORY_TYPES = [
         ('expense', _('支出')),
@@ -119,16 +194,25 @@ class Category(models.Model):
     )
     icon = models.CharField(max_length=50, blank=True, verbose_name=_("アイコン"))
     family = models.ForeignKey(Family, on_delete=models.CASCADE, related_name='categories')
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name = _("カテゴリー")
         verbose_name_plural = _("カテゴリー")
         unique_together = ['name', 'family']
+        indexes = [models.Index(fields=['family', '-usage_score'])]
 
     def __str__(self):
         return f"{self.name} ({self.get_category_type_display()})"
 
-class PaymentMethod(models.Model):
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        # Keep the copy on the category's transactions in step
+        Transaction.objects.filter(category=self, transaction_type='expense').exclude(
+            is_insurance_saving=self.is_insurance_saving
+        ).update(is_insurance_saving=self.is_insurance_saving)
+
+class PaymentMethod(UsageCounters):
     """支払方法"""
     METHOD_TYPES = [
         ('cash', _('現金')),
@@ -142,14 +226,20 @@ class PaymentMethod(models.Model):
     name = models.CharField(max_length=50, verbose_name=_("支払方法名"))
     method_type = models.CharField(max_length=10, choices=METHOD_TYPES, verbose_name=_("種類"))
     family = models.ForeignKey(Family, on_delete=models.CASCADE, related_name='payment_methods')
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name = _("支払方法")
         verbose_name_plural = _("支払方法")
+        indexes = [models.Index(fields=['family', '-usage_score'])]
 
     def __str__(self):
         return self.name
 
+def to_year_month(day):
+    """日付 → Transaction.year_month の値（2026年10月 → 202610）"""
+    return day.year * 100 + day.month
+
 class Transaction(models.Model):
     """収支取引"""
     TRANSACTION_TYPES = [
@@ -161,12 +251,22 @@ class Transaction(models.Model):
     member = models.ForeignKey('FamilyMember', on_delete=models.SET_NULL, null=True, verbose_name=_("登録者"))
     transaction_type = models.CharField(max_length=10, choices=TRANSACTION_TYPES, verbose_name=_("種類"))
     category = models.ForeignKey(Category, on_delete=models.PROTECT, verbose_name=_("カテゴリー"))
-    amount = models.DecimalField(max_digits=10, decimal_places=0, verbose_name=_("金額"))
+    amount = MoneyField(verbose_name=_("金額"))
+    # None = in the family's currency
+    currency = models.ForeignKey(
+        Currency, on_delete=models.PROTECT, null=True, blank=True,
+        related_name='+', verbose_name=_("通貨")
+    )
     payment_method = models.ForeignKey(PaymentMethod, on_delete=models.SET_NULL, null=True, blank=True, verbose_name=_("支払方法"))
     date = models.DateField(default=timezone.now, verbose_name=_("日付"))
     description = models.CharField(max_length=200, blank=True, verbose_name=_("メモ"))
     receipt_image = models.ImageField(upload_to='receipts/%Y/%m/', blank=True, null=True, verbose_name=_("レシート"))
     is_recurring = models.BooleanField(default=False, verbose_name=_("固定費"))
+    # Copies of category.is_insurance_saving (expenses only) and of the date's
+    # year * 100 + month, so the hot aggregates read this table alone. Set in
+    # save() and kept in step by Category.save().
+    is_insurance_saving = models.BooleanField(default=False, editable=False)
+    year_month = models.PositiveIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -174,31 +274,65 @@ class Transaction(models.Model):
         verbose_name = _("取引")
         verbose_name_plural = _("取引")
         ordering = ['-date', '-created_at']
+        indexes = [
+            models.Index(fields=['family', 'updated_at']),
+            # Covering indexes for the monthly totals and the savings totals
+            models.Index(fields=['family', 'year_month', 'transaction_type', 'is_insurance_saving', 'amount']),
+            models.Index(fields=['family', 'is_insurance_saving', 'date', 'amount']),
+        ]
 
     def __str__(self):
         return f"{self.date} - {self.category.name}: ¥{self.amount:,}"
 
-    def is_insurance_saving(self):
-        """保険型積立かどうか"""
-        return self.transaction_type == 'expense' and self.category.is_insurance_saving
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Category and payment method as loaded, so a save can move the usage
+        # counters (see signals.py)
+        instance._loaded_usage = (
+            instance.__dict__.get('category_id'), instance.__dict__.get('payment_method_id')
+        )
+        # Memo and category as loaded, so the category classifier can unlearn
+        # them (None when either was deferred)
+        if 'description' in instance.__dict__ and 'category_id' in instance.__dict__:
+            instance._loaded_memo = (instance.description, instance.category_id)
+        else:
+            instance._loaded_memo = None
+        return instance
+
+    def save(self, *args, **kwargs):
+        self.set_denormalized_fields()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'is_insurance_saving', 'year_month'}
+        super().save(*args, **kwargs)
+
+    def set_denormalized_fields(self):
+        """カテゴリー・日付から is_insurance_saving と year_month を設定"""
+        self.year_month = to_year_month(self._meta.get_field('date').to_python(self.date))
+        self.is_insurance_saving = self.transaction_type == 'expense' and self.category.is_insurance_saving
 
     def contributes_to_savings(self):
         """長期貯蓄に寄与するか（保険型積立の場合）"""
-        return self.is_insurance_saving()
+        return self.is_insurance_saving
 
 class CashSaving(models.Model):
     """現金貯蓄（貯金）"""
     family = models.ForeignKey(Family, on_delete=models.CASCADE, related_name='cash_savings')
     member = models.ForeignKey('FamilyMember', on_delete=models.SET_NULL, null=True, verbose_name=_("登録者"))
-    amount = models.DecimalField(max_digits=10, decimal_places=0, verbose_name=_("金額"))
+    amount = MoneyField(verbose_name=_("金額"))
     date = models.DateField(default=timezone.now, verbose_name=_("日付"))
     description = models.CharField(max_length=200, blank=True, verbose_name=_("メモ"))
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name = _("現金貯蓄")
         verbose_name_plural = _("現金貯蓄")
         ordering = ['-date', '-created_at']
+        indexes = [
+            models.Index(fields=['family', 'updated_at']),
+        ]
 
     def __str__(self):
         return f"{self.date} - 貯金: ¥{self.amount:,}"
@@ -209,7 +343,8 @@ class Budget(models.Model):
     category = models.ForeignKey(Category, on_delete=models.CASCADE, verbose_name=_("カテゴリー"))
     year = models.IntegerField(verbose_name=_("年"))
     month = models.IntegerField(verbose_name=_("月"))
-    amount = models.DecimalField(max_digits=10, decimal_places=0, verbose_name=_("予算額"))
+    amount = MoneyField(verbose_name=_("予算額"))
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name = _("予算")
@@ -219,15 +354,27 @@ class Budget(models.Model):
     def __str__(self):
         return f"{self.year}/{self.month} - {self.category.name}: ¥{self.amount:,}"
 
+    # Set for a whole list by the views (see used_amounts()), else on first use
+    used_amount = None
+
+    @classmethod
+    def used_amounts(cls, family, year, month, category_ids):
+        """カテゴリーごとの使用額（家族の通貨、1クエリ）"""
+        from .exchange import family_amount
+        totals = Transaction.objects.filter(
+            family=family,
+            category__in=category_ids,
+            year_month=year * 100 + month
+        ).values('category').annotate(
+            total=MinorSum(family_amount(family))
+        ).values_list('category', 'total').order_by()
+        return {category_id: from_minor(total or 0) for category_id, total in totals}
+
     def get_used_amount(self):
-        from django.db.models import Sum
-        result = Transaction.objects.filter(
-            family=self.family,
-            category=self.category,
-            date__year=self.year,
-            date__month=self.month
-        ).aggregate(total=Sum('amount'))
-        return result['total'] or Decimal('0')
+        if self.used_amount is None:
+            used = Budget.used_amounts(self.family, self.year, self.month, [self.category_id])
+            self.used_amount = used.get(self.category_id, Decimal('0'))
+        return self.used_amount
 
     def get_remaining_amount(self):
         return self.amount - self.get_used_amount()
@@ -250,7 +397,7 @@ class RecurringTemplate(models.Model):
     member = models.ForeignKey('FamilyMember', on_delete=models.SET_NULL, null=True)
     transaction_type = models.CharField(max_length=10, choices=Transaction.TRANSACTION_TYPES, verbose_name=_("種類"))
     category = models.ForeignKey(Category, on_delete=models.PROTECT, verbose_name=_("カテゴリー"))
-    amount = models.DecimalField(max_digits=10, decimal_places=0, verbose_name=_("金額"))
+    amount = MoneyField(verbose_name=_("金額"))
     payment_method = models.ForeignKey(PaymentMethod, on_delete=models.SET_NULL, null=True, blank=True, verbose_name=_("支払方法"))
     description = models.CharField(max_length=200, blank=True, verbose_name=_("メモ"))
     # Recurring settings
@@ -333,6 +480,87 @@ class RecurringTemplate(models.Model):
 
         return transaction
 
+class Tombstone(models.Model):
+    """削除記録（同期API用）"""
+    family = models.ForeignKey(Family, on_delete=models.CASCADE, related_name='tombstones')
+    model_name = models.CharField(max_length=30)
+    object_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = _("削除記録")
+        verbose_name_plural = _("削除記録")
+        indexes = [
+            models.Index(fields=['family', 'deleted_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.model_name}#{self.object_id} ({self.deleted_at:%Y-%m-%d %H:%M})"
+
+class SpendingAnomaly(models.Model):
+    """検出された異常な支出（detect_anomalies コマンドが一括で計算）"""
+    KIND_CHOICES = [
+        ('large_transaction', _('高額な取引')),
+        ('monthly_spike', _('月間支出の急増')),
+        ('weekly_spike', _('週間支出の急増')),
+        ('duplicate', _('重複の可能性')),
+    ]
+
+    family = models.ForeignKey(Family, on_delete=models.CASCADE, related_name='anomalies')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, verbose_name=_("種類"))
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, verbose_name=_("カテゴリー"))
+    transaction = models.ForeignKey(Transaction, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    # Transaction date, or the first day of the month / week
+    period_start = models.DateField(verbose_name=_("期間"))
+    amount = MoneyField(verbose_name=_("金額"))
+    baseline = MoneyField(verbose_name=_("通常の金額"))
+    score = models.FloatField(default=0)
+    detected_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = _("支出の異常")
+        verbose_name_plural = _("支出の異常")
+        ordering = ['-period_start', '-score']
+        indexes = [
+            models.Index(fields=['family', 'period_start']),
+        ]
+
+    def __str__(self):
+        return f"{self.period_start} - {self.category.name}: {self.get_kind_display()}"
+
+class AmountSuggestion(models.Model):
+    """プリセット入力の金額候補（家族・カテゴリー・メンバーごと、取引の登録で更新）"""
+    family = models.ForeignKey(Family, on_delete=models.CASCADE, related_name='+')
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='+')
+    member = models.ForeignKey(FamilyMember, on_delete=models.CASCADE, related_name='+')
+    # {'counts': {minor units: [uses, overestimate]}, 'recent': [minor units], 'methods': {id: uses}}
+    # (see suggestions.py)
+    data = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['family', 'category', 'member']
+
+class CategoryClassifier(models.Model):
+    """メモからカテゴリーを推定するモデル（家族ごと、行があれば履歴から作成済み）"""
+    family = models.OneToOneField(Family, on_delete=models.CASCADE, related_name='+')
+    updated_at = models.DateTimeField(auto_now=True)
+
+class ClassifierCategory(models.Model):
+    """カテゴリーごとの学習済みメモ数（classifier.py）"""
+    category = models.OneToOneField(Category, on_delete=models.CASCADE, primary_key=True, related_name='+')
+    family = models.ForeignKey(Family, on_delete=models.CASCADE, related_name='+')
+    docs = models.PositiveIntegerField(default=0)
+
+class ClassifierToken(models.Model):
+    """カテゴリーごとのトークンの出現回数（classifier.py）"""
+    category = models.ForeignKey(ClassifierCategory, on_delete=models.CASCADE, related_name='tokens')
+    token = models.CharField(max_length=2)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ['category', 'token']
+
 class EmailNotificationSettings(models.Model):
     """メール通知設定"""
     family = models.OneToOneField(Family, on_delete=models.CASCADE, related_name='email_settings')
@@ -0,0 +1,129 @@
+"""Money stored as integer minor units.
+
+Amounts are stored as BIGINT hundredths whatever the family's currency:
+two decimals hold EUR/USD cents, and zero-decimal currencies such as JPY are
+whole numbers times SCALE. A family switching currency keeps its numbers, as
+before.
+
+* MoneyField reads and writes Decimal values with two decimal places, so
+  forms, templates and model code keep working with Decimal.
+* MinorSum sums in SQL and returns the raw integer, which skips the Decimal
+  conversion of every row on SQLite. Hot aggregates use it and stay in
+  integer arithmetic until to_number() / from_minor() at the edge.
+* format_amount() shows an amount with its currency's own number of
+  decimals, and validate_currency_decimals() keeps forms from accepting
+  more decimals than the currency has (no ¥10.50), so nothing entered is
+  rounded away on display.
+"""
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+from django import forms
+from django.core import exceptions
+from django.db import models
+from django.db.models import Sum, lookups
+from django.utils.translation import gettext_lazy as _
+
+# Minor units per major unit, and the decimals they allow
+SCALE = 100
+DECIMALS = 2
+
+# ISO 4217 decimals of the currencies that don't use two
+CURRENCY_DECIMALS = {'JPY': 0, 'KRW': 0}
+
+
+def to_minor(value):
+    """金額（Decimal・int・float・文字列）→ 最小単位の整数（0.005 は切り上げ）"""
+    if isinstance(value, int):
+        return value * SCALE
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value))
+    return int((value * SCALE).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def from_minor(minor):
+    """最小単位の整数 → Decimal（小数2桁）"""
+    return Decimal(minor).scaleb(-DECIMALS)
+
+
+def to_number(minor):
+    """最小単位の整数 → JSON・グラフ用の数値（端数がなければ int）"""
+    whole, rest = divmod(minor, SCALE)
+    return whole if not rest else minor / SCALE
+
+
+def currency_decimals(code):
+    return CURRENCY_DECIMALS.get(code, DECIMALS)
+
+
+def amount_step(code):
+    """金額入力の step（通貨の最小単位、JPY は 1）"""
+    return str(Decimal(1).scaleb(-currency_decimals(code)))
+
+
+def validate_currency_decimals(value, code):
+    """通貨の小数桁を超える金額を ValidationError にする"""
+    decimals = currency_decimals(code)
+    if value == value.quantize(Decimal(1).scaleb(-decimals)):
+        return
+    if decimals:
+        message = _('%(code)s の金額は小数%(decimals)s桁までです')
+    else:
+        message = _('%(code)s の金額に小数は使えません')
+    raise exceptions.ValidationError(
+        message, code='currency_decimals', params={'code': code, 'decimals': decimals},
+    )
+
+
+def format_amount(value, code=None):
+    """3桁区切りの表示（通貨の小数桁、通貨が不明なら端数がある時だけ小数）"""
+    minor = to_minor(value)
+    if code is not None:
+        decimals = currency_decimals(code)
+    else:
+        decimals = DECIMALS if minor % SCALE else 0
+    # Round half up like to_minor(); the format spec alone would round half to even
+    shown = from_minor(minor).quantize(Decimal(1).scaleb(-decimals), rounding=ROUND_HALF_UP)
+    return f"{shown:,.{decimals}f}"
+
+
+class MoneyField(models.BigIntegerField):
+    """金額（DB には最小単位の整数、Python では小数2桁の Decimal）"""
+    description = _("Amount stored in minor units")
+
+    def from_db_value(self, value, expression, connection):
+        return None if value is None else from_minor(value)
+
+    def to_python(self, value):
+        if value is None:
+            return value
+        try:
+            return from_minor(to_minor(value))
+        except (InvalidOperation, TypeError, ValueError):
+            raise exceptions.ValidationError(
+                self.error_messages['invalid'], code='invalid', params={'value': value},
+            )
+
+    def get_prep_value(self, value):
+        if value is None or hasattr(value, 'resolve_expression'):
+            return value
+        return to_minor(self.to_python(value))
+
+    def formfield(self, **kwargs):
+        # Entered as a decimal number, not as minor units
+        return models.Field.formfield(self, **{
+            'form_class': forms.DecimalField,
+            'max_digits': 15,
+            'decimal_places': DECIMALS,
+            **kwargs,
+        })
+
+
+# IntegerField rounds float arguments of these lookups up to whole numbers;
+# amounts are converted by get_prep_value instead
+MoneyField.register_lookup(lookups.GreaterThanOrEqual)
+MoneyField.register_lookup(lookups.LessThan)
+
+
+def MinorSum(expression, **extra):
+    """最小単位の整数のままの合計（Decimal への変換なし）"""
+    return Sum(expression, output_field=models.BigIntegerField(), **extra)
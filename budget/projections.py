@@ -0,0 +1,170 @@
+"""Occurrence calendar for recurring templates.
+
+The dates follow RecurringTemplate.get_next_date() / should_generate(), the
+rules the generator uses:
+
+* the schedule continues from last_generated, or from start_date before the
+  first generation (start_date itself is not an occurrence);
+* occurrence k is k steps on: days for daily/weekly; for monthly, the next
+  month on day_of_month (28 when the month is shorter), or without
+  day_of_month on the previous day clamped to the month end, so the day never
+  grows back; for yearly the same day a year on (29 February becomes 28);
+* nothing after end_date;
+* a template already due is generated on the day it is looked at (today),
+  and continues from there.
+
+Occurrence k is computed directly rather than by stepping, so
+monthly_totals() counts each month of a 60-year forecast with a few index
+computations per template, without expanding the dates.
+"""
+import calendar
+from collections import namedtuple
+from datetime import date, timedelta
+
+from dateutil.relativedelta import relativedelta
+
+from .models import RecurringTemplate
+from .money import to_minor
+
+DAY_STEPS = {'daily': 1, 'weekly': 7}
+MONTH_STEPS = {'monthly': 1, 'yearly': 12}
+
+# Every 48 consecutive months include a 28-day February
+CLAMP_MONTHS = 48
+
+Occurrence = namedtuple('Occurrence', 'date template amount')
+
+
+def _month_index(d):
+    return d.year * 12 + d.month - 1
+
+
+def _month_length(month_index):
+    year, month = divmod(month_index, 12)
+    return calendar.monthrange(year, month + 1)[1]
+
+
+def _in_month(month_index, day):
+    year, month = divmod(month_index, 12)
+    return date(year, month + 1, day)
+
+
+class Schedule:
+    """1つのテンプレートの発生日（anchor から k 回目を直接計算）"""
+
+    def __init__(self, template, today):
+        self.frequency = template.frequency
+        self.day_of_month = template.day_of_month
+        self.end_date = template.end_date
+        self.anchor = template.last_generated or template.start_date
+        self.due = None
+        if self.frequency not in DAY_STEPS and self.frequency not in MONTH_STEPS:
+            self.frequency = None
+        elif self.nth(1) < today and (self.end_date is None or today <= self.end_date):
+            # Overdue: generated today, and the schedule goes on from today
+            self.due = today
+            self.anchor = today
+
+    def nth(self, k):
+        """anchor から k 回目（k >= 1）の発生日"""
+        if self.frequency in DAY_STEPS:
+            return self.anchor + timedelta(days=k * DAY_STEPS[self.frequency])
+
+        month = _month_index(self.anchor) + k * MONTH_STEPS[self.frequency]
+        if self.frequency == 'yearly':
+            day = 28 if (self.anchor.month, self.anchor.day) == (2, 29) else self.anchor.day
+        elif self.day_of_month:
+            day = self.day_of_month if self.day_of_month <= _month_length(month) else 28
+        else:
+            day = self.anchor.day
+            if day > 28:
+                first = _month_index(self.anchor) + 1
+                for i in range(first, first + min(k, CLAMP_MONTHS)):
+                    day = min(day, _month_length(i))
+        return _in_month(month, day)
+
+    def first_index(self, d):
+        """d 以降で最初の発生の k"""
+        if self.frequency in DAY_STEPS:
+            k = -(-(d - self.anchor).days // DAY_STEPS[self.frequency])
+        else:
+            k = -(-(_month_index(d) - _month_index(self.anchor)) // MONTH_STEPS[self.frequency])
+            if k >= 1 and self.nth(k) < d:
+                k += 1
+        return max(k, 1)
+
+    def last_index(self, d):
+        """d 以前で最後の発生の k（なければ 0）"""
+        if self.end_date and self.end_date < d:
+            d = self.end_date
+        if self.frequency in DAY_STEPS:
+            k = (d - self.anchor).days // DAY_STEPS[self.frequency]
+        else:
+            k = (_month_index(d) - _month_index(self.anchor)) // MONTH_STEPS[self.frequency]
+            if k >= 1 and self.nth(k) > d:
+                k -= 1
+        return max(k, 0)
+
+    def count(self, start, end):
+        """start〜end（両端を含む）の発生回数"""
+        if self.frequency is None or start > end:
+            return 0
+        due = 1 if self.due is not None and start <= self.due <= end else 0
+        return due + max(self.last_index(end) - self.first_index(start) + 1, 0)
+
+    def dates(self, start, end):
+        """start〜end（両端を含む）の発生日"""
+        if self.frequency is None or start > end:
+            return []
+        dates = [self.due] if self.due is not None and start <= self.due <= end else []
+        dates.extend(self.nth(k) for k in range(self.first_index(start), self.last_index(end) + 1))
+        return dates
+
+
+def template_dates(template, start, end):
+    """テンプレートの start（今日）〜end の発生日"""
+    if not template.is_active:
+        return []
+    return Schedule(template, start).dates(start, end)
+
+
+def active_templates(family):
+    return list(RecurringTemplate.objects.filter(
+        family=family, is_active=True
+    ).select_related('category'))
+
+
+def project(templates, start, end):
+    """start（今日）〜end の発生予定（日付順）"""
+    occurrences = [
+        Occurrence(d, template, template.amount)
+        for template in templates
+        for d in template_dates(template, start, end)
+    ]
+    occurrences.sort(key=lambda occurrence: occurrence.date)
+    return occurrences
+
+
+def monthly_totals(templates, start, months):
+    """start（今日）から1ヶ月ごとの区間の固定収入・固定支出・保険積立（最小単位の整数）
+
+    Returns a list of ``months`` dicts; entry i covers
+    [start + i months, start + i + 1 months).
+    """
+    if months < 1:
+        return []
+    boundaries = [start + relativedelta(months=i) for i in range(months + 1)]
+    totals = [{'income': 0, 'expense': 0, 'insurance': 0} for _ in range(months)]
+
+    for template in templates:
+        if not template.is_active:
+            continue
+        schedule = Schedule(template, start)
+        amount = to_minor(template.amount)
+        for i, bucket in enumerate(totals):
+            count = schedule.count(boundaries[i], boundaries[i + 1] - timedelta(days=1))
+            if count:
+                bucket[template.transaction_type] += count * amount
+                if template.category.is_insurance_saving:
+                    bucket['insurance'] += count * amount
+    return totals
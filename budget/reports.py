@@ -0,0 +1,184 @@
+"""Annual category x month report.
+
+One grouped query returns the actuals per (category, month) for the year and
+the year before; they are pivoted in memory into 12-month rows. Budgets are
+laid over the same rows, and every total, variance, year-over-year delta and
+the CSV export are derived from that one matrix. The matrix is computed in
+integer minor units and turned into plain numbers at the end. Transactions
+entered in another currency are converted to the family's at the rate of
+their date, in the same query (see exchange.family_amount()).
+"""
+import csv
+from datetime import date
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.functions import TruncMonth
+from django.utils.dates import MONTHS_3
+from django.utils.text import capfirst
+from django.utils.translation import gettext as _
+
+from .conditional import family_cache_key
+from .exchange import family_amount
+from .models import Budget, Transaction
+from .money import MinorSum, to_minor, to_number
+
+REPORT_TIMEOUT = getattr(settings, 'REPORT_CACHE_SECONDS', 60 * 60)
+
+MONTHS = range(1, 13)
+
+# Keys of rows and column totals that hold amounts
+AMOUNT_KEYS = (
+    'actual', 'previous', 'budget', 'variance', 'total', 'previous_total',
+    'budget_total', 'variance_total', 'yoy_delta', 'net', 'net_total',
+)
+
+
+def _percent(current, previous):
+    return round((current - previous) / previous * 100, 1) if previous else None
+
+
+def _row(name, category_type):
+    return {
+        'category': name,
+        'type': category_type,
+        'actual': [0] * 12,
+        'previous': [0] * 12,
+        'budget': [None] * 12,
+    }
+
+
+def _finish_row(row):
+    actual, budget = row['actual'], row['budget']
+    row['variance'] = [b - a if b is not None else None for a, b in zip(actual, budget)]
+    row['total'] = sum(actual)
+    row['previous_total'] = sum(row['previous'])
+    budgeted = [i for i, b in enumerate(budget) if b is not None]
+    row['budget_total'] = sum(budget[i] for i in budgeted) if budgeted else None
+    # Only months that have a budget count towards the variance
+    row['variance_total'] = sum(row['variance'][i] for i in budgeted) if budgeted else None
+    row['yoy_delta'] = row['total'] - row['previous_total']
+    row['yoy_percent'] = _percent(row['total'], row['previous_total'])
+    return row
+
+
+def _to_numbers(entry):
+    for key in AMOUNT_KEYS:
+        if key not in entry:
+            continue
+        value = entry[key]
+        if isinstance(value, list):
+            entry[key] = [None if v is None else to_number(v) for v in value]
+        elif value is not None:
+            entry[key] = to_number(value)
+    return entry
+
+
+def _column_totals(rows):
+    actual = [sum(column) for column in zip(*(row['actual'] for row in rows))] or [0] * 12
+    previous = [sum(column) for column in zip(*(row['previous'] for row in rows))] or [0] * 12
+    return {
+        'actual': actual,
+        'previous': previous,
+        'total': sum(actual),
+        'previous_total': sum(previous),
+        'yoy_delta': sum(actual) - sum(previous),
+        'yoy_percent': _percent(sum(actual), sum(previous)),
+    }
+
+
+def annual_report(family, year):
+    """year 年のカテゴリー×月の実績・予算・差異・前年比"""
+    actuals = Transaction.objects.filter(
+        family=family,
+        date__gte=date(year - 1, 1, 1),
+        date__lt=date(year + 1, 1, 1)
+    ).annotate(month=TruncMonth('date')).values(
+        'month', 'category_id', 'category__name', 'category__category_type'
+    ).annotate(total=MinorSum(family_amount(family))).order_by()
+
+    budgets = Budget.objects.filter(family=family, year=year).values_list(
+        'category_id', 'category__name', 'category__category_type', 'month', 'amount'
+    )
+
+    matrix = {}
+    for entry in actuals:
+        row = matrix.setdefault(entry['category_id'], _row(
+            entry['category__name'], entry['category__category_type']
+        ))
+        series = row['actual'] if entry['month'].year == year else row['previous']
+        series[entry['month'].month - 1] += entry['total']
+    for category_id, name, category_type, month, amount in budgets:
+        row = matrix.setdefault(category_id, _row(name, category_type))
+        row['budget'][month - 1] = to_minor(amount)
+
+    rows = sorted(
+        (_finish_row(row) for row in matrix.values()),
+        key=lambda row: (row['type'] != 'income', -row['total'], row['category'])
+    )
+    income_rows = [row for row in rows if row['type'] == 'income']
+    expense_rows = [row for row in rows if row['type'] == 'expense']
+    income = _column_totals(income_rows)
+    expense = _column_totals(expense_rows)
+
+    net = [i - e for i, e in zip(income['actual'], expense['actual'])]
+    net_total = income['total'] - expense['total']
+    for entry in (*rows, income, expense):
+        _to_numbers(entry)
+
+    return _to_numbers({
+        'year': year,
+        'months': list(MONTHS),
+        'rows': rows,
+        'income_rows': income_rows,
+        'expense_rows': expense_rows,
+        'income': income,
+        'expense': expense,
+        'net': net,
+        'net_total': net_total,
+    })
+
+
+def get_annual_report(request, family, year):
+    """annual_report() をデータバージョン単位でキャッシュ"""
+    cache_key = family_cache_key(request, 'annual-report', year)
+    report = cache.get(cache_key)
+    if report is None:
+        report = annual_report(family, year)
+        cache.set(cache_key, report, REPORT_TIMEOUT)
+    return report
+
+
+def month_labels():
+    return [capfirst(MONTHS_3[month]) for month in MONTHS]
+
+
+def write_csv(report, file):
+    """レポートを CSV で書き出す（行・列の合計と前年比を含む）"""
+    writer = csv.writer(file)
+    writer.writerow([
+        _('カテゴリー'), _('種類'), *month_labels(),
+        _('合計'), _('予算'), _('予算差異'), _('前年'), _('前年比'),
+    ])
+
+    type_labels = {'income': _('収入'), 'expense': _('支出')}
+    for row in report['rows']:
+        writer.writerow([
+            row['category'], type_labels.get(row['type'], row['type']), *row['actual'],
+            row['total'],
+            '' if row['budget_total'] is None else row['budget_total'],
+            '' if row['variance_total'] is None else row['variance_total'],
+            row['previous_total'],
+            row['yoy_delta'],
+        ])
+
+    for label, totals in ((_('収入合計'), report['income']), (_('支出合計'), report['expense'])):
+        writer.writerow([
+            label, '', *totals['actual'], totals['total'], '', '',
+            totals['previous_total'], totals['yoy_delta'],
+        ])
+    writer.writerow([
+        _('収支'), '', *report['net'], report['net_total'], '', '',
+        report['income']['previous_total'] - report['expense']['previous_total'],
+        report['net_total'] - (report['income']['previous_total'] - report['expense']['previous_total']),
+    ])
@@ -3,9 +3,15 @@ from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from .models import Family, FamilyMember, Category, PaymentMethod, Budget, Transaction, FamilyInvite,Currency
 from django import forms
+from django.db.models import ProtectedError
 import uuid
+from decimal import Decimal
 from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
+from .conditional import conditional_page
+from .family_context import family_required, get_family_member
+from .forms import AmountForm, CurrencyAmountMixin
+from .money import amount_step
 
 class CategoryForm(forms.ModelForm):
     """カテゴリーフォーム"""
@@ -56,13 +62,10 @@ class PaymentMethodForm(forms.ModelForm):
         }
 
 @login_required
+@family_required
 def family_members(request):
     """家族メンバー管理"""
-    try:
-        member = request.user.familymember
-        family = member.family
-    except FamilyMember.DoesNotExist:
-        return redirect('setup_profile')
+    family = request.family
 
     members = FamilyMember.objects.filter(family=family)
     active_invites = FamilyInvite.objects.filter(
@@ -79,13 +82,11 @@ def family_members(request):
     return render(request, 'budget/family_members.html', context)
 
 @login_required
+@family_required
 def create_invite(request):
     """招待コード作成"""
-    try:
-        member = request.user.familymember
-        family = member.family
-    except FamilyMember.DoesNotExist:
-        return redirect('setup_profile')
+    member = request.member
+    family = request.family
 
     if request.method == 'POST':
         invite = FamilyInvite.objects.create(
@@ -98,13 +99,10 @@ def create_invite(request):
     return render(request, 'budget/create_invite.html')
 
 @login_required
+@family_required
 def delete_invite(request, invite_id):
     """招待削除"""
-    try:
-        member = request.user.familymember
-        family = member.family
-    except FamilyMember.DoesNotExist:
-        return redirect('setup_profile')
+    family = request.family
 
     invite = get_object_or_404(FamilyInvite, id=invite_id, family=family)
 
@@ -117,13 +115,11 @@ def delete_invite(request, invite_id):
     return render(request, 'budget/delete_invite.html', context)
 
 @login_required
+@family_required
+@conditional_page
 def manage_categories(request):
     """カテゴリー管理"""
-    try:
-        member = request.user.familymember
-        family = member.family
-    except FamilyMember.DoesNotExist:
-        return redirect('setup_profile')
+    family = request.family
 
     categories = Category.objects.filter(family=family).order_by('category_type', 'name')
 
@@ -133,13 +129,10 @@ def manage_categories(request):
     return render(request, 'budget/manage_categories.html', context)
 
 @login_required
+@family_required
 def add_category(request):
     """カテゴリー追加"""
-    try:
-        member = request.user.familymember
-        family = member.family
-    except FamilyMember.DoesNotExist:
-        return redirect('setup_profile')
+    family = request.family
 
     if request.method == 'POST':
         form = CategoryForm(request.POST)
@@ -156,13 +149,10 @@ def add_category(request):
     return render(request, 'budget/add_category.html', context)
 
 @login_required
+@family_required
 def edit_category(request, category_id):
     """カテゴリー編集"""
-    try:
-        member = request.user.familymember
-        family = member.family
-    except FamilyMember.DoesNotExist:
-        return redirect('setup_profile')
+    family = request.family
 
     category = get_object_or_404(Category, id=category_id, family=family)
 
@@ -182,41 +172,45 @@ def edit_category(request, category_id):
     return render(request, 'budget/edit_category.html', context)
 
 @login_required
+@family_required
 def delete_category(request, category_id):
     """カテゴリー削除"""
-    try:
-        member = request.user.familymember
-        family = member.family
-    except FamilyMember.DoesNotExist:
-        return redirect('setup_profile')
+    family = request.family
 
     category = get_object_or_404(Category, id=category_id, family=family)
 
-    # 使用中かチェック
-    transaction_count = Transaction.objects.filter(category=category).count()
+    # 使用中かチェック（判定は取引の有無、usage_count は件数の表示だけ）
+    in_use = Transaction.objects.filter(category=category).exists()
+    transaction_count = category.usage_count
 
     if request.method == 'POST':
-        if transaction_count > 0:
-            messages.error(request, _('⚠️ このカテゴリーは取引で使用されているため削除できません'))
-        else:
-            category.delete()
+        deleted = False
+        if not in_use:
+            try:
+                category.delete()
+                deleted = True
+            except ProtectedError:
+                # Used by a transaction saved meanwhile
+                pass
+        if deleted:
             messages.success(request, _('✓ カテゴリーを削除しました'))
+        else:
+            messages.error(request, _('⚠️ このカテゴリーは取引で使用されているため削除できません'))
         return redirect('manage_categories')
 
     context = {
         'category': category,
+        'in_use': in_use,
         'transaction_count': transaction_count
     }
     return render(request, 'budget/delete_category.html', context)
 
 @login_required
+@family_required
+@conditional_page
 def manage_payment_methods(request):
     """支払方法管理"""
-    try:
-        member = request.user.familymember
-        family = member.family
-    except FamilyMember.DoesNotExist:
-        return redirect('setup_profile')
+    family = request.family
 
     payment_methods = PaymentMethod.objects.filter(family=family).order_by('method_type', 'name')
 
@@ -226,13 +220,10 @@ def manage_payment_methods(request):
     return render(request, 'budget/manage_payment_methods.html', context)
 
 @login_required
+@family_required
 def add_payment_method(request):
     """支払方法追加"""
-    try:
-        member = request.user.familymember
-        family = member.family
-    except FamilyMember.DoesNotExist:
-        return redirect('setup_profile')
+    family = request.family
 
     if request.method == 'POST':
         form = PaymentMethodForm(request.POST)
@@ -249,13 +240,10 @@ def add_payment_method(request):
     return render(request, 'budget/add_payment_method.html', context)
 
 @login_required
+@family_required
 def edit_payment_method(request, method_id):
     """支払方法編集"""
-    try:
-        member = request.user.familymember
-        family = member.family
-    except FamilyMember.DoesNotExist:
-        return redirect('setup_profile')
+    family = request.family
 
     method = get_object_or_404(PaymentMethod, id=method_id, family=family)
 
@@ -275,21 +263,19 @@ def edit_payment_method(request, method_id):
     return render(request, 'budget/edit_payment_method.html', context)
 
 @login_required
+@family_required
 def delete_payment_method(request, method_id):
     """支払方法削除"""
-    try:
-        member = request.user.familymember
-        family = member.family
-    except FamilyMember.DoesNotExist:
-        return redirect('setup_profile')
+    family = request.family
 
     method = get_object_or_404(PaymentMethod, id=method_id, family=family)
 
-    # 使用中かチェック
-    transaction_count = Transaction.objects.filter(payment_method=method).count()
+    # 使用中かチェック（SET_NULL なので、カウンターがずれていても取引から判定）
+    in_use = Transaction.objects.filter(payment_method=method).exists()
+    transaction_count = method.usage_count
 
     if request.method == 'POST':
-        if transaction_count > 0:
+        if in_use:
             messages.error(request, _('⚠️ この支払方法は取引で使用されているため削除できません'))
         else:
             method.delete()
@@ -298,6 +284,7 @@ def delete_payment_method(request, method_id):
 
     context = {
         'method': method,
+        'in_use': in_use,
         'transaction_count': transaction_count
     }
     return render(request, 'budget/delete_payment_method.html', context)
@@ -335,7 +322,7 @@ class CategorySetupForm(forms.Form):
         })
     )
 
-class BudgetSetupForm(forms.ModelForm):
+class BudgetSetupForm(CurrencyAmountMixin, forms.ModelForm):
     """予算設定フォーム"""
     class Meta:
         model = Budget
@@ -347,7 +334,7 @@ class BudgetSetupForm(forms.ModelForm):
             'amount': forms.NumberInput(attrs={
                 'class': 'w-full p-3 border-2 border-gray-300 rounded-lg',
                 'placeholder': _('月額予算'),
-                'inputmode': 'numeric'
+                'inputmode': 'decimal'
             })
         }
 
@@ -355,11 +342,8 @@ class BudgetSetupForm(forms.ModelForm):
 def setup_profile(request):
     """初期プロフィール設定"""
     # すでに設定済みならダッシュボードへ
-    try:
-        member = request.user.familymember
+    if get_family_member(request) is not None:
         return redirect('dashboard')
-    except FamilyMember.DoesNotExist:
-        pass
 
     if request.method == 'POST':
         form = FamilySetupForm(request.POST)
@@ -383,13 +367,10 @@ def setup_profile(request):
     return render(request, 'budget/setup_profile.html', context)
 
 @login_required
+@family_required
 def setup_categories(request):
     """カテゴリー初期設定"""
-    try:
-        member = request.user.familymember
-        family = member.family
-    except FamilyMember.DoesNotExist:
-        return redirect('setup_profile')
+    family = request.family
 
     # すでにカテゴリーがある場合はスキップ
     if Category.objects.filter(family=family).exists():
@@ -409,13 +390,10 @@ def setup_categories(request):
     return render(request, 'budget/setup_categories.html', context)
 
 @login_required
+@family_required
 def setup_payment_methods(request):
     """支払方法初期設定"""
-    try:
-        member = request.user.familymember
-        family = member.family
-    except FamilyMember.DoesNotExist:
-        return redirect('setup_profile')
+    family = request.family
 
     # すでに支払方法がある場合はスキップ
     if PaymentMethod.objects.filter(family=family).exists():
@@ -487,13 +465,12 @@ def create_default_payment_methods(family):
         )
 
 @login_required
+@family_required
+@conditional_page
 def settings(request):
     """設定画面"""
-    try:
-        member = request.user.familymember
-        family = member.family
-    except FamilyMember.DoesNotExist:
-        return redirect('setup_profile')
+    member = request.member
+    family = request.family
 
     categories = Category.objects.filter(family=family).order_by('category_type', 'name')
     payment_methods = PaymentMethod.objects.filter(family=family)
@@ -511,14 +488,12 @@ def settings(request):
 
 
 @login_required
+@family_required
 def save_gemini_api_key(request):
     """Save or clear the user's personal Gemini API key."""
     if request.method != 'POST':
         return redirect('settings')
-    try:
-        member = request.user.familymember
-    except FamilyMember.DoesNotExist:
-        return redirect('setup_profile')
+    member = request.member
     member.gemini_api_key = request.POST.get('gemini_api_key', '').strip()
     member.save()
     messages.success(request, _('✓ Gemini API Keyを保存しました'))
@@ -526,13 +501,11 @@ def save_gemini_api_key(request):
 
 
 @login_required
+@family_required
+@conditional_page
 def manage_budgets(request):
     """予算管理"""
-    try:
-        member = request.user.familymember
-        family = member.family
-    except FamilyMember.DoesNotExist:
-        return redirect('setup_profile')
+    family = request.family
 
     from django.utils import timezone
     today = timezone.now()
@@ -541,31 +514,39 @@ def manage_budgets(request):
 
     if request.method == 'POST':
         category_id = request.POST.get('category')
-        amount = request.POST.get('amount')
+        form = AmountForm(request.POST, family=family)
 
-        if category_id and amount:
+        if category_id and form.is_valid():
             Budget.objects.update_or_create(
                 family=family,
                 category_id=category_id,
                 year=year,
                 month=month,
-                defaults={'amount': amount}
+                defaults={'amount': form.cleaned_data['amount']}
             )
             messages.success(request, _('✓ 予算を設定しました'))
             return redirect('manage_budgets')
+        for error in form.errors.get('amount', []):
+            messages.error(request, error)
 
-    budgets = Budget.objects.filter(
+    budgets = list(Budget.objects.filter(
         family=family,
         year=year,
         month=month
-    ).select_related('category')
+    ).select_related('category'))
+    # Used amounts of every budget in one grouped query
+    used_by_category = Budget.used_amounts(
+        family, year, month, [budget.category_id for budget in budgets]
+    )
+    for budget in budgets:
+        budget.used_amount = used_by_category.get(budget.category_id, Decimal('0'))
 
     # 未設定のカテゴリー
     expense_categories = Category.objects.filter(
         family=family,
         category_type='expense'
     ).exclude(
-        id__in=budgets.values_list('category_id', flat=True)
+        id__in=[budget.category_id for budget in budgets]
     )
 
     context = {
@@ -573,18 +554,16 @@ def manage_budgets(request):
         'expense_categories': expense_categories,
         'year': year,
         'month': month,
+        'amount_step': amount_step(family.get_currency_code()),
     }
 
     return render(request, 'budget/manage_budgets.html', context)
 
 @login_required
+@family_required
 def export_data(request):
     """データエクスポート"""
-    try:
-        member = request.user.familymember
-        family = member.family
-    except FamilyMember.DoesNotExist:
-        return redirect('setup_profile')
+    family = request.family
 
     if request.method == 'POST':
         export_type = request.POST.get('type', 'csv')
@@ -603,8 +582,7 @@ def export_data(request):
 
         transactions = Transaction.objects.filter(
             family=family,
-            date__year=year,
-            date__month=month
+            year_month=int(year) * 100 + int(month)
         ).select_related('category', 'payment_method', 'member')
 
         for t in transactions:
@@ -623,33 +601,29 @@ def export_data(request):
     return render(request, 'budget/export_data.html')
 
 @login_required
+@family_required
 def edit_budget(request, budget_id):
-    try:
-        member = request.user.familymember
-        family = member.family
-    except FamilyMember.DoesNotExist:
-        return redirect('setup_profile')
+    family = request.family
 
     budget = get_object_or_404(Budget, id=budget_id, family=family)
 
     if request.method == 'POST':
-        amount = request.POST.get('amount')
-        if amount:
-            budget.amount = amount
+        form = AmountForm(request.POST, family=family)
+        if form.is_valid():
+            budget.amount = form.cleaned_data['amount']
             budget.save()
             messages.success(request, _('✓ 予算を更新しました'))
             return redirect('manage_budgets')
+        for error in form.errors.get('amount', []):
+            messages.error(request, error)
 
-    context = {'budget': budget}
+    context = {'budget': budget, 'amount_step': amount_step(family.get_currency_code())}
     return render(request, 'budget/edit_budget.html', context)
 
 @login_required
+@family_required
 def delete_budget(request, budget_id):
-    try:
-        member = request.user.familymember
-        family = member.family
-    except FamilyMember.DoesNotExist:
-        return redirect('setup_profile')
+    family = request.family
 
     budget = get_object_or_404(Budget, id=budget_id, family=family)
 
@@ -662,12 +636,9 @@ def delete_budget(request, budget_id):
     return render(request, 'budget/delete_budget.html', context)
 
 @login_required
+@family_required
 def currency_settings(request):
-    try:
-        member = request.user.familymember
-        family = member.family
-    except FamilyMember.DoesNotExist:
-        return redirect('setup_profile')
+    family = request.family
 
     if request.method == 'POST':
         currency_id = request.POST.get('currency')
@@ -0,0 +1,179 @@
+from django.db.models import F, QuerySet
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .exchange import invalidate_rate_table
+from .family_context import invalidate_family_context
+from . import classifier, suggestions
+from .models import (
+    Currency, ExchangeRate, Family, FamilyMember, FamilyInvite, Transaction, CashSaving, Category,
+    PaymentMethod, Budget, RecurringTemplate, Tombstone
+)
+
+# Models exposed by the sync API, keyed by the name used in tombstones
+SYNCED_MODELS = {
+    'transaction': Transaction,
+    'cash_saving': CashSaving,
+    'category': Category,
+    'payment_method': PaymentMethod,
+    'budget': Budget,
+}
+TOMBSTONE_NAMES = {model: model_name for model_name, model in SYNCED_MODELS.items()}
+
+# Models whose changes alter what the family's pages show
+FAMILY_DATA_MODELS = (
+    Transaction, CashSaving, Category, PaymentMethod, Budget,
+    RecurringTemplate, FamilyMember, FamilyInvite,
+)
+
+
+def _deleting_family(origin):
+    return isinstance(origin, Family) or isinstance(origin, QuerySet) and origin.model is Family
+
+
+def record_tombstone(sender, instance, origin=None, **kwargs):
+    """削除を記録して、クライアントが差分同期で削除を反映できるようにする"""
+    model_name = TOMBSTONE_NAMES[sender]
+
+    # Deleting the whole family removes its tombstones as well
+    if _deleting_family(origin):
+        return
+
+    Tombstone.objects.create(
+        family_id=instance.family_id,
+        model_name=model_name,
+        object_id=instance.pk,
+    )
+
+
+# Connected per model: a receiver without a sender would listen to every
+# model and turn off fast deletes project-wide
+for _model in SYNCED_MODELS.values():
+    post_delete.connect(record_tombstone, sender=_model, dispatch_uid=f'record_tombstone:{_model.__name__}')
+
+
+def bump_family_data_version(sender, instance, origin=None, **kwargs):
+    """家族データのバージョンを更新（ETag・キャッシュの無効化用）"""
+    if _deleting_family(origin):
+        return
+    Family.bump_data_version(instance.family_id)
+
+
+@receiver(post_save, sender=Family)
+def bump_family_version_on_edit(sender, instance, created, **kwargs):
+    """家族名・通貨の変更でバージョンを更新"""
+    if not created:
+        Family.bump_data_version(instance.pk)
+
+
+for _model in FAMILY_DATA_MODELS:
+    post_save.connect(bump_family_data_version, sender=_model,
+                      dispatch_uid=f'bump_family_data_version:{_model.__name__}')
+    post_delete.connect(bump_family_data_version, sender=_model,
+                        dispatch_uid=f'bump_family_data_version:{_model.__name__}')
+
+
+@receiver(post_save, sender=Transaction)
+def count_usage(sender, instance, created, **kwargs):
+    """カテゴリー・支払方法の使用回数とスコアを更新"""
+    if created:
+        loaded = (None, None)
+    else:
+        loaded = getattr(instance, '_loaded_usage', None)
+        if loaded is None:
+            # Not loaded from the database: the previous values are unknown
+            return
+    current = (instance.category_id, instance.payment_method_id)
+    for model, old, new in zip((Category, PaymentMethod), loaded, current):
+        if old != new:
+            model.record_usage(old, instance.created_at, -1)
+            model.record_usage(new, instance.created_at)
+    instance._loaded_usage = current
+
+
+@receiver(post_save, sender=Transaction)
+def update_amount_suggestions(sender, instance, created, **kwargs):
+    """新しい取引をプリセット入力の金額候補に反映"""
+    if created:
+        suggestions.record(instance)
+
+
+@receiver(post_save, sender=Transaction)
+def learn_category(sender, instance, created, **kwargs):
+    """取引のメモからカテゴリーの推定を学習（変更時は学習し直す）"""
+    current = (instance.description, instance.category_id)
+    if created:
+        classifier.record(instance)
+    else:
+        loaded = getattr(instance, '_loaded_memo', None)
+        if loaded is None:
+            # Not loaded from the database: the previous memo is unknown
+            return
+        if loaded != current:
+            classifier.relearn(instance, *loaded)
+    instance._loaded_memo = current
+
+
+@receiver(post_delete, sender=Transaction)
+def unlearn_category(sender, instance, origin=None, **kwargs):
+    """削除した取引のメモを推定から取り消す"""
+    if _deleting_family(origin):
+        return
+    loaded = getattr(instance, '_loaded_memo', None) or (instance.description, instance.category_id)
+    classifier.forget(instance, *loaded)
+
+
+@receiver(post_delete, sender=Category)
+def forget_category(sender, instance, origin=None, **kwargs):
+    """削除したカテゴリーを推定から外す"""
+    if not _deleting_family(origin):
+        classifier.forget_deleted_category(instance)
+
+
+@receiver(post_delete, sender=Transaction)
+def uncount_usage(sender, instance, origin=None, **kwargs):
+    """削除した取引の使用を取り消す"""
+    if _deleting_family(origin):
+        return
+    category_id, payment_method_id = getattr(
+        instance, '_loaded_usage', (instance.category_id, instance.payment_method_id)
+    )
+    Category.record_usage(category_id, instance.created_at, -1)
+    PaymentMethod.record_usage(payment_method_id, instance.created_at, -1)
+
+
+@receiver(post_save, sender=Currency)
+@receiver(post_delete, sender=Currency)
+@receiver(post_save, sender=ExchangeRate)
+@receiver(post_delete, sender=ExchangeRate)
+def invalidate_exchange_rates(sender, **kwargs):
+    """レートの変更でキャッシュ済みの RateTable を破棄"""
+    invalidate_rate_table()
+
+
+@receiver(post_save, sender=FamilyMember)
+@receiver(post_delete, sender=FamilyMember)
+def invalidate_member_context(sender, instance, **kwargs):
+    """メンバーの変更・削除でキャッシュ済みの家族情報を破棄"""
+    invalidate_family_context([instance.user_id])
+
+
+@receiver(post_save, sender=Family)
+def invalidate_family_members_context(sender, instance, created, **kwargs):
+    """家族名・通貨の変更をメンバー全員のキャッシュに反映"""
+    if not created:
+        invalidate_family_context(instance.members.values_list('user_id', flat=True))
+
+
+@receiver(post_save, sender=Currency)
+def invalidate_currency_context(sender, instance, **kwargs):
+    # Currencies in use are protected from deletion, so only edits matter
+    invalidate_family_context(
+        FamilyMember.objects.filter(family__currency_id=instance.pk).values_list('user_id', flat=True)
+    )
+    # Other processes notice the new version on their next request
+    Family.objects.filter(currency_id=instance.pk).update(
+        data_version=F('data_version') + 1,
+        data_updated_at=timezone.now(),
+    )
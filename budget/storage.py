@@ -0,0 +1,15 @@
+from whitenoise.storage import CompressedManifestStaticFilesStorage
+
+
+class ManifestStaticFilesStorage(CompressedManifestStaticFilesStorage):
+    """Hashed + precompressed static files that tolerate missing optional assets.
+
+    Templates reference PWA icons that each installation provides itself; a
+    missing file is served under its plain name instead of failing the page.
+    """
+
+    def stored_name(self, name):
+        try:
+            return super().stored_name(name)
+        except ValueError:
+            return name
@@ -0,0 +1,144 @@
+"""Amount suggestions for the two-tap preset entry.
+
+Every (family, category, member) has one AmountSuggestion row holding, as
+JSON in integer minor units of the family's currency (foreign-currency
+transactions are converted, see exchange.py):
+
+* counts: [uses, overestimate] per amount. At most TRACKED_AMOUNTS are
+  kept; a new amount then takes over the least used slot, starting from
+  that slot's count plus one and remembering the count it inherited (the
+  Space-Saving algorithm). Amounts used often are never lost while one-off
+  amounts come and go, and uses - overestimate is a guaranteed lower bound;
+* recent: the last RECENT_AMOUNTS distinct amounts, newest first;
+* methods: how often each payment method was used.
+
+The row is updated on every new transaction (see signals.py) and kept in
+the cache, so the preset page reads it without touching the transaction
+table. A missing row is seeded once from the last SEED_TRANSACTIONS
+transactions. Edits and deletions of transactions are not taken back; the
+suggestions only need to follow what is entered.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction as db_transaction
+
+from .exchange import family_amount, transaction_minor
+from .models import AmountSuggestion, Transaction
+from .money import from_minor
+
+SUGGESTIONS_TIMEOUT = getattr(settings, 'SUGGESTIONS_CACHE_SECONDS', 60 * 60 * 24)
+
+TRACKED_AMOUNTS = 12
+RECENT_AMOUNTS = 5
+SHOWN_AMOUNTS = 3
+SEED_TRANSACTIONS = 50
+
+
+def _cache_key(family_id, category_id, member_id):
+    return f'suggestions:{family_id}:{category_id}:{member_id}'
+
+
+def empty():
+    return {'counts': {}, 'recent': [], 'methods': {}}
+
+
+def add(data, minor, payment_method_id=None):
+    """1件の入力を data に反映"""
+    counts = data['counts']
+    key = str(minor)
+    if key in counts:
+        counts[key][0] += 1
+    elif len(counts) < TRACKED_AMOUNTS:
+        counts[key] = [1, 0]
+    else:
+        least = min(counts, key=lambda amount: counts[amount][0])
+        inherited = counts.pop(least)[0]
+        counts[key] = [inherited + 1, inherited]
+
+    data['recent'] = ([minor] + [amount for amount in data['recent'] if amount != minor])[:RECENT_AMOUNTS]
+
+    if payment_method_id is not None:
+        methods = data['methods']
+        methods[str(payment_method_id)] = methods.get(str(payment_method_id), 0) + 1
+    return data
+
+
+def amounts(data, count=SHOWN_AMOUNTS):
+    """候補の金額（よく使う順、足りなければ最近の金額）"""
+    recency = {amount: i for i, amount in enumerate(data['recent'])}
+    # Amounts certainly entered more than once, most used first
+    repeated = [
+        (int(key), uses) for key, (uses, overestimate) in data['counts'].items()
+        if uses - overestimate > 1
+    ]
+    repeated.sort(key=lambda item: (-item[1], recency.get(item[0], len(recency))))
+    chosen = [amount for amount, _uses in repeated[:count]]
+    for amount in data['recent']:
+        if len(chosen) >= count:
+            break
+        if amount not in chosen:
+            chosen.append(amount)
+    return [from_minor(amount) for amount in chosen]
+
+
+def payment_method(data):
+    """いちばん使われている支払方法の id"""
+    methods = data['methods']
+    if not methods:
+        return None
+    return int(max(methods, key=methods.get))
+
+
+def _seed(family, category_id, member_id):
+    data = empty()
+    rows = Transaction.objects.filter(
+        family=family, category_id=category_id, member_id=member_id
+    ).annotate(minor=family_amount(family)).order_by('-created_at').values_list(
+        'minor', 'payment_method_id'
+    )[:SEED_TRANSACTIONS]
+    for minor, payment_method_id in reversed(rows):
+        add(data, minor, payment_method_id)
+    return data
+
+
+def get_suggestion(family, category_id, member_id):
+    """キャッシュ済みの候補（なければ DB の行、それもなければ履歴から作成）"""
+    key = _cache_key(family.pk, category_id, member_id)
+    data = cache.get(key)
+    if data is None:
+        row = AmountSuggestion.objects.filter(
+            family=family, category_id=category_id, member_id=member_id
+        ).values_list('data', flat=True).first()
+        if row is None:
+            data = _seed(family, category_id, member_id)
+            AmountSuggestion.objects.get_or_create(
+                family=family, category_id=category_id, member_id=member_id,
+                defaults={'data': data},
+            )
+        else:
+            data = row
+        cache.set(key, data, SUGGESTIONS_TIMEOUT)
+    return data
+
+
+def record(instance):
+    """新しい取引を候補に加える"""
+    if instance.member_id is None:
+        return
+    family = instance.family
+    key = (instance.family_id, instance.category_id, instance.member_id)
+    with db_transaction.atomic():
+        row = AmountSuggestion.objects.select_for_update().filter(
+            family_id=key[0], category_id=key[1], member_id=key[2]
+        ).first()
+        if row is None:
+            # The history already includes this transaction
+            data = _seed(family, key[1], key[2])
+            AmountSuggestion.objects.get_or_create(
+                family_id=key[0], category_id=key[1], member_id=key[2],
+                defaults={'data': data},
+            )
+        else:
+            data = add(row.data, transaction_minor(instance, family), instance.payment_method_id)
+            row.save(update_fields=['data', 'updated_at'])
+    cache.set(_cache_key(*key), data, SUGGESTIONS_TIMEOUT)
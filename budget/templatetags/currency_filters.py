@@ -1,11 +1,25 @@
+from decimal import InvalidOperation
+
 from django import template
 
+from budget.money import format_amount
+
 register = template.Library()
 
 @register.filter
-def currency_format(value, currency_symbol='¥'):
-    """Format amount with currency symbol"""
+def currency_format(value, currency='¥'):
+    """Format amount with currency symbol
+
+    ``currency`` is a Family or a Currency, whose code sets the decimals
+    (``{{ amount|currency_format:family }}``), or just a symbol.
+    """
+    if hasattr(currency, 'get_currency_code'):
+        symbol, code = currency.get_currency_symbol(), currency.get_currency_code()
+    elif hasattr(currency, 'code'):
+        symbol, code = currency.symbol, currency.code
+    else:
+        symbol, code = currency, None
     try:
-        return f"{currency_symbol}{float(value):,.0f}"
-    except (ValueError, TypeError):
-        return f"{currency_symbol}0"
\ No newline at end of file
+        return f"{symbol}{format_amount(value, code)}"
+    except (InvalidOperation, ValueError, TypeError):
+        return f"{symbol}0"
\ No newline at end of file
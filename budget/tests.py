@@ -1,3 +1,1075 @@
-from django.test import TestCase
+import copy
+import csv
+import io
+import os
+import tempfile
+import threading
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from dateutil.relativedelta import relativedelta
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models.deletion import Collector
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from . import ai, ai_limits, anomalies, classifier, projections, reports, suggestions, timeline
+from .ai_limits import AIBusy
+from .exchange import family_amount
+from .family_context import get_family_member
+from .forms import AmountForm
+from .models import (
+    AmountSuggestion, Budget, CashSaving, Category, Currency, EmailNotificationSettings,
+    ExchangeRate, Family, FamilyMember, PaymentMethod, RecurringTemplate, SpendingAnomaly, Tombstone, Transaction,
+    usage_weight,
+)
+from .money import MinorSum, format_amount, from_minor, to_minor, to_number
+
+
+class FamilyTestCase(TestCase):
+    """ログイン済みの家族メンバーと支出カテゴリー1つ"""
+
+    def setUp(self):
+        # Cached suggestions and reports are keyed by pk, which SQLite reuses
+        cache.clear()
+        self.user = User.objects.create_user('taro', password='test-pass-1234')
+        self.family = Family.objects.create(name='山田家', currency=Currency.objects.get(code='JPY'))
+        self.member = FamilyMember.objects.create(user=self.user, family=self.family, nickname='taro')
+        self.category = Category.objects.create(family=self.family, name='食費', category_type='expense')
+        self.client.force_login(self.user)
+
+    def add(self, amount, category=None, **fields):
+        category = category or self.category
+        fields.setdefault('date', date(2026, 1, 15))
+        return Transaction.objects.create(
+            family=self.family, member=self.member, category=category,
+            transaction_type=category.category_type, amount=amount, **fields
+        )
+
+
+class SyncTests(FamilyTestCase):
+    def sync(self, **params):
+        response = self.client.get(reverse('api_sync'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def ids(self, table):
+        index = table['fields'].index('id')
+        return {row[index] for row in table['rows']}
+
+    def test_full_sync_returns_every_row(self):
+        first, second = self.add(100), self.add(200)
+
+        data = self.sync()
+
+        self.assertTrue(data['full'])
+        self.assertEqual(self.ids(data['transactions']), {first.pk, second.pk})
+        self.assertEqual(self.ids(data['categories']), {self.category.pk})
+
+    def test_delta_sync_returns_changes_and_deletions_since_cursor(self):
+        kept, edited, deleted = self.add(100), self.add(200), self.add(300)
+        cursor = self.sync()['cursor']
+
+        edited.amount = 250
+        edited.save()
+        added = self.add(400)
+        deleted_pk = deleted.pk
+        deleted.delete()
+
+        data = self.sync(updated_since=cursor)
+
+        self.assertFalse(data['full'])
+        self.assertEqual(self.ids(data['transactions']), {edited.pk, added.pk})
+        self.assertNotIn(kept.pk, self.ids(data['transactions']))
+        self.assertEqual(data['deleted']['transactions'], [deleted_pk])
+        self.assertEqual(data['deleted']['categories'], [])
+
+    def test_invalid_cursor_is_rejected(self):
+        response = self.client.get(reverse('api_sync'), {'updated_since': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'invalid_updated_since')
+
+    def test_tombstones_only_for_synced_models(self):
+        method = PaymentMethod.objects.create(family=self.family, name='現金', method_type='cash')
+        method_pk = method.pk
+        method.delete()
+        FamilyMember.objects.create(
+            user=User.objects.create_user('hanako'), family=self.family, nickname='hanako'
+        ).delete()
+
+        self.assertEqual(
+            list(Tombstone.objects.values_list('model_name', 'object_id')),
+            [('payment_method', method_pk)],
+        )
+
+    def test_unrelated_models_keep_fast_deletes(self):
+        # A sender-less delete receiver would make every model collect rows
+        self.assertTrue(Collector('default').can_fast_delete(Session.objects.all()))
+
+
+class ConditionalGetTests(FamilyTestCase):
+    def version(self):
+        return Family.objects.values_list('data_version', flat=True).get(pk=self.family.pk)
+
+    def test_unchanged_data_answers_304(self):
+        self.add(100)
+        first = self.client.get(reverse('api_sync'))
+        self.assertEqual(first.status_code, 200)
+
+        again = self.client.get(reverse('api_sync'), HTTP_IF_NONE_MATCH=first['ETag'])
+
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.content, b'')
+
+    def test_a_write_changes_the_etag(self):
+        first = self.client.get(reverse('transaction_list'))
+
+        self.add(100)
+        again = self.client.get(reverse('transaction_list'), HTTP_IF_NONE_MATCH=first['ETag'])
+
+        self.assertEqual(again.status_code, 200)
+        self.assertNotEqual(again['ETag'], first['ETag'])
+
+    def test_version_follows_family_data_only(self):
+        before = self.version()
+        transaction = self.add(100)
+        self.assertEqual(self.version(), before + 1)
+
+        transaction.delete()
+        self.assertEqual(self.version(), before + 2)
+
+        self.user.first_name = 'Taro'
+        self.user.save()
+        self.assertEqual(self.version(), before + 2)
+
+        self.family.name = '山田家（本家）'
+        self.family.save()
+        self.assertEqual(self.version(), before + 3)
+
+
+class ProjectionTests(TestCase):
+    """projections と RecurringTemplate.should_generate() / get_next_date() の一致"""
+
+    TODAY = date(2026, 1, 20)
+
+    def generated(self, template, end):
+        """should_generate() を毎日呼んだときに作られる日付"""
+        template = copy.copy(template)
+        dates = []
+        day = self.TODAY
+        while day <= end:
+            moment = datetime.combine(day, time(12), tzinfo=dt_timezone.utc)
+            with mock.patch('budget.models.timezone.now', return_value=moment):
+                if template.should_generate():
+                    dates.append(day)
+                    template.last_generated = day
+            day += timedelta(days=1)
+        return dates
+
+    def template(self, frequency, start_date, **fields):
+        return RecurringTemplate(
+            frequency=frequency, start_date=start_date, amount=Decimal('1000'),
+            transaction_type='expense', category=Category(is_insurance_saving=False), **fields
+        )
+
+    def assertMatchesGenerator(self, template, days):
+        end = self.TODAY + timedelta(days=days)
+        expected = self.generated(template, end)
+        self.assertTrue(expected)
+        self.assertEqual(projections.template_dates(template, self.TODAY, end), expected)
+
+    def test_monthly_on_a_day_missing_in_short_months(self):
+        self.assertMatchesGenerator(self.template('monthly', date(2025, 12, 5), day_of_month=31), 400)
+
+    def test_monthly_from_the_end_of_a_month(self):
+        self.assertMatchesGenerator(self.template('monthly', date(2026, 1, 31)), 400)
+
+    def test_yearly_from_29_february(self):
+        self.assertMatchesGenerator(self.template('yearly', date(2024, 2, 29)), 1500)
+
+    def test_weekly_until_end_date(self):
+        self.assertMatchesGenerator(
+            self.template('weekly', date(2026, 1, 10), end_date=date(2026, 4, 1)), 200
+        )
+
+    def test_start_date_is_not_an_occurrence(self):
+        template = self.template('daily', self.TODAY)
+        self.assertEqual(
+            projections.template_dates(template, self.TODAY, self.TODAY + timedelta(days=2)),
+            [self.TODAY + timedelta(days=1), self.TODAY + timedelta(days=2)],
+        )
+
+    def test_overdue_template_is_generated_today(self):
+        self.assertMatchesGenerator(
+            self.template('weekly', date(2025, 11, 1), last_generated=date(2025, 12, 1)), 60
+        )
+
+    def test_monthly_totals_count_each_occurrence(self):
+        template = self.template('weekly', date(2026, 1, 16))
+        months = 12
+        end = self.TODAY + relativedelta(months=months) - timedelta(days=1)
+        occurrences = len(projections.template_dates(template, self.TODAY, end))
+
+        totals = projections.monthly_totals([template], self.TODAY, months)
+
+        self.assertEqual(sum(month['expense'] for month in totals), occurrences * to_minor(1000))
+        self.assertEqual(totals[0]['expense'], 4 * to_minor(1000))
+
+
+class MoneyTests(FamilyTestCase):
+    def raw_amount(self, transaction):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT amount FROM {Transaction._meta.db_table} WHERE id = %s', [transaction.pk]
+            )
+            return cursor.fetchone()[0]
+
+    def test_amount_round_trip(self):
+        transaction = self.add(Decimal('12.34'))
+
+        self.assertEqual(self.raw_amount(transaction), 1234)
+        self.assertEqual(Transaction.objects.get(pk=transaction.pk).amount, Decimal('12.34'))
+        self.assertEqual(Transaction.objects.filter(amount__gte=Decimal('12.34')).count(), 1)
+        self.assertEqual(Transaction.objects.filter(amount__lt=Decimal('12.34')).count(), 0)
+
+    def test_minor_units(self):
+        self.assertEqual(to_minor(Decimal('0.005')), 1)
+        self.assertEqual(to_minor(3), 300)
+        self.assertEqual(to_minor('19.99'), 1999)
+        self.assertEqual(from_minor(1999), Decimal('19.99'))
+        self.assertEqual(to_number(1200), 12)
+        self.assertEqual(to_number(1250), 12.5)
+
+    def test_minor_sum(self):
+        self.add(Decimal('0.10'))
+        self.add(Decimal('0.20'))
+        total = Transaction.objects.aggregate(total=MinorSum('amount'))['total']
+        self.assertEqual(total, 30)
+
+    def test_format_amount_uses_currency_decimals(self):
+        self.assertEqual(format_amount(Decimal('1234.5'), 'JPY'), '1,235')
+        self.assertEqual(format_amount(Decimal('1234.5'), 'USD'), '1,234.50')
+        self.assertEqual(format_amount(Decimal('1234')), '1,234')
+
+    def test_fractional_yen_is_rejected(self):
+        self.assertFalse(AmountForm({'amount': '10.50'}, family=self.family).is_valid())
+        form = AmountForm({'amount': '10'}, family=self.family)
+        self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data['amount'], 10)
+
+        dollars = Family.objects.create(name='Smith', currency=Currency.objects.get(code='USD'))
+        self.assertTrue(AmountForm({'amount': '10.50'}, family=dollars).is_valid())
+        self.assertFalse(AmountForm({'amount': '10.505'}, family=dollars).is_valid())
+
+    def test_pages_reject_fractional_yen(self):
+        response = self.client.post(reverse('quick_add_transaction'), {
+            'transaction_type': 'expense', 'category': self.category.pk,
+            'amount': '10.50', 'date': '2026-01-15',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('JPY', response.context['form'].errors['amount'][0])
+
+        self.client.post(reverse('preset_transaction', args=[self.category.pk]), {'amount': '10.50'})
+        self.client.post(reverse('manage_budgets'), {'category': self.category.pk, 'amount': '10.50'})
+        self.assertFalse(Transaction.objects.exists())
+        self.assertFalse(Budget.objects.exists())
+
+        response = self.client.get(reverse('preset_transaction', args=[self.category.pk]))
+        self.assertContains(response, 'step="1"')
+
+
+class MoneyMigrationTests(TransactionTestCase):
+    """0008: 金額を整数（最小単位）に変換し、戻すと元の値になる"""
+
+    before = [('budget', '0007_transaction_denormalized_columns')]
+    after = [('budget', '0008_money_minor_units')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def raw_amounts(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT amount FROM budget_transaction ORDER BY id')
+            return [row[0] for row in cursor.fetchall()]
+
+    def test_forward_and_backward(self):
+        apps = self.migrate(self.before)
+        family = apps.get_model('budget', 'Family').objects.create(name='山田家')
+        category = apps.get_model('budget', 'Category').objects.create(
+            family=family, name='食費', category_type='expense'
+        )
+        apps.get_model('budget', 'Transaction').objects.create(
+            family=family, category=category, transaction_type='expense',
+            amount=1500, date=date(2026, 1, 15),
+        )
+
+        self.migrate(self.after)
+        self.assertEqual([int(amount) for amount in self.raw_amounts()], [150000])
+
+        self.migrate(self.before)
+        self.assertEqual([int(amount) for amount in self.raw_amounts()], [1500])
+
+
+class TimelineTests(FamilyTestCase):
+    START, END = date(2026, 1, 1), date(2026, 1, 31)
+
+    def setUp(self):
+        super().setUp()
+        salary = Category.objects.create(family=self.family, name='給与', category_type='income')
+        insurance = Category.objects.create(
+            family=self.family, name='保険', category_type='expense', is_insurance_saving=True
+        )
+        usd = Currency.objects.get(code='USD')
+        ExchangeRate.objects.create(currency=usd, date=date(2026, 1, 1), rate=Decimal('0.0067'))
+
+        self.add(1000, salary, date=date(2025, 12, 31))
+        self.add(300, date=date(2026, 1, 10))
+        self.add(200, insurance, date=date(2026, 1, 10))
+        # 10 USD at 0.0067 per yen
+        self.add(Decimal('10.00'), date=date(2026, 1, 15), currency=usd)
+        self.add(5000, salary, date=date(2026, 1, 20))
+        CashSaving.objects.create(family=self.family, member=self.member, amount=700, date=date(2026, 1, 25))
+
+    def rows(self, points):
+        data = timeline.timeline(self.family, self.START, self.END, points)
+        return data['bucket_days'], [dict(zip(data['fields'], row)) for row in data['rows']]
+
+    def test_daily_rows(self):
+        size, rows = self.rows(31)
+
+        self.assertEqual(size, 1)
+        self.assertEqual(len(rows), 31)
+        by_day = {row['date']: row for row in rows}
+        self.assertEqual(by_day['2026-01-01']['balance'], 1000)
+        self.assertEqual(by_day['2026-01-10']['expense'], 500)
+        self.assertEqual(by_day['2026-01-10']['insurance_saving'], 200)
+        self.assertEqual(by_day['2026-01-10']['balance'], 500)
+        self.assertEqual(by_day['2026-01-15']['expense'], 1492.54)
+        self.assertEqual(by_day['2026-01-16']['balance'], -992.54)
+        self.assertEqual(by_day['2026-01-31']['balance'], 3307.46)
+        self.assertEqual(by_day['2026-01-31']['savings'], 900)
+
+    def test_buckets_sum_the_days(self):
+        size, rows = self.rows(4)
+
+        self.assertEqual(size, 8)
+        self.assertEqual([row['date'] for row in rows], ['2026-01-01', '2026-01-09', '2026-01-17', '2026-01-25'])
+        self.assertEqual([row['expense'] for row in rows], [0, 1992.54, 0, 0])
+        self.assertEqual([row['income'] for row in rows], [0, 0, 5000, 0])
+        self.assertEqual([row['cash_saving'] for row in rows], [0, 0, 0, 700])
+        self.assertEqual([row['net'] for row in rows], [0, -1992.54, 5000, -700])
+        self.assertEqual([row['balance'] for row in rows], [1000, -992.54, 4007.46, 3307.46])
+        self.assertEqual([row['savings'] for row in rows], [0, 200, 200, 900])
+
+    def test_api(self):
+        response = self.client.get(reverse('api_timeline'), {'from': '2026-01-01', 'to': '2026-01-31', 'points': 4})
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['rows'][-1][data['fields'].index('balance')], 3307.46)
+
+
+class AnnualReportTests(FamilyTestCase):
+    def setUp(self):
+        super().setUp()
+        salary = Category.objects.create(family=self.family, name='給与', category_type='income')
+        usd = Currency.objects.get(code='USD')
+        ExchangeRate.objects.create(currency=usd, date=date(2026, 1, 1), rate=Decimal('0.0067'))
+
+        self.add(400, date=date(2025, 1, 20))
+        self.add(300, date=date(2026, 1, 10))
+        self.add(200, date=date(2026, 1, 31))
+        self.add(1000, date=date(2026, 2, 1))
+        # 10 USD at 0.0067 per yen
+        self.add(Decimal('10.00'), date=date(2026, 3, 15), currency=usd)
+        self.add(5000, salary, date=date(2026, 1, 25))
+        Budget.objects.create(family=self.family, category=self.category, year=2026, month=1, amount=600)
+        Budget.objects.create(family=self.family, category=self.category, year=2026, month=2, amount=800)
+
+    def test_rows_and_totals(self):
+        report = reports.annual_report(self.family, 2026)
+
+        self.assertEqual([row['category'] for row in report['rows']], ['給与', '食費'])
+        food = report['rows'][1]
+        self.assertEqual(food['actual'], [500, 1000, 1492.54] + [0] * 9)
+        self.assertEqual(food['previous'], [400] + [0] * 11)
+        self.assertEqual(food['budget'], [600, 800] + [None] * 10)
+        self.assertEqual(food['variance'], [100, -200] + [None] * 10)
+        self.assertEqual(food['total'], 2992.54)
+        self.assertEqual(food['budget_total'], 1400)
+        # Only budgeted months count towards the variance
+        self.assertEqual(food['variance_total'], -100)
+        self.assertEqual(food['yoy_delta'], 2592.54)
+        self.assertEqual(food['yoy_percent'], 648.1)
+
+        self.assertEqual(report['income']['actual'], [5000] + [0] * 11)
+        self.assertEqual(report['expense']['actual'], food['actual'])
+        self.assertEqual(report['net'], [4500, -1000, -1492.54] + [0] * 9)
+        self.assertEqual(report['net_total'], 2007.46)
+
+    def test_cached_report_follows_new_transactions(self):
+        url = reverse('api_annual_report')
+        before = self.client.get(url, {'year': 2026}).json()
+        self.add(100, date=date(2026, 12, 31))
+        after = self.client.get(url, {'year': 2026}).json()
+
+        self.assertEqual(before['expense']['total'], 2992.54)
+        self.assertEqual(after['expense']['total'], 3092.54)
+        self.assertEqual(after['expense']['actual'][11], 100)
+
+    def test_csv(self):
+        response = self.client.get(reverse('annual_report'), {'year': 2026, 'format': 'csv'})
+
+        self.assertEqual(response.status_code, 200)
+        rows = list(csv.reader(io.StringIO(response.content.decode('utf-8-sig'))))
+        self.assertEqual(len(rows), 1 + 2 + 3)
+        self.assertEqual(rows[2][0], '食費')
+        self.assertEqual(rows[2][2:5], ['500', '1000', '1492.54'])
+        self.assertEqual(rows[2][14:], ['2992.54', '1400', '-100', '400', '2592.54'])
+        # 収支: months, total, previous year and the change
+        self.assertEqual(rows[-1][2:5], ['4500', '-1000', '-1492.54'])
+        self.assertEqual(rows[-1][14:], ['2007.46', '', '', '-400', '2407.46'])
+
+
+class AnomalyTests(FamilyTestCase):
+    TODAY = date(2026, 1, 20)
+
+    def setUp(self):
+        super().setUp()
+        for month, amount in enumerate([1000, 1100, 900, 1000, 1050, 950, 1000, 1100, 900, 1000, 1050, 950], 1):
+            self.add(amount, date=date(2025, month, 5))
+        self.spike = self.add(5000, date=date(2026, 1, 10))
+        daily = Category.objects.create(family=self.family, name='日用品', category_type='expense')
+        self.add(300, daily, date=date(2026, 1, 15), description='洗剤')
+        self.twice = self.add(300, daily, date=date(2026, 1, 15), description='洗剤 ')
+
+    def found(self):
+        return sorted(
+            (a.kind, a.category_id, a.transaction_id, a.period_start, a.amount, a.baseline)
+            for a in anomalies.detect(self.family, self.TODAY)
+        )
+
+    def test_detect(self):
+        self.assertEqual(self.found(), [
+            ('duplicate', self.twice.category_id, self.twice.pk, date(2026, 1, 15), 300, 300),
+            ('large_transaction', self.category.pk, self.spike.pk, date(2026, 1, 10), 5000, 1000),
+            ('monthly_spike', self.category.pk, None, date(2026, 1, 1), 5000, 1000),
+        ])
+
+    def test_usual_month_is_not_flagged(self):
+        self.spike.amount = 1000
+        self.spike.save()
+
+        self.assertEqual([kind for kind, *_rest in self.found()], ['duplicate'])
+
+    def test_foreign_currency_is_converted(self):
+        usd = Currency.objects.get(code='USD')
+        ExchangeRate.objects.create(currency=usd, date=date(2026, 1, 1), rate=Decimal('0.005'))
+        # 25 USD = 5000 yen, the same spike as before
+        self.spike.amount = Decimal('25.00')
+        self.spike.currency = usd
+        self.spike.save()
+
+        self.assertIn(
+            ('monthly_spike', self.category.pk, None, date(2026, 1, 1), 5000, 1000), self.found()
+        )
+
+    def test_refresh_runs_only_when_data_changed(self):
+        self.assertEqual(anomalies.refresh(self.family, today=self.TODAY), 3)
+        self.assertEqual(SpendingAnomaly.objects.filter(family=self.family).count(), 3)
+        self.assertIsNone(anomalies.refresh(self.family, today=self.TODAY))
+
+        self.twice.delete()
+
+        self.assertEqual(anomalies.refresh(self.family, today=self.TODAY), 2)
+        self.assertEqual(
+            set(SpendingAnomaly.objects.filter(family=self.family).values_list('kind', flat=True)),
+            {'large_transaction', 'monthly_spike'},
+        )
+
+
+class AmountSuggestionTests(FamilyTestCase):
+    def stored(self):
+        return AmountSuggestion.objects.get(
+            family=self.family, category=self.category, member=self.member
+        ).data
+
+    def test_least_used_amount_is_replaced(self):
+        data = suggestions.empty()
+        for minor in range(1, suggestions.TRACKED_AMOUNTS + 1):
+            suggestions.add(data, minor)
+        suggestions.add(data, 5)
+
+        suggestions.add(data, 99)
+
+        self.assertEqual(len(data['counts']), suggestions.TRACKED_AMOUNTS)
+        self.assertNotIn('1', data['counts'])
+        # Takes over the count of the amount it replaced
+        self.assertEqual(data['counts']['99'], [2, 1])
+        self.assertEqual(data['counts']['5'], [2, 0])
+        self.assertEqual(data['recent'], [99, 5, 12, 11, 10])
+
+    def test_amounts_prefer_repeated_then_recent(self):
+        data = suggestions.empty()
+        for minor in [50000, 30000, 50000, 30000, 50000, 12000, 8000]:
+            suggestions.add(data, minor)
+
+        self.assertEqual(suggestions.amounts(data), [500, 300, 80])
+
+    def test_new_transactions_update_the_stored_suggestions(self):
+        card = PaymentMethod.objects.create(family=self.family, name='カード', method_type='credit')
+        for amount in [500, 300, 500, 500, 300]:
+            self.add(amount, payment_method=card)
+        self.add(1200)
+
+        data = suggestions.get_suggestion(self.family, self.category.pk, self.member.pk)
+
+        self.assertEqual(suggestions.amounts(data), [500, 300, 1200])
+        self.assertEqual(suggestions.payment_method(data), card.pk)
+        self.assertEqual(data, self.stored())
+        # Same as building them again from the history
+        self.assertEqual(data, suggestions._seed(self.family, self.category.pk, self.member.pk))
+
+        cache.clear()
+        self.assertEqual(suggestions.get_suggestion(self.family, self.category.pk, self.member.pk), data)
+
+    def test_foreign_currency_is_converted(self):
+        usd = Currency.objects.get(code='USD')
+        ExchangeRate.objects.create(currency=usd, date=date(2026, 1, 1), rate=Decimal('0.0067'))
+        self.add(100)
+        self.add(Decimal('10.00'), currency=usd)
+
+        self.assertEqual(self.stored()['recent'], [149254, 10000])
+        self.assertEqual(self.stored(), suggestions._seed(self.family, self.category.pk, self.member.pk))
+
+
+class ClassifierTests(FamilyTestCase):
+    def setUp(self):
+        super().setUp()
+        self.daily = Category.objects.create(family=self.family, name='日用品', category_type='expense')
+        self.lunch = self.add(800, description='ランチ')
+        self.market = self.add(3000, description='スーパー 食材')
+        self.soap = self.add(500, self.daily, description='ドラッグストア 洗剤')
+        self.add(300, self.daily, description='洗剤')
+
+    def stored(self):
+        return classifier._load(self.family.pk)
+
+    def assertMatchesHistory(self):
+        model = classifier.get_model(self.family.pk)
+        self.assertEqual(model, self.stored())
+        self.assertEqual(model, classifier._seed(self.family.pk))
+        return model
+
+    def best(self, text):
+        return classifier.suggest(classifier.get_model(self.family.pk), text)[0][0]
+
+    def test_learns_new_memos(self):
+        model = self.assertMatchesHistory()
+
+        self.assertEqual(model['docs'], {str(self.category.pk): 2, str(self.daily.pk): 2})
+        self.assertEqual(self.best('スーパー'), self.category.pk)
+        self.assertEqual(self.best('洗剤'), self.daily.pk)
+
+    def test_edited_memo_and_category_are_relearnt(self):
+        self.market.description = 'スーパー 洗剤'
+        self.market.category = self.daily
+        self.market.save()
+
+        model = self.assertMatchesHistory()
+        self.assertNotIn('食材', model['vocabulary'])
+        self.assertEqual(self.best('スーパー'), self.daily.pk)
+
+    def test_deleted_transaction_is_unlearnt(self):
+        self.soap.delete()
+
+        model = self.assertMatchesHistory()
+        self.assertEqual(model['docs'][str(self.daily.pk)], 1)
+        self.assertEqual(model['tokens'][str(self.daily.pk)], {'洗剤': 1})
+        self.assertNotIn('ドラ', model['vocabulary'])
+
+    def test_deleted_category_is_forgotten(self):
+        unused = Category.objects.create(family=self.family, name='雑費', category_type='expense')
+        classifier._update(self.family.pk, lambda: classifier._learn(self.family.pk, ['雑費'], unused.pk))
+        self.assertIn(str(unused.pk), classifier.get_model(self.family.pk)['docs'])
+
+        unused.delete()
+
+        self.assertNotIn(str(unused.pk), classifier.get_model(self.family.pk)['docs'])
+
+        self.assertNotIn(str(unused.pk), self.stored()['docs'])
+        self.assertNotIn('雑費', self.stored()['vocabulary'])
+
+    def test_saving_updates_only_the_memo_tokens(self):
+        classifier.get_model(self.family.pk)
+        with CaptureQueriesContext(connection) as first:
+            self.add(800, description='ランチ')
+        for i in range(20):
+            self.add(100, self.daily, description=f'xqz {i}')
+
+        with CaptureQueriesContext(connection) as queries:
+            self.add(800, description='ランチ')
+        self.assertEqual(len(queries), len(first))
+        # The other memos are neither read nor written again
+        self.assertFalse([query for query in queries if 'xq' in query['sql']])
+        self.assertMatchesHistory()
+
+    def test_api(self):
+        response = self.client.get(reverse('api_category_suggestions'), {'q': 'スーパー'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['suggestions'][0]['id'], self.category.pk)
+
+
+class BudgetUsageTests(FamilyTestCase):
+    def setUp(self):
+        super().setUp()
+        usd = Currency.objects.get(code='USD')
+        ExchangeRate.objects.create(currency=usd, date=date(2026, 1, 1), rate=Decimal('0.0067'))
+        self.budget = Budget.objects.create(
+            family=self.family, category=self.category, year=2026, month=1, amount=5000
+        )
+        self.add(1000)
+        # 10 USD at 0.0067 per yen
+        self.add(Decimal('10.00'), currency=usd)
+
+    def test_model(self):
+        budget = Budget.objects.get(pk=self.budget.pk)
+
+        self.assertEqual(budget.get_used_amount(), Decimal('2492.54'))
+        self.assertEqual(budget.get_remaining_amount(), Decimal('2507.46'))
+
+    def test_manage_budgets_page(self):
+        daily = Category.objects.create(family=self.family, name='日用品', category_type='expense')
+        Budget.objects.create(family=self.family, category=daily, year=2026, month=1, amount=3000)
+        self.add(800, daily)
+
+        # Used amounts of all budgets come from one grouped query
+        with self.assertNumQueries(6):
+            response = self.client.get(reverse('manage_budgets'), {'year': 2026, 'month': 1})
+
+        used = {budget.category_id: budget.get_used_amount() for budget in response.context['budgets']}
+        self.assertEqual(used, {self.category.pk: Decimal('2492.54'), daily.pk: 800})
+        self.assertContains(response, '¥2492.54')
+        self.assertContains(response, '¥2507.46')
+
+    def test_dashboard_section(self):
+        response = self.client.get(
+            reverse('dashboard_section', args=['budgets']), {'year': 2026, 'month': 1}
+        )
+
+        data, = response.context['budget_data']
+        self.assertEqual(data['used'], Decimal('2492.54'))
+        self.assertEqual(data['remaining'], Decimal('2507.46'))
+
+    def test_admin_changelist(self):
+        usd = Currency.objects.get(code='USD')
+        family = Family.objects.create(name='Smith', currency=usd)
+        category = Category.objects.create(family=family, name='Food', category_type='expense')
+        Budget.objects.create(family=family, category=category, year=2026, month=1, amount=100)
+        # 1000 yen in a dollar family
+        Transaction.objects.create(
+            family=family, category=category, transaction_type='expense', amount=1000,
+            currency=Currency.objects.get(code='JPY'), date=date(2026, 1, 15),
+        )
+        self.user.is_staff = self.user.is_superuser = True
+        self.user.save()
+
+        response = self.client.get(reverse('admin:budget_budget_changelist'))
+
+        self.assertContains(response, '¥2,493 / ¥5,000 (49.9%)')
+        self.assertContains(response, '$6.70 / $100.00 (6.7%)')
+
+
+class AdminChangelistQueryTests(FamilyTestCase):
+    """管理画面の一覧のクエリ数が行数によらず一定であること"""
+
+    def setUp(self):
+        super().setUp()
+        self.user.is_staff = self.user.is_superuser = True
+        self.user.save()
+        self.index = 0
+
+    def family_rows(self):
+        """行ごとに別の家族・メンバー・カテゴリー（外部キーの N+1 を見逃さない）"""
+        self.index += 1
+        i = self.index
+        user = User.objects.create_user(f'user{i}')
+        family = Family.objects.create(name=f'家族{i}', currency=Currency.objects.get(code='JPY'))
+        return SimpleNamespace(
+            family=family,
+            member=FamilyMember.objects.create(user=user, family=family, nickname=f'member{i}'),
+            category=Category.objects.create(family=family, name='食費', category_type='expense'),
+            currency=Currency.objects.create(code=f'X{i:02d}', name=f'Currency {i}', symbol='¤'),
+        )
+
+    def build(self, model):
+        row = self.family_rows()
+        common = {'family': row.family, 'category': row.category}
+        if model is Family:
+            return row.family
+        if model is FamilyMember:
+            return row.member
+        if model is Category:
+            return row.category
+        if model is Currency:
+            return row.currency
+        if model is ExchangeRate:
+            return ExchangeRate.objects.create(currency=row.currency, date=date(2026, 1, 1), rate=1)
+        if model is PaymentMethod:
+            return PaymentMethod.objects.create(family=row.family, name='現金', method_type='cash')
+        if model is Transaction:
+            return Transaction.objects.create(
+                member=row.member, transaction_type='expense', amount=100, date=date(2026, 1, 15), **common
+            )
+        if model is CashSaving:
+            return CashSaving.objects.create(family=row.family, member=row.member, amount=100)
+        if model is Budget:
+            Transaction.objects.create(
+                transaction_type='expense', amount=100, date=date(2026, 1, 15), **common
+            )
+            return Budget.objects.create(year=2026, month=1, amount=1000, **common)
+        if model is RecurringTemplate:
+            return RecurringTemplate.objects.create(
+                member=row.member, transaction_type='expense', amount=100, frequency='monthly',
+                start_date=date(2026, 1, 1), **common
+            )
+        if model is SpendingAnomaly:
+            return SpendingAnomaly.objects.create(
+                kind='monthly_spike', period_start=date(2026, 1, 1), amount=300, baseline=100, **common
+            )
+        if model is EmailNotificationSettings:
+            return EmailNotificationSettings.objects.create(family=row.family, notification_emails='a@example.com')
+        raise AssertionError(model)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        for model in [
+            Currency, ExchangeRate, Family, FamilyMember, Category, PaymentMethod, Transaction,
+            CashSaving, Budget, RecurringTemplate, SpendingAnomaly, EmailNotificationSettings,
+        ]:
+            with self.subTest(model=model.__name__):
+                url = reverse(f'admin:budget_{model._meta.model_name}_changelist')
+                self.build(model)
+                with CaptureQueriesContext(connection) as one_row:
+                    self.assertEqual(self.client.get(url).status_code, 200)
+
+                for _i in range(5):
+                    self.build(model)
+                with self.assertNumQueries(len(one_row)):
+                    response = self.client.get(url)
+                self.assertGreaterEqual(response.context['cl'].result_count, 6)
+
+
+class LoadExchangeRatesTests(FamilyTestCase):
+    def load(self, text):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False, encoding='utf-8') as f:
+            f.write(text)
+        self.addCleanup(os.remove, f.name)
+        call_command('load_exchange_rates', f.name, stdout=io.StringIO())
+
+    def version(self, family):
+        return Family.objects.values_list('data_version', flat=True).get(pk=family.pk)
+
+    def test_families_converting_from_or_to_the_currency_are_invalidated(self):
+        usd, eur = Currency.objects.get(code='USD'), Currency.objects.get(code='EUR')
+        self.add(Decimal('10.00'), currency=usd)
+        dollar_family = Family.objects.create(name='Smith', currency=usd)
+        euro_family = Family.objects.create(name='Müller', currency=eur)
+        before = {family.pk: self.version(family) for family in (self.family, dollar_family, euro_family)}
+
+        self.load('date,currency,rate\n2026-01-01,USD,0.0066\n2026-01-03,USD,0.0068\n')
+
+        self.assertGreater(self.version(self.family), before[self.family.pk])
+        self.assertGreater(self.version(dollar_family), before[dollar_family.pk])
+        self.assertEqual(self.version(euro_family), before[euro_family.pk])
+        self.assertEqual(
+            list(ExchangeRate.objects.filter(currency=usd).values_list('rate', flat=True).order_by('date')),
+            [Decimal('0.0066'), Decimal('0.0067'), Decimal('0.0068')],
+        )
+
+
+class FamilyAmountTests(FamilyTestCase):
+    def test_base_currency_is_looked_up_per_query(self):
+        usd = Currency.objects.get(code='USD')
+        ExchangeRate.objects.create(currency=usd, date=date(2026, 1, 1), rate=Decimal('0.0067'))
+        # A family without a currency counts in JPY
+        family = Family.objects.create(name='未設定')
+        category = Category.objects.create(family=family, name='食費', category_type='expense')
+        Transaction.objects.create(
+            family=family, category=category, transaction_type='expense',
+            amount=Decimal('10.00'), currency=usd, date=date(2026, 1, 15),
+        )
+
+        def total():
+            return Transaction.objects.filter(family=family).aggregate(
+                total=MinorSum(family_amount(family))
+            )['total']
+
+        self.assertEqual(total(), 149254)
+        # Re-seeded base currency with a new pk
+        Currency.objects.filter(code='JPY').update(code='JPX', exchange_rate=2)
+        Currency.objects.create(code='JPY', name='Japanese Yen', symbol='¥', exchange_rate=1)
+        self.assertEqual(total(), 149254)
+
+
+class UsageCounterTests(FamilyTestCase):
+    def setUp(self):
+        super().setUp()
+        self.daily = Category.objects.create(family=self.family, name='日用品', category_type='expense')
+        self.card = PaymentMethod.objects.create(family=self.family, name='カード', method_type='credit')
+        self.cash = PaymentMethod.objects.create(family=self.family, name='現金', method_type='cash')
+
+    def assertUsage(self, obj, count, *created):
+        obj.refresh_from_db()
+        self.assertEqual(obj.usage_count, count)
+        # Scores are large floats: compare up to the rounding of today's weight
+        score = sum(usage_weight(moment) for moment in created)
+        self.assertAlmostEqual(
+            obj.usage_score, score, delta=usage_weight(datetime.now(dt_timezone.utc)) * 1e-9
+        )
+
+    def add_at(self, moment, category=None, **fields):
+        with mock.patch('django.utils.timezone.now', return_value=moment):
+            return self.add(100, category, **fields)
+
+    def test_created_transactions_count(self):
+        first = self.add(100, payment_method=self.card)
+        second = self.add(200, payment_method=self.card)
+
+        self.assertUsage(self.category, 2, first.created_at, second.created_at)
+        self.assertUsage(self.card, 2, first.created_at, second.created_at)
+        self.assertUsage(self.daily, 0)
+        self.assertEqual(self.category.last_used_at, second.created_at)
+
+    def test_edit_moves_the_use(self):
+        self.add(100, payment_method=self.card)
+        transaction = Transaction.objects.get()
+
+        transaction.category = self.daily
+        transaction.payment_method = self.cash
+        transaction.save()
+
+        self.assertUsage(self.category, 0)
+        self.assertUsage(self.card, 0)
+        self.assertUsage(self.daily, 1, transaction.created_at)
+        self.assertUsage(self.cash, 1, transaction.created_at)
+
+        # Saving again without a change counts nothing
+        transaction.description = 'メモ'
+        transaction.save()
+        self.assertUsage(self.daily, 1, transaction.created_at)
+
+    def test_delete_takes_the_use_back(self):
+        kept = self.add(100, payment_method=self.card)
+        Transaction.objects.get(pk=self.add(200, payment_method=self.card).pk).delete()
+
+        self.assertUsage(self.category, 1, kept.created_at)
+        self.assertUsage(self.card, 1, kept.created_at)
+
+    def test_recent_uses_outrank_old_ones(self):
+        now = datetime(2026, 1, 20, 12, tzinfo=dt_timezone.utc)
+        # Three uses four half-lives ago weigh less than one use today
+        for _i in range(3):
+            self.add_at(now - timedelta(days=120), payment_method=self.cash)
+        self.add_at(now, self.daily, payment_method=self.card)
+
+        response = self.client.get(reverse('quick_add_transaction'))
+        self.assertEqual(
+            [category['id'] for category in response.context['frequent_categories']],
+            [self.daily.pk, self.category.pk],
+        )
+
+        response = self.client.get(reverse('preset_transaction', args=[self.category.pk]))
+        self.assertEqual(
+            [method.pk for method in response.context['common_methods']], [self.card.pk, self.cash.pk]
+        )
+
+    def test_delete_guard_does_not_trust_the_counters(self):
+        transaction = self.add(100, payment_method=self.card)
+        # Counters off, as after a bulk import
+        PaymentMethod.objects.filter(pk=self.card.pk).update(usage_count=0, usage_score=0)
+        Category.objects.filter(pk=self.category.pk).update(usage_count=0, usage_score=0)
+
+        response = self.client.get(reverse('delete_payment_method', args=[self.card.pk]))
+        self.assertTrue(response.context['in_use'])
+        self.client.post(reverse('delete_payment_method', args=[self.card.pk]))
+        self.client.post(reverse('delete_category', args=[self.category.pk]))
+
+        transaction.refresh_from_db()
+        self.assertEqual(transaction.payment_method_id, self.card.pk)
+        self.assertTrue(Category.objects.filter(pk=self.category.pk).exists())
+
+        self.client.post(reverse('delete_payment_method', args=[self.cash.pk]))
+        self.assertFalse(PaymentMethod.objects.filter(pk=self.cash.pk).exists())
+
+
+class FamilyContextTests(FamilyTestCase):
+    def context(self):
+        return get_family_member(SimpleNamespace(user=self.user))
+
+    def as_other_worker(self, change):
+        """change() を別プロセスで行ったように、このプロセスのキャッシュを古いまま残す"""
+        key = f'family-context:{self.user.pk}'
+        self.context()
+        stale = cache.get(key)
+        self.assertIsNotNone(stale)
+        change()
+        cache.set(key, stale)
+
+    def test_cached_context_costs_one_small_query(self):
+        with self.assertNumQueries(1):
+            first = self.context()
+        # A new request: checked against the membership row only
+        with self.assertNumQueries(1):
+            second = self.context()
+
+        self.assertEqual(second.pk, self.member.pk)
+        self.assertEqual(second.family.currency.code, 'JPY')
+        self.assertIs(second.user, self.user)
+        self.assertEqual(first.family.data_version, second.family.data_version)
+
+    def test_removed_member_loses_access(self):
+        self.as_other_worker(lambda: FamilyMember.objects.filter(pk=self.member.pk).delete())
+
+        self.assertIsNone(self.context())
+        self.assertRedirects(
+            self.client.get(reverse('dashboard')), reverse('setup_profile'), fetch_redirect_response=False
+        )
+
+    def test_moving_to_another_family(self):
+        other = Family.objects.create(name='佐藤家', currency=Currency.objects.get(code='USD'))
+        self.as_other_worker(lambda: FamilyMember.objects.filter(pk=self.member.pk).update(family=other))
+
+        member = self.context()
+        self.assertEqual(member.family_id, other.pk)
+        self.assertEqual(member.family.get_currency_code(), 'USD')
+
+    def test_family_currency_change_shows_through(self):
+        def change():
+            self.family.currency = Currency.objects.get(code='USD')
+            self.family.save()
+        self.as_other_worker(change)
+
+        self.assertEqual(self.context().family.get_currency_symbol(), '$')
+
+    def test_currency_edit_shows_through(self):
+        def change():
+            yen = Currency.objects.get(code='JPY')
+            yen.symbol = '円'
+            yen.save()
+        self.as_other_worker(change)
+
+        self.assertEqual(self.context().family.get_currency_symbol(), '円')
+
+
+class AdmissionControlTests(FamilyTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client_mock = mock.Mock()
+        self.client_mock.generate_content.return_value = SimpleNamespace(text='**節約できます**')
+        patcher = mock.patch('budget.ai_backends.get_client', return_value=self.client_mock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.family_bucket = ai_limits.TokenBucket('family', 2, 60 * 60)
+        patcher = mock.patch.object(ai_limits, 'family_bucket', self.family_bucket)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def analyse(self, prompt, family_id=None):
+        return ai.generate_analysis(prompt, 'test-key', family_id or self.family.pk)
+
+    def test_bucket_refills_over_time(self):
+        bucket = ai_limits.TokenBucket('test', 2, 60)
+        with mock.patch('budget.ai_limits.time.time') as clock:
+            clock.return_value = 1000.0
+            self.assertEqual(bucket.take('k'), 0)
+            self.assertEqual(bucket.take('k'), 0)
+            # One token every 30 seconds
+            self.assertAlmostEqual(bucket.take('k'), 30)
+            clock.return_value = 1015.0
+            self.assertAlmostEqual(bucket.take('k'), 15)
+            clock.return_value = 1030.0
+            self.assertEqual(bucket.take('k'), 0)
+            bucket.give_back('k')
+            self.assertEqual(bucket.take('k'), 0)
+            # Never more than the capacity
+            clock.return_value = 10000.0
+            self.assertEqual([bucket.take('k') for _i in range(2)], [0, 0])
+            self.assertGreater(bucket.take('k'), 0)
+
+    def test_family_limit(self):
+        self.assertIn('<strong>節約できます</strong>', self.analyse('first'))
+        self.analyse('second')
+
+        with self.assertRaises(AIBusy) as raised:
+            self.analyse('third')
+        self.assertEqual(raised.exception.retry_after, 1800)
+        # The same prompt comes from the result cache, without a token
+        self.analyse('first')
+        # Other families have their own bucket
+        self.analyse('third', family_id=self.family.pk + 1)
+        self.assertEqual(self.client_mock.generate_content.call_count, 3)
+
+    def test_busy_response(self):
+        url = reverse('ai_narrative')
+        self.assertEqual(self.client.post(url, {'months': 3}).status_code, 200)
+        self.assertEqual(self.client.post(url, {'months': 6}).status_code, 200)
+
+        response = self.client.post(url, {'months': 12})
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '1800')
+        self.assertContains(response, '1800', status_code=429)
+        self.assertEqual(self.client_mock.generate_content.call_count, 2)
+
+    def test_no_free_slot_gives_the_tokens_back(self):
+        slots = threading.BoundedSemaphore(1)
+        slots.acquire()
+        with mock.patch.object(ai_limits, '_slots', slots), mock.patch.object(ai_limits, 'QUEUE_TIMEOUT', 0.01):
+            with self.assertRaises(AIBusy):
+                self.analyse('first')
+
+        self.analyse('first')
+        self.analyse('second')
+        self.client_mock.generate_content.assert_called()
+
+    def test_identical_analyses_in_flight_share_one_call(self):
+        started, release = threading.Event(), threading.Event()
+        calls, results = [], []
+
+        def call():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            # Empty answers are not cached, so only coalescing can share it
+            return ''
+
+        def run():
+            results.append(ai_limits.run_limited(self.family.pk, 'test-key', 'same', call))
+
+        threads = [threading.Thread(target=run) for _i in range(3)]
+        threads[0].start()
+        self.assertTrue(started.wait(5))
+        for thread in threads[1:]:
+            thread.start()
+        release.wait(0.2)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['', '', ''])
@@ -0,0 +1,137 @@
+"""Daily running-balance timeline.
+
+Daily flows and their running totals come from a single SQL query: the
+transactions and cash savings are unioned, grouped per day and accumulated
+with ``SUM() OVER (ORDER BY day)``, so the database does the pass over the
+whole history and only the days inside the requested range are returned
+(plus the last day before it, which carries the opening balance). The union
+is built with the ORM so transaction amounts are converted to the family's
+currency by family_amount() (see exchange.py).
+
+Long ranges are then downsampled into equal buckets of whole days: flows are
+summed per bucket and the running totals are taken at the end of each
+bucket, so a 10-year range still comes back as a few hundred points.
+"""
+from datetime import date, timedelta
+
+from django.db import connection
+from django.db.models import Case, F, Value, When
+
+from .exchange import family_amount
+from .models import CashSaving, Transaction
+from .money import to_number
+
+# Points returned when the client does not ask for a number
+DEFAULT_POINTS = 366
+MAX_POINTS = 2000
+
+FIELDS = ['date', 'income', 'expense', 'cash_saving', 'insurance_saving', 'net', 'balance', 'savings']
+
+# flows: (day, income, expense, cash_saving, insurance_saving), see _flows()
+TIMELINE_SQL = """
+WITH flows (day, income, expense, cash_saving, insurance_saving) AS (
+    {flows}
+),
+daily AS (
+    SELECT day,
+           SUM(income) AS income,
+           SUM(expense) AS expense,
+           SUM(cash_saving) AS cash_saving,
+           SUM(insurance_saving) AS insurance_saving
+    FROM flows
+    GROUP BY day
+),
+running AS (
+    SELECT day, income, expense, cash_saving, insurance_saving,
+           SUM(income - expense - cash_saving) OVER w AS balance,
+           SUM(cash_saving + insurance_saving) OVER w AS savings
+    FROM daily
+    WINDOW w AS (ORDER BY day ROWS UNBOUNDED PRECEDING)
+)
+SELECT day, income, expense, cash_saving, insurance_saving, balance, savings
+FROM running
+WHERE day >= COALESCE((SELECT MAX(day) FROM daily WHERE day < %s), %s)
+ORDER BY day
+"""
+
+
+def _flows(family, end):
+    """取引と現金貯蓄の UNION ALL（SQL とパラメーター）"""
+    amount = family_amount(family)
+    zero = Value(0)
+    transactions = Transaction.objects.filter(family=family, date__lte=end).order_by().values_list(
+        'date',
+        Case(When(transaction_type='income', then=amount), default=zero),
+        Case(When(transaction_type='expense', then=amount), default=zero),
+        zero,
+        Case(When(is_insurance_saving=True, then=amount), default=zero),
+    )
+    cash_savings = CashSaving.objects.filter(family=family, date__lte=end).order_by().values_list(
+        'date', zero, zero, F('amount'), zero,
+    )
+    return transactions.union(cash_savings, all=True).query.sql_with_params()
+
+
+def _to_date(value):
+    # SQLite hands dates back as text
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+
+def daily_rows(family, start, end):
+    """(opening, rows): 期間前の累計 (balance, savings) と日別の
+    (day, income, expense, cash_saving, insurance_saving, balance, savings)（最小単位）"""
+    flows, params = _flows(family, end)
+    with connection.cursor() as cursor:
+        cursor.execute(TIMELINE_SQL.format(flows=flows), (*params, start, start))
+        raw = cursor.fetchall()
+
+    opening = (0, 0)
+    rows = []
+    for day, *amounts in raw:
+        day = _to_date(day)
+        # Raw column values: integer minor units (see money.py)
+        amounts = [int(amount or 0) for amount in amounts]
+        if day < start:
+            opening = (amounts[4], amounts[5])
+        else:
+            rows.append((day, *amounts))
+    return opening, rows
+
+
+def bucket_days(start, end, points):
+    """1点あたりの日数（期間を points 点以内に収める）"""
+    days = (end - start).days + 1
+    return max(1, -(-days // max(1, points)))
+
+
+def timeline(family, start, end, points=DEFAULT_POINTS):
+    """start〜end の残高推移（FIELDS 順の行、bucket 日ごと）"""
+    opening, rows = daily_rows(family, start, end)
+    size = bucket_days(start, end, points)
+    count = -(-((end - start).days + 1) // size)
+
+    balance, savings = opening
+    buckets = []
+    for i in range(count):
+        bucket_start = start + timedelta(days=i * size)
+        buckets.append([bucket_start.isoformat(), 0, 0, 0, 0, 0, balance, savings])
+
+    for day, income, expense, cash_saving, insurance_saving, balance, savings in rows:
+        bucket = buckets[(day - start).days // size]
+        bucket[1] += income
+        bucket[2] += expense
+        bucket[3] += cash_saving
+        bucket[4] += insurance_saving
+        bucket[5] += income - expense - cash_saving
+        bucket[6] = balance
+        bucket[7] = savings
+
+    # Buckets without activity carry the running totals forward
+    for previous, bucket in zip(buckets, buckets[1:]):
+        if not any(bucket[1:5]):
+            bucket[6], bucket[7] = previous[6], previous[7]
+
+    for bucket in buckets:
+        bucket[1:] = [to_number(value) for value in bucket[1:]]
+
+    return {'bucket_days': size, 'fields': FIELDS, 'rows': buckets}
@@ -0,0 +1,201 @@
+"""Monthly trends per category.
+
+Monthly totals for the last SERIES_MONTHS complete months come from one
+grouped query and are laid out as one dense array per category (months
+without spending are 0). On those arrays:
+
+* 3/6/12-month moving averages, via prefix sums, counted from the month the
+  category was first used so older empty months don't drag them down;
+* the trend slope: least-squares fit over the last TREND_MONTHS months,
+  per month and as a percentage of the 12-month average;
+* a seasonality index per calendar month (average of that month / overall
+  average), once there are MIN_SEASONAL_MONTHS of history;
+* the expected spend for the coming month: the 6-month average scaled by
+  the coming month's seasonality index.
+
+Sums and series are integer minor units (see money.py) until analyse()
+returns them as plain numbers.
+"""
+from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.db.models.functions import TruncMonth
+from django.utils import timezone
+
+from .conditional import family_cache_key
+from .exchange import family_amount
+from .models import CashSaving, Transaction, to_year_month
+from .money import SCALE, MinorSum, to_number
+
+TRENDS_TIMEOUT = getattr(settings, 'TRENDS_CACHE_SECONDS', 60 * 60)
+
+SERIES_MONTHS = 36
+WINDOWS = (3, 6, 12)
+TREND_MONTHS = 12
+MIN_SEASONAL_MONTHS = 24
+
+
+def month_list(today, count):
+    """today の前月までの count ヶ月（古い順、各月1日）"""
+    this_month = today.replace(day=1)
+    return [this_month - relativedelta(months=count - i) for i in range(count)]
+
+
+def moving_average(values, window):
+    """各月までの直近 window ヶ月の平均（月数が足りなければ None）"""
+    prefix = [0]
+    for value in values:
+        prefix.append(prefix[-1] + value)
+    return [
+        (prefix[i + 1] - prefix[i + 1 - window]) / window if i + 1 >= window else None
+        for i in range(len(values))
+    ]
+
+
+def slope(values):
+    """最小二乗法による1ヶ月あたりの増減"""
+    n = len(values)
+    if n < 2:
+        return 0.0
+    mean_x = (n - 1) / 2
+    mean_y = sum(values) / n
+    covariance = sum((x - mean_x) * (y - mean_y) for x, y in enumerate(values))
+    variance = sum((x - mean_x) ** 2 for x in range(n))
+    return covariance / variance
+
+
+def seasonality(months, values):
+    """暦月ごとの季節指数（1.0 = 平均的な月、履歴が足りなければ None）"""
+    if len(values) < MIN_SEASONAL_MONTHS:
+        return None
+    overall = sum(values) / len(values)
+    if not overall:
+        return None
+    by_month = [[] for _ in range(12)]
+    for month, value in zip(months, values):
+        by_month[month.month - 1].append(value)
+    return [
+        round(sum(bucket) / len(bucket) / overall, 3) if bucket else 1.0
+        for bucket in by_month
+    ]
+
+
+def analyse(months, values, next_month):
+    """1系列の移動平均・傾き・季節指数・翌月の見込み"""
+    first = next((i for i, value in enumerate(values) if value), len(values))
+    active_months, active = months[first:], values[first:]
+
+    # Keyed by str(window) so the result survives a JSON round trip unchanged
+    averages = {str(w): [None] * first + moving_average(active, w) for w in WINDOWS}
+    latest = {window: values[-1] if values else None for window, values in averages.items()}
+
+    recent = active[-TREND_MONTHS:]
+    per_month = slope(recent)
+    mean = sum(recent) / len(recent) if recent else 0
+    indexes = seasonality(active_months, active)
+
+    # Fall back to shorter averages while the history is short
+    level = next((latest[w] for w in ('6', '3') if latest[w] is not None), mean)
+    expected = level * indexes[next_month.month - 1] if indexes else level
+
+    def major(value):
+        return None if value is None else round(value / SCALE, 2)
+
+    return {
+        'values': [to_number(value) for value in values],
+        'moving_averages': {w: [major(v) for v in series] for w, series in averages.items()},
+        'latest': {w: major(value) for w, value in latest.items()},
+        'slope': round(per_month / SCALE, 1),
+        'trend_percent': round(per_month / mean * 100, 1) if mean else None,
+        'seasonality': indexes,
+        'expected': to_number(round(expected)),
+        'history_months': len(active),
+    }
+
+
+def category_trends(family, today=None, count=SERIES_MONTHS, transaction_type='expense'):
+    """カテゴリー別の月次推移と分析（直近 count ヶ月の完了月）"""
+    today = today or timezone.now().date()
+    months = month_list(today, count)
+    index = {month: i for i, month in enumerate(months)}
+
+    rows = Transaction.objects.filter(
+        family=family,
+        transaction_type=transaction_type,
+        date__gte=months[0],
+        date__lt=today.replace(day=1)
+    ).annotate(month=TruncMonth('date')).values(
+        'month', 'category_id', 'category__name'
+    ).annotate(total=MinorSum(family_amount(family))).order_by()
+
+    series = {}
+    for row in rows:
+        entry = series.setdefault(row['category_id'], {
+            'category_id': row['category_id'],
+            'category': row['category__name'],
+            'values': [0] * count,
+        })
+        entry['values'][index[row['month']]] = row['total']
+
+    next_month = today.replace(day=1)
+    categories = [
+        {'category_id': entry['category_id'], 'category': entry['category'],
+         **analyse(months, entry['values'], next_month)}
+        for entry in series.values()
+    ]
+    categories.sort(key=lambda entry: entry['latest']['3'] or 0, reverse=True)
+
+    return {
+        'months': [month.strftime('%Y-%m') for month in months],
+        'next_month': next_month.strftime('%Y-%m'),
+        'categories': categories,
+    }
+
+
+def get_category_trends(request, family, transaction_type='expense'):
+    """category_trends() をデータバージョン単位でキャッシュ"""
+    today = timezone.now().date()
+    cache_key = family_cache_key(request, 'trends', today.strftime('%Y-%m'), transaction_type)
+    data = cache.get(cache_key)
+    if data is None:
+        data = category_trends(family, today, transaction_type=transaction_type)
+        cache.set(cache_key, data, TRENDS_TIMEOUT)
+    return data
+
+
+def monthly_totals(family, today=None, count=12, exclude_recurring=False):
+    """直近 count ヶ月（完了月）の収入・支出・保険積立・現金貯蓄の月別配列（最小単位、2クエリ）"""
+    today = today or timezone.now().date()
+    months = month_list(today, count)
+    index = {month: i for i, month in enumerate(months)}
+    end = today.replace(day=1)
+
+    transactions = Transaction.objects.filter(
+        family=family,
+        year_month__gte=to_year_month(months[0]),
+        year_month__lt=to_year_month(end)
+    )
+    if exclude_recurring:
+        transactions = transactions.filter(is_recurring=False)
+    amount = family_amount(family)
+    rows = transactions.values('year_month').annotate(
+        income=MinorSum(amount, filter=Q(transaction_type='income')),
+        expense=MinorSum(amount, filter=Q(transaction_type='expense')),
+        insurance=MinorSum(amount, filter=Q(is_insurance_saving=True)),
+    ).order_by()
+
+    month_index = {to_year_month(month): i for i, month in enumerate(months)}
+    totals = {name: [0] * count for name in ('income', 'expense', 'insurance', 'cash_saving')}
+    for row in rows:
+        for name in ('income', 'expense', 'insurance'):
+            totals[name][month_index[row['year_month']]] = row[name] or 0
+
+    savings = CashSaving.objects.filter(
+        family=family, date__gte=months[0], date__lt=end
+    ).annotate(month=TruncMonth('date')).values('month').annotate(total=MinorSum('amount')).order_by()
+    for row in savings:
+        totals['cash_saving'][index[row['month']]] = row['total']
+
+    totals['months'] = months
+    return totals
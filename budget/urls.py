@@ -1,6 +1,6 @@
 # urls.py - Updated URL patterns
 from django.urls import path
-from . import views, setup_views, auth_views
+from . import views, setup_views, auth_views, api_views
 
 urlpatterns = [
     # 認証
@@ -16,8 +16,11 @@ urlpatterns = [
 
     # ダッシュボード
     path('dashboard/', views.dashboard, name='dashboard'),
+    path('dashboard/sections/<slug:section>/', views.dashboard_section, name='dashboard_section'),
     path('transactions/', views.transaction_list, name='transaction_list'),
     path('savings/', views.savings_summary, name='savings_summary'),
+    path('reports/annual/', views.annual_report, name='annual_report'),
+    path('reports/members/', views.member_report, name='member_report'),
 
     # クイック入力
     path('quick-add/', views.quick_add_transaction, name='quick_add_transaction'),
@@ -53,6 +56,7 @@ urlpatterns = [
     path('export/', setup_views.export_data, name='export_data'),
     path('currency/', setup_views.currency_settings, name='currency'),
     path('ai/', views.ai_spending_analysis, name='ai'),
+    path('ai/narrative/', views.ai_narrative, name='ai_narrative'),
 
     # 削除
     path('transaction/<int:transaction_id>/delete/', views.delete_transaction, name='delete_transaction'),
@@ -61,6 +65,7 @@ urlpatterns = [
     path('recurring/', views.manage_recurring, name='manage_recurring'),
     path('recurring/add/', views.add_recurring, name='add_recurring'),
     path('recurring/generate/', views.generate_all_recurring, name='generate_all_recurring'),
+    path('recurring/upcoming/', views.upcoming_recurring, name='upcoming_recurring'),
     path('recurring/<int:template_id>/toggle/', views.toggle_recurring, name='toggle_recurring'),
 
     # API Key
@@ -76,4 +81,16 @@ urlpatterns = [
 
 urlpatterns += [
     path('manifest.json', views.manifest, name='manifest'),
+]
+
+# JSON API (PWA sync)
+urlpatterns += [
+    path('api/v1/sync/', api_views.sync, name='api_sync'),
+    path('api/v1/summaries/', api_views.monthly_summaries, name='api_monthly_summaries'),
+    path('api/v1/timeline/', api_views.timeline, name='api_timeline'),
+    path('api/v1/reports/annual/', api_views.annual_report, name='api_annual_report'),
+    path('api/v1/reports/members/', api_views.members, name='api_members'),
+    path('api/v1/heatmap/', api_views.heatmap, name='api_heatmap'),
+    path('api/v1/trends/', api_views.trends, name='api_trends'),
+    path('api/v1/categories/suggest/', api_views.category_suggestions, name='api_category_suggestions'),
 ]
\ No newline at end of file
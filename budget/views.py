@@ -1,82 +1,84 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
+from django.core.cache import cache
 from django.db.models import Sum, Q
+from django.db.models.functions import TruncMonth
 from django.utils import timezone
-from django.utils.safestring import mark_safe
-from django.utils.translation import gettext as _, get_language
+from django.utils.translation import gettext as _
 from django.conf import settings
 from django.contrib import messages
-from django.db import models
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, Http404
+from django.utils.html import format_html
+from django.views.decorators.http import require_GET, require_POST
 from django import forms
 from datetime import datetime, timedelta
 from decimal import Decimal
+from dateutil.relativedelta import relativedelta
 from .models import (
-    Family, FamilyMember, Transaction, CashSaving,
-    Category, Budget, PaymentMethod, EmailNotificationSettings, RecurringTemplate
+    Family, Transaction, CashSaving,
+    Category, Budget, PaymentMethod, EmailNotificationSettings, RecurringTemplate,
+    SpendingAnomaly, to_year_month
 )
-from .forms import QuickTransactionForm, CashSavingForm
-
+from .forms import AmountForm, CashSavingForm, CurrencyAmountMixin, QuickTransactionForm
+from .conditional import conditional_page, family_cache_key
+from .exchange import family_amount
+from .money import MinorSum, amount_step, from_minor, to_number
+from .family_context import family_required
+from . import ai, contributions, insights, projections, reports, suggestions, trends
+from .ai_limits import AIBusy
+
+import io
 import json
-import markdown
 
-import google.generativeai as genai
+def _month_range(year, month):
+    """月の範囲 [start_date, end_date)"""
+    start_date = datetime(year, month, 1).date()
+    if month == 12:
+        end_date = datetime(year + 1, 1, 1).date()
+    else:
+        end_date = datetime(year, month + 1, 1).date()
+    return start_date, end_date
 
-# Configure Gemini
-genai.configure(api_key=settings.GEMINI_API_KEY)
 
-@login_required
-def dashboard(request):
-    """ダッシュボード - 月次サマリー"""
-    try:
-        member = request.user.familymember
-        family = member.family
-    except FamilyMember.DoesNotExist:
-        return redirect('setup_profile')
-
-    # 現在の年月
+def _dashboard_month(request):
     today = timezone.now().date()
     year = int(request.GET.get('year', today.year))
     month = int(request.GET.get('month', today.month))
+    return year, month
 
-    # 月の範囲
-    start_date = datetime(year, month, 1).date()
-    if month == 12:
-        end_date = datetime(year + 1, 1, 1).date()
-    else:
-        end_date = datetime(year, month + 1, 1).date()
 
-    # 今月の収入
-    income_total = Transaction.objects.filter(
-        family=family,
-        transaction_type='income',
-        date__gte=start_date,
-        date__lt=end_date
-    ).aggregate(total=Sum('amount'))['total'] or Decimal('0')
+@login_required
+@family_required
+@conditional_page
+def dashboard(request):
+    """ダッシュボード - 月次サマリー（グラフ・内訳・予算・最近の取引は後から読み込む）"""
+    member = request.member
+    family = request.family
 
-    # 今月の支出（保険型積立を含む）
-    expense_total = Transaction.objects.filter(
+    # 現在の年月
+    year, month = _dashboard_month(request)
+    start_date, end_date = _month_range(year, month)
+
+    # 今月の収入・支出（保険型積立を含む）・保険型積立
+    amount = family_amount(family)
+    totals = Transaction.objects.filter(
         family=family,
-        transaction_type='expense',
-        date__gte=start_date,
-        date__lt=end_date
-    ).aggregate(total=Sum('amount'))['total'] or Decimal('0')
+        year_month=year * 100 + month
+    ).aggregate(
+        income=MinorSum(amount, filter=Q(transaction_type='income')),
+        expense=MinorSum(amount, filter=Q(transaction_type='expense')),
+        insurance_saving=MinorSum(amount, filter=Q(is_insurance_saving=True)),
+    )
+    income_total = totals['income'] or 0
+    expense_total = totals['expense'] or 0
+    insurance_saving_total = totals['insurance_saving'] or 0
 
     # 今月の現金貯蓄
     cash_saving_total = CashSaving.objects.filter(
         family=family,
         date__gte=start_date,
         date__lt=end_date
-    ).aggregate(total=Sum('amount'))['total'] or Decimal('0')
-
-    # 今月の保険型積立
-    insurance_saving_total = Transaction.objects.filter(
-        family=family,
-        transaction_type='expense',
-        category__is_insurance_saving=True,
-        date__gte=start_date,
-        date__lt=end_date
-    ).aggregate(total=Sum('amount'))['total'] or Decimal('0')
+    ).aggregate(total=MinorSum('amount'))['total'] or 0
 
     # 月次収支
     balance = income_total - expense_total - cash_saving_total
@@ -84,46 +86,6 @@ def dashboard(request):
     # 総貯蓄額（長期）
     total_savings = cash_saving_total + insurance_saving_total
 
-    # カテゴリー別支出
-    category_expenses = Transaction.objects.filter(
-        family=family,
-        transaction_type='expense',
-        date__gte=start_date,
-        date__lt=end_date
-    ).values('category__name', 'category__is_insurance_saving').annotate(
-        total=Sum('amount')
-    ).order_by('-total')
-
-    # 予算対比
-    budgets = Budget.objects.filter(
-        family=family,
-        year=year,
-        month=month
-    ).select_related('category')
-
-    budget_data = []
-    for budget in budgets:
-        used = budget.get_used_amount()
-        remaining = budget.get_remaining_amount()
-        percentage = budget.get_usage_percentage()
-
-        budget_data.append({
-            'category': budget.category.name,
-            'budget': budget.amount,
-            'used': used,
-            'remaining': remaining,
-            'percentage': percentage,
-            'is_over': remaining < 0
-        })
-
-    # 最近の取引
-    recent_transactions = Transaction.objects.filter(
-        family=family
-    ).select_related('category', 'member', 'payment_method')[:10]
-
-    # グラフ用データ（過去6ヶ月）
-    chart_data = get_chart_data(family, year, month)
-
     # 前月・次月リンク
     prev_month = month - 1 if month > 1 else 12
     prev_year = year if month > 1 else year - 1
@@ -137,16 +99,13 @@ def dashboard(request):
         'member': member,
         'year': year,
         'month': month,
-        'income_total': income_total,
-        'expense_total': expense_total,
-        'cash_saving_total': cash_saving_total,
-        'insurance_saving_total': insurance_saving_total,
-        'balance': balance,
-        'total_savings': total_savings,
-        'category_expenses': category_expenses,
-        'budget_data': budget_data,
-        'recent_transactions': recent_transactions,
-        'chart_data': json.dumps(chart_data),
+        'income_total': from_minor(income_total),
+        'expense_total': from_minor(expense_total),
+        'cash_saving_total': from_minor(cash_saving_total),
+        'insurance_saving_total': from_minor(insurance_saving_total),
+        'balance': from_minor(balance),
+        'total_savings': from_minor(total_savings),
+        'sections': [name for name in DASHBOARD_SECTIONS if name != 'chart'],
         'prev_year': prev_year,
         'prev_month': prev_month,
         'next_year': next_year,
@@ -156,57 +115,45 @@ def dashboard(request):
 
     return render(request, 'budget/dashboard.html', context)
 
+
 def get_chart_data(family, current_year, current_month):
     """過去6ヶ月のグラフデータ生成"""
-    months_data = []
+    first_month = datetime(current_year, current_month, 1).date() - relativedelta(months=5)
+    _, end_date = _month_range(current_year, current_month)
 
-    for i in range(5, -1, -1):
-        month = current_month - i
-        year = current_year
-
-        while month < 1:
-            month += 12
-            year -= 1
-
-        start_date = datetime(year, month, 1).date()
-        if month == 12:
-            end_date = datetime(year + 1, 1, 1).date()
-        else:
-            end_date = datetime(year, month + 1, 1).date()
-
-        income = Transaction.objects.filter(
-            family=family,
-            transaction_type='income',
-            date__gte=start_date,
-            date__lt=end_date
-        ).aggregate(total=Sum('amount'))['total'] or 0
-
-        expense = Transaction.objects.filter(
-            family=family,
-            transaction_type='expense',
-            date__gte=start_date,
-            date__lt=end_date
-        ).aggregate(total=Sum('amount'))['total'] or 0
-
-        cash_saving = CashSaving.objects.filter(
-            family=family,
-            date__gte=start_date,
-            date__lt=end_date
-        ).aggregate(total=Sum('amount'))['total'] or 0
-
-        insurance_saving = Transaction.objects.filter(
-            family=family,
-            transaction_type='expense',
-            category__is_insurance_saving=True,
-            date__gte=start_date,
-            date__lt=end_date
-        ).aggregate(total=Sum('amount'))['total'] or 0
+    totals = {}
+    amount = family_amount(family)
+    transaction_totals = Transaction.objects.filter(
+        family=family,
+        year_month__gte=to_year_month(first_month),
+        year_month__lte=current_year * 100 + current_month
+    ).values('year_month').annotate(
+        income=MinorSum(amount, filter=Q(transaction_type='income')),
+        expense=MinorSum(amount, filter=Q(transaction_type='expense')),
+        insurance_saving=MinorSum(amount, filter=Q(is_insurance_saving=True)),
+    ).order_by()
+    for row in transaction_totals:
+        totals[row['year_month']] = row
+
+    cash_saving_totals = CashSaving.objects.filter(
+        family=family,
+        date__gte=first_month,
+        date__lt=end_date
+    ).annotate(month=TruncMonth('date')).values('month').annotate(
+        cash_saving=MinorSum('amount'),
+    ).order_by()
+    for row in cash_saving_totals:
+        totals.setdefault(to_year_month(row['month']), {})['cash_saving'] = row['cash_saving']
 
+    months_data = []
+    for i in range(6):
+        month_start = first_month + relativedelta(months=i)
+        values = totals.get(to_year_month(month_start), {})
         months_data.append({
-            'label': f"{year}/{month}",
-            'income': float(income),
-            'expense': float(expense),
-            'savings': float(cash_saving + insurance_saving)
+            'label': f"{month_start.year}/{month_start.month}",
+            'income': to_number(values.get('income') or 0),
+            'expense': to_number(values.get('expense') or 0),
+            'savings': to_number((values.get('cash_saving') or 0) + (values.get('insurance_saving') or 0))
         })
 
     return {
@@ -216,14 +163,128 @@ def get_chart_data(family, current_year, current_month):
         'savings': [m['savings'] for m in months_data]
     }
 
+
+def get_category_expenses(family, year, month):
+    """カテゴリー別支出"""
+    rows = list(Transaction.objects.filter(
+        family=family,
+        transaction_type='expense',
+        year_month=year * 100 + month
+    ).values('category__name', 'category__is_insurance_saving').annotate(
+        total=MinorSum(family_amount(family))
+    ).order_by('-total'))
+    for row in rows:
+        row['total'] = from_minor(row['total'])
+    return rows
+
+
+def get_budget_data(family, year, month):
+    """予算対比（使用額はカテゴリーごとに1クエリでまとめて集計）"""
+    budgets = list(Budget.objects.filter(
+        family=family,
+        year=year,
+        month=month
+    ).select_related('category'))
+    if not budgets:
+        return []
+
+    used_by_category = Budget.used_amounts(
+        family, year, month, [budget.category_id for budget in budgets]
+    )
+
+    budget_data = []
+    for budget in budgets:
+        used = used_by_category.get(budget.category_id, Decimal('0'))
+        remaining = budget.amount - used
+        percentage = used / budget.amount * 100 if budget.amount else 0
+
+        budget_data.append({
+            'category': budget.category.name,
+            'budget': budget.amount,
+            'used': used,
+            'remaining': remaining,
+            'percentage': percentage,
+            'is_over': remaining < 0
+        })
+    return budget_data
+
+
+def get_recent_transactions(family, year=None, month=None):
+    """最近の取引"""
+    return list(Transaction.objects.filter(
+        family=family
+    ).select_related('category', 'member', 'payment_method')[:10])
+
+
+def get_anomalies(family, year, month):
+    """月内に検出された異常な支出（detect_anomalies で計算済みのものを読むだけ）"""
+    start_date, end_date = _month_range(year, month)
+    return list(SpendingAnomaly.objects.filter(
+        family=family,
+        period_start__gte=start_date,
+        period_start__lt=end_date
+    ).select_related('category', 'transaction')[:10])
+
+
+def get_category_trends(family, year, month):
+    """支出の多いカテゴリーの移動平均・傾向と今月の見込み（前月までの完了月から）"""
+    data = trends.category_trends(family, datetime(year, month, 1).date())
+    return data['categories'][:DASHBOARD_TREND_CATEGORIES]
+
+
+# Categories shown in the dashboard's trend section
+DASHBOARD_TREND_CATEGORIES = 6
+
+# Dashboard sections loaded after the summary: name -> (builder, context name).
+# 'chart' is returned as JSON, the others as HTML fragments.
+DASHBOARD_SECTIONS = {
+    'chart': (get_chart_data, None),
+    'anomalies': (get_anomalies, 'anomalies'),
+    'categories': (get_category_expenses, 'category_expenses'),
+    'trends': (get_category_trends, 'category_trends'),
+    'budgets': (get_budget_data, 'budget_data'),
+    'recent': (get_recent_transactions, 'recent_transactions'),
+}
+
+# Section data is cached per family data version, so writes invalidate it at once
+DASHBOARD_SECTION_TIMEOUT = getattr(settings, 'DASHBOARD_SECTION_CACHE_SECONDS', 60 * 60)
+
+
+@login_required
+@family_required
+@require_GET
+@conditional_page
+def dashboard_section(request, section):
+    """ダッシュボードの各セクション（サマリー表示後に並行して読み込む）"""
+    if section not in DASHBOARD_SECTIONS:
+        raise Http404
+    family = request.family
+
+    year, month = _dashboard_month(request)
+    builder, context_name = DASHBOARD_SECTIONS[section]
+
+    cache_key = family_cache_key(request, 'dashboard', section, year, month)
+    data = cache.get(cache_key)
+    if data is None:
+        data = builder(family, year, month)
+        cache.set(cache_key, data, DASHBOARD_SECTION_TIMEOUT)
+
+    if context_name is None:
+        return JsonResponse(data)
+
+    return render(request, f'budget/dashboard/{section}.html', {
+        context_name: data,
+        'year': year,
+        'month': month,
+        'currency_symbol': family.get_currency_symbol(),
+    })
+
 @login_required
+@family_required
+@conditional_page
 def transaction_list(request):
     """取引一覧"""
-    try:
-        member = request.user.familymember
-        family = member.family
-    except FamilyMember.DoesNotExist:
-        return redirect('setup_profile')
+    family = request.family
 
     transactions = Transaction.objects.filter(
         family=family
@@ -240,7 +301,7 @@ def transaction_list(request):
         transactions = transactions.filter(category_id=category_id)
     if month:
         year, m = month.split('-')
-        transactions = transactions.filter(date__year=year, date__month=m)
+        transactions = transactions.filter(year_month=int(year) * 100 + int(m))
 
     context = {
         'transactions': transactions[:100],
@@ -254,13 +315,11 @@ def transaction_list(request):
     return render(request, 'budget/transaction_list.html', context)
 
 @login_required
+@family_required
+@conditional_page
 def savings_summary(request):
     """貯蓄サマリー"""
-    try:
-        member = request.user.familymember
-        family = member.family
-    except FamilyMember.DoesNotExist:
-        return redirect('setup_profile')
+    family = request.family
 
     # 総現金貯蓄
     total_cash_savings = CashSaving.objects.filter(
@@ -268,11 +327,10 @@ def savings_summary(request):
     ).aggregate(total=Sum('amount'))['total'] or Decimal('0')
 
     # 総保険型積立
-    total_insurance_savings = Transaction.objects.filter(
+    total_insurance_savings = from_minor(Transaction.objects.filter(
         family=family,
-        transaction_type='expense',
-        category__is_insurance_saving=True
-    ).aggregate(total=Sum('amount'))['total'] or Decimal('0')
+        is_insurance_saving=True
+    ).aggregate(total=MinorSum(family_amount(family)))['total'] or 0)
 
     # 合計貯蓄
     grand_total = total_cash_savings + total_insurance_savings
@@ -284,7 +342,7 @@ def savings_summary(request):
 
     recent_insurance_savings = Transaction.objects.filter(
         family=family,
-        category__is_insurance_saving=True
+        is_insurance_saving=True
     ).select_related('category').order_by('-date')[:10]
 
     context = {
@@ -298,13 +356,68 @@ def savings_summary(request):
     return render(request, 'budget/savings_summary.html', context)
 
 @login_required
+@family_required
+@conditional_page
+def annual_report(request):
+    """年間レポート（カテゴリー×月、?format=csv で CSV ダウンロード）"""
+    family = request.family
+
+    today = timezone.now().date()
+    year = int(request.GET.get('year', today.year))
+    report = reports.get_annual_report(request, family, year)
+
+    if request.GET.get('format') == 'csv':
+        # Written in one piece: utf-8-sig would prepend a BOM to every write
+        buffer = io.StringIO()
+        reports.write_csv(report, buffer)
+        response = HttpResponse(buffer.getvalue(), content_type='text/csv; charset=utf-8-sig')
+        response['Content-Disposition'] = f'attachment; filename="annual_report_{year}.csv"'
+        return response
+
+    # Each month cell is shown with its budget variance (over budget in red)
+    rows = [dict(row, cells=list(zip(row['actual'], row['variance']))) for row in report['rows']]
+
+    context = {
+        'report': report,
+        'rows': rows,
+        'month_labels': reports.month_labels(),
+        'year': year,
+        'previous_year': year - 1,
+        'next_year': year + 1,
+        'currency_symbol': family.get_currency_symbol(),
+    }
+    return render(request, 'budget/annual_report.html', context)
+
+@login_required
+@family_required
+@conditional_page
+def member_report(request):
+    """メンバー別の収入・支出・貯蓄とカテゴリー構成（年単位）"""
+    family = request.family
+
+    today = timezone.now().date()
+    year = int(request.GET.get('year', today.year))
+    breakdown = contributions.get_member_breakdown(request, family, year)
+
+    context = {
+        'breakdown': breakdown,
+        'chart': {
+            'labels': reports.month_labels(),
+            'members': [[entry['name'], entry['expense']] for entry in breakdown['members']],
+        },
+        'year': year,
+        'previous_year': year - 1,
+        'next_year': year + 1,
+        'currency_symbol': family.get_currency_symbol(),
+    }
+    return render(request, 'budget/member_report.html', context)
+
+@login_required
+@family_required
 def quick_add_transaction(request):
     """クイック取引追加（モバイル最適化）"""
-    try:
-        member = request.user.familymember
-        family = member.family
-    except FamilyMember.DoesNotExist:
-        return redirect('setup_profile')
+    member = request.member
+    family = request.family
 
     if request.method == 'POST':
         form = QuickTransactionForm(request.POST, request.FILES, family=family)
@@ -330,12 +443,10 @@ def quick_add_transaction(request):
 
         form = QuickTransactionForm(family=family, initial=initial)
 
-    # よく使うカテゴリー（最近の取引から）
-    frequent_categories = Transaction.objects.filter(
-        family=family
-    ).values('category__id', 'category__name').annotate(
-        count=models.Count('id')
-    ).order_by('-count')[:6]
+    # よく使うカテゴリー（最近よく使うものほど上）
+    frequent_categories = Category.objects.filter(
+        family=family, usage_count__gt=0
+    ).order_by('-usage_score').values('id', 'name')[:6]
 
     context = {
         'form': form,
@@ -345,16 +456,14 @@ def quick_add_transaction(request):
     return render(request, 'budget/quick_add.html', context)
 
 @login_required
+@family_required
 def quick_add_saving(request):
     """クイック貯蓄追加"""
-    try:
-        member = request.user.familymember
-        family = member.family
-    except FamilyMember.DoesNotExist:
-        return redirect('setup_profile')
+    member = request.member
+    family = request.family
 
     if request.method == 'POST':
-        form = CashSavingForm(request.POST)
+        form = CashSavingForm(request.POST, family=family)
         if form.is_valid():
             saving = form.save(commit=False)
             saving.family = family
@@ -364,7 +473,7 @@ def quick_add_saving(request):
             messages.success(request, _('✓ 貯金を登録しました'))
             return redirect('savings_summary')
     else:
-        form = CashSavingForm()
+        form = CashSavingForm(family=family)
 
     context = {
         'form': form,
@@ -373,58 +482,60 @@ def quick_add_saving(request):
     return render(request, 'budget/quick_add_saving.html', context)
 
 @login_required
+@family_required
 def preset_transaction(request, category_id):
     """プリセット取引（2タップ入力）"""
-    try:
-        member = request.user.familymember
-        family = member.family
-    except FamilyMember.DoesNotExist:
-        return redirect('setup_profile')
+    member = request.member
+    family = request.family
 
     category = get_object_or_404(Category, id=category_id, family=family)
 
     if request.method == 'POST':
-        amount = request.POST.get('amount')
+        form = AmountForm(request.POST, family=family)
         payment_method_id = request.POST.get('payment_method')
 
-        if amount:
+        if form.is_valid():
             transaction = Transaction.objects.create(
                 family=family,
                 member=member,
                 transaction_type=category.category_type,
                 category=category,
-                amount=amount,
+                amount=form.cleaned_data['amount'],
                 payment_method_id=payment_method_id if payment_method_id else None,
                 date=timezone.now().date()
             )
             messages.success(request, _('✓ %(category_name)s を登録しました') % {'category_name': category.name})
             return redirect('dashboard')
-
-    # よく使う支払方法
-    common_methods = PaymentMethod.objects.filter(family=family)[:4]
-
-    # 最近の同カテゴリー金額
-    recent_amounts = Transaction.objects.filter(
-        family=family,
-        category=category
-    ).values_list('amount', flat=True).distinct()[:3]
+        for error in form.errors.get('amount', []):
+            messages.error(request, error)
+
+    # よく使う金額・支払方法（このメンバーの入力から）
+    suggestion = suggestions.get_suggestion(family, category.id, member.id)
+    typical_method_id = suggestions.payment_method(suggestion)
+
+    common_methods = list(PaymentMethod.objects.filter(family=family).order_by('-usage_score', 'id')[:4])
+    if typical_method_id and typical_method_id not in {method.id for method in common_methods}:
+        typical = PaymentMethod.objects.filter(family=family, pk=typical_method_id).first()
+        if typical:
+            common_methods = [typical] + common_methods[:3]
+        else:
+            typical_method_id = None
 
     context = {
         'category': category,
         'common_methods': common_methods,
-        'recent_amounts': recent_amounts,
+        'recent_amounts': suggestions.amounts(suggestion),
+        'typical_method_id': typical_method_id,
+        'amount_step': amount_step(family.get_currency_code()),
     }
 
     return render(request, 'budget/preset_transaction.html', context)
 
 @login_required
+@family_required
 def delete_transaction(request, transaction_id):
     """取引削除"""
-    try:
-        member = request.user.familymember
-        family = member.family
-    except FamilyMember.DoesNotExist:
-        return redirect('setup_profile')
+    family = request.family
 
     transaction = get_object_or_404(Transaction, id=transaction_id, family=family)
 
@@ -439,7 +550,7 @@ def delete_transaction(request, transaction_id):
 
     return render(request, 'budget/confirm_delete.html', context)
 
-class RecurringTemplateForm(forms.ModelForm):
+class RecurringTemplateForm(CurrencyAmountMixin, forms.ModelForm):
     class Meta:
         model = RecurringTemplate
         fields = ['transaction_type', 'category', 'amount', 'payment_method',
@@ -457,13 +568,11 @@ class RecurringTemplateForm(forms.ModelForm):
         }
 
 @login_required
+@family_required
+@conditional_page
 def manage_recurring(request):
     """定期取引管理"""
-    try:
-        member = request.user.familymember
-        family = member.family
-    except FamilyMember.DoesNotExist:
-        return redirect('setup_profile')
+    family = request.family
 
     templates = RecurringTemplate.objects.filter(family=family, is_active=True)
 
@@ -473,16 +582,14 @@ def manage_recurring(request):
     return render(request, 'budget/manage_recurring.html', context)
 
 @login_required
+@family_required
 def add_recurring(request):
     """定期取引追加"""
-    try:
-        member = request.user.familymember
-        family = member.family
-    except FamilyMember.DoesNotExist:
-        return redirect('setup_profile')
+    member = request.member
+    family = request.family
 
     if request.method == 'POST':
-        form = RecurringTemplateForm(request.POST)
+        form = RecurringTemplateForm(request.POST, family=family)
         if form.is_valid():
             template = form.save(commit=False)
             template.family = family
@@ -491,7 +598,7 @@ def add_recurring(request):
             messages.success(request, _('✓ 定期取引を追加しました'))
             return redirect('manage_recurring')
     else:
-        form = RecurringTemplateForm()
+        form = RecurringTemplateForm(family=family)
         form.fields['category'].queryset = Category.objects.filter(family=family)
         form.fields['payment_method'].queryset = PaymentMethod.objects.filter(family=family)
 
@@ -499,13 +606,10 @@ def add_recurring(request):
     return render(request, 'budget/add_recurring.html', context)
 
 @login_required
+@family_required
 def generate_all_recurring(request):
     """一括定期取引生成"""
-    try:
-        member = request.user.familymember
-        family = member.family
-    except FamilyMember.DoesNotExist:
-        return redirect('setup_profile')
+    family = request.family
 
     if request.method == 'POST':
         templates = RecurringTemplate.objects.filter(family=family, is_active=True)
@@ -534,13 +638,10 @@ def generate_all_recurring(request):
     return render(request, 'budget/confirm_generate_recurring.html', context)
 
 @login_required
+@family_required
 def toggle_recurring(request, template_id):
     """定期取引の有効/無効切り替え"""
-    try:
-        member = request.user.familymember
-        family = member.family
-    except FamilyMember.DoesNotExist:
-        return redirect('setup_profile')
+    family = request.family
 
     template = get_object_or_404(RecurringTemplate, id=template_id, family=family)
     template.is_active = not template.is_active
@@ -550,13 +651,41 @@ def toggle_recurring(request, template_id):
     messages.success(request, _('✓ 定期取引を%(status)sにしました') % {'status': status})
     return redirect('manage_recurring')
 
+UPCOMING_DAY_OPTIONS = (30, 60, 90, 365)
+
+@login_required
+@family_required
+@conditional_page
+def upcoming_recurring(request):
+    """今後の固定費（定期取引の発生予定）"""
+    family = request.family
+
+    days = int(request.GET.get('days', 30))
+    if days not in UPCOMING_DAY_OPTIONS:
+        days = UPCOMING_DAY_OPTIONS[0]
+
+    today = timezone.now().date()
+    occurrences = projections.project(
+        projections.active_templates(family), today, today + timedelta(days=days - 1)
+    )
+
+    total_income = sum(o.amount for o in occurrences if o.template.transaction_type == 'income')
+    total_expense = sum(o.amount for o in occurrences if o.template.transaction_type == 'expense')
+
+    context = {
+        'occurrences': occurrences,
+        'days': days,
+        'day_options': UPCOMING_DAY_OPTIONS,
+        'total_income': total_income,
+        'total_expense': total_expense,
+        'currency_symbol': family.get_currency_symbol(),
+    }
+    return render(request, 'budget/upcoming_recurring.html', context)
+
 @login_required
+@family_required
 def email_notification_settings(request):
-    try:
-        member = request.user.familymember
-        family = member.family
-    except FamilyMember.DoesNotExist:
-        return redirect('setup_profile')
+    family = request.family
 
     settings, created = EmailNotificationSettings.objects.get_or_create(family=family)
 
@@ -573,117 +702,80 @@ def email_notification_settings(request):
     return render(request, 'budget/email_settings.html', context)
 
 @login_required
+@family_required
+@conditional_page
 def forecast_view(request):
-    try:
-        member = request.user.familymember
-        family = member.family
-    except FamilyMember.DoesNotExist:
-        return redirect('setup_profile')
+    family = request.family
 
     # Get years parameter (default 5, max 60)
-    forecast_years = min(int(request.GET.get('years', 5)), 60)
+    forecast_years = max(1, min(int(request.GET.get('years', 5)), 60))
     year_options = list(range(1, 61))
-    # Historical data (last 12 months)
+    # Historical data: the last 12 complete months, in two grouped queries.
+    # Transactions generated from recurring templates are left out: those are
+    # projected exactly below instead.
     today = timezone.now().date()
-    twelve_months_ago = today - timedelta(days=365)
-
-    # Initialize sums and counters
-    sum_income = Decimal('0')
-    sum_expense = Decimal('0')
-    sum_cash_saving = Decimal('0')
-    sum_insurance = Decimal('0')
-
-    months_with_income = 0
-    months_with_expense = 0
-    months_with_cash_saving = 0
-    months_with_insurance = 0
-
-    monthly_data = []
-
-    for i in range(12):
-        month_start = twelve_months_ago + timedelta(days=30*i)
-        month_end = month_start + timedelta(days=30)
-
-        income = Transaction.objects.filter(
-            family=family, transaction_type='income',
-            date__gte=month_start, date__lt=month_end
-        ).aggregate(total=models.Sum('amount'))['total'] or Decimal('0')
-
-        expense = Transaction.objects.filter(
-            family=family, transaction_type='expense',
-            date__gte=month_start, date__lt=month_end
-        ).aggregate(total=models.Sum('amount'))['total'] or Decimal('0')
-
-        cash_saving = CashSaving.objects.filter(
-            family=family, date__gte=month_start, date__lt=month_end
-        ).aggregate(total=models.Sum('amount'))['total'] or Decimal('0')
-
-        insurance = Transaction.objects.filter(
-            family=family, category__is_insurance_saving=True,
-            date__gte=month_start, date__lt=month_end
-        ).aggregate(total=models.Sum('amount'))['total'] or Decimal('0')
-
-        # Add to sums and increment counters if > 0
-        if income > 0:
-            sum_income += income
-            months_with_income += 1
-        if expense > 0:
-            sum_expense += expense
-            months_with_expense += 1
-        if cash_saving > 0:
-            sum_cash_saving += cash_saving
-            months_with_cash_saving += 1
-        if insurance > 0:
-            sum_insurance += insurance
-            months_with_insurance += 1
-
-        monthly_data.append({
-            'month': month_start.strftime('%Y/%m'),
-            'income': float(income),
-            'expense': float(expense),
-            'cash_saving': float(cash_saving),
-            'insurance': float(insurance)
-        })
+    history = trends.monthly_totals(family, today, count=12, exclude_recurring=True)
+
+    # Average over the months since the family started recording, with empty
+    # months counted as 0, so a quiet month lowers the average as it should
+    series = ('income', 'expense', 'cash_saving', 'insurance')
+    first = next(
+        (i for i in range(12) if any(history[name][i] for name in series)), 12
+    )
+    recorded_months = 12 - first
+
+    def average(name):
+        # Rounded to whole minor units, so the projection stays in integers
+        return round(sum(history[name][first:]) / recorded_months) if recorded_months else 0
 
-    # Calculate averages based on months with data
-    avg_income = float(sum_income / months_with_income) if months_with_income else 0
-    avg_expense = float(sum_expense / months_with_expense) if months_with_expense else 0
-    avg_cash_saving = float(sum_cash_saving / 12)
-    avg_insurance = float(sum_insurance / months_with_insurance) if months_with_insurance else 0
+    avg_income = average('income')
+    avg_expense = average('expense')
+    avg_cash_saving = average('cash_saving')
+    avg_insurance = average('insurance')
 
     # Current totals
     total_cash_savings = CashSaving.objects.filter(family=family).aggregate(
-        total=models.Sum('amount'))['total'] or Decimal('0')
+        total=MinorSum('amount'))['total'] or 0
 
     total_insurance = Transaction.objects.filter(
-        family=family, category__is_insurance_saving=True
-    ).aggregate(total=models.Sum('amount'))['total'] or Decimal('0')
+        family=family, is_insurance_saving=True
+    ).aggregate(total=MinorSum(family_amount(family)))['total'] or 0
+
+    # Fixed income and costs per future month, from the recurring templates
+    fixed = projections.monthly_totals(
+        projections.active_templates(family), today, forecast_years * 12
+    )
 
     # Generate forecast
     forecast_data = []
 
-    cumulative_cash = float(total_cash_savings)
-    cumulative_insurance = float(total_insurance)
+    cumulative_cash = total_cash_savings
+    cumulative_insurance = total_insurance
 
     for i in range(1, forecast_years * 12 + 1):  # Monthly for N years
-        future_month = today + timedelta(days=30*i)
-        cumulative_cash = cumulative_cash + avg_cash_saving + avg_income - avg_expense
-        cumulative_insurance = cumulative_insurance + avg_insurance
+        future_month = today + relativedelta(months=i)
+        month_fixed = fixed[i - 1]
+        cumulative_cash = (cumulative_cash + avg_cash_saving
+                           + avg_income + month_fixed['income']
+                           - avg_expense - month_fixed['expense'])
+        cumulative_insurance = cumulative_insurance + avg_insurance + month_fixed['insurance']
 
         if i % 12 == 0:  # Store yearly data
             forecast_data.append({
                 'year': future_month.year,
-                'cash_savings': cumulative_cash,
-                'insurance_savings': cumulative_insurance,
-                'total_savings': cumulative_cash + cumulative_insurance
+                'cash_savings': to_number(cumulative_cash),
+                'insurance_savings': to_number(cumulative_insurance),
+                'total_savings': to_number(cumulative_cash + cumulative_insurance)
             })
 
     context = {
         'forecast_data': json.dumps(forecast_data),
-        'avg_cash_saving': avg_cash_saving,
-        'avg_insurance': avg_insurance * 12,
-        'total_cash_savings': float(total_cash_savings),
-        'total_insurance': float(total_insurance),
+        'avg_cash_saving': from_minor(avg_cash_saving),
+        'avg_insurance': from_minor(avg_insurance * 12),
+        'fixed_income': from_minor(sum(month['income'] for month in fixed[:12])),
+        'fixed_expense': from_minor(sum(month['expense'] for month in fixed[:12])),
+        'total_cash_savings': from_minor(total_cash_savings),
+        'total_insurance': from_minor(total_insurance),
         'forecast_years': forecast_years,
         'year_options': year_options,  # ← ADD THIS
     }
@@ -754,203 +846,67 @@ def manifest(request):
     }
     return JsonResponse(manifest_data)
 
+def _ai_options(request, family, currency_symbol, status=200):
+    """AI分析のオプション画面"""
+    # Get available categories for focus-area dropdown
+    expense_categories = Category.objects.filter(
+        family=family,
+        category_type='expense'
+    ).order_by('name')
+
+    context = {
+        'expense_categories': expense_categories,
+        'currency_symbol': currency_symbol,
+    }
+    return render(request, 'budget/ai_options.html', context, status=status)
+
+def _ai_request_options(request):
+    """POST されたAI分析オプション"""
+    months = int(request.POST.get('months', 3))
+    # Clamp months to valid range
+    months = max(1, min(12, months))
+    return {
+        'months': months,
+        'analysis_type': request.POST.get('analysis_type', 'general'),
+        'custom_question': request.POST.get('custom_question', '').strip(),
+        'focus_category': request.POST.get('focus_category', ''),
+    }
+
+def _analysis_since_date(months):
+    return timezone.now().date() - timedelta(days=months * 30)
+
 @login_required
+@family_required
 def ai_spending_analysis(request):
-    try:
-        member = request.user.familymember
-        family = member.family
-    except FamilyMember.DoesNotExist:
-        return redirect('setup_profile')
+    """支出分析: ローカル分析を即時表示し、Gemini のアドバイスは後から読み込む"""
+    family = request.family
 
     currency_symbol = family.get_currency_symbol()
 
-    # Use the member's personal API key if set, otherwise fall back to global key
-    api_key = member.gemini_api_key.strip() or settings.GEMINI_API_KEY
-    genai.configure(api_key=api_key)
-
     # GET → show the options/configuration page
     if request.method == 'GET':
-        # Get available categories for focus-area dropdown
-        expense_categories = Category.objects.filter(
-            family=family,
-            category_type='expense'
-        ).order_by('name')
-
-        context = {
-            'expense_categories': expense_categories,
-            'currency_symbol': currency_symbol,
-        }
-        return render(request, 'budget/ai_options.html', context)
+        return _ai_options(request, family, currency_symbol)
 
     # POST → run the analysis with user-chosen options
-    months = int(request.POST.get('months', 3))
-    analysis_type = request.POST.get('analysis_type', 'general')
-    custom_question = request.POST.get('custom_question', '').strip()
-    focus_category = request.POST.get('focus_category', '')
-
-    # Clamp months to valid range
-    months = max(1, min(12, months))
-    days = months * 30
+    options = _ai_request_options(request)
+    months = options['months']
+    analysis_type = options['analysis_type']
+    focus_category = options['focus_category']
 
     today = timezone.now().date()
-    since_date = today - timedelta(days=days)
-
-    transactions = Transaction.objects.filter(
-        family=family,
-        date__gte=since_date
-    ).select_related('category')
+    since_date = _analysis_since_date(months)
 
     # Aggregate data
-    category_totals = {}
-    for trans in transactions:
-        cat_name = trans.category.name
-        if cat_name not in category_totals:
-            category_totals[cat_name] = {
-                'total': 0,
-                'count': 0,
-                'type': trans.transaction_type
-            }
-        category_totals[cat_name]['total'] += float(trans.amount)
-        category_totals[cat_name]['count'] += 1
+    category_totals = insights.category_totals(family, since_date)
 
     total_income = sum(v['total'] for v in category_totals.values() if v['type'] == 'income')
     total_expense = sum(v['total'] for v in category_totals.values() if v['type'] == 'expense')
     balance = total_income - total_expense
     savings_rate = (balance / total_income * 100) if total_income > 0 else 0
-    monthly_income = total_income / months
-    monthly_expense = total_expense / months
-
-    # Map Django language code to a language name for the AI prompt
-    _lang_names = {'ja': 'Japanese', 'en': 'English', 'it': 'Italian'}
-    _response_lang = _lang_names.get(get_language() or 'ja', 'Japanese')
-
-    # Build base data section of prompt
-    prompt = f"""
-You are an experienced financial planner (FP).
-Based on the following household budget data (actual results for the past {months} months), please provide specific and actionable advice in {_response_lang}.
-
-## 📊 家計概要（{months}ヶ月合計）
-- **期間:** {days}日間
-- **通貨:** {family.get_currency_code()}
-- **総収入:** {currency_symbol}{total_income:,.0f}
-- **総支出:** {currency_symbol}{total_expense:,.0f}
-- **収支バランス:** {currency_symbol}{balance:,.0f}
-- **貯蓄率:** {savings_rate:.1f}%
-
-## 📅 月平均換算（目安）
-- **月収:** 約 {currency_symbol}{monthly_income:,.0f}
-- **月支出:** 約 {currency_symbol}{monthly_expense:,.0f}
-
-## 📂 カテゴリー別支出詳細（金額順）
-"""
-    sorted_expenses = sorted(
-        [(k, v) for k, v in category_totals.items() if v['type'] == 'expense'],
-        key=lambda x: x[1]['total'],
-        reverse=True
-    )
-    for cat_name, data in sorted_expenses:
-        monthly_avg = data['total'] / months
-        percent_of_total = (data['total'] / total_expense * 100) if total_expense > 0 else 0
-        prompt += f"- **{cat_name}**: 総額 {currency_symbol}{data['total']:,.0f} (月平均 {currency_symbol}{monthly_avg:,.0f}) | 支出全体の{percent_of_total:.1f}% | {data['count']}回\n"
-
-    # Build the instruction section based on analysis_type
-    if analysis_type == 'savings':
-        prompt += """
-
-## 📝 分析依頼内容
-貯蓄の最適化に特化した分析をMarkdown形式で出力してください。
-
-### 1. 💰 現在の貯蓄状況の評価
-貯蓄率や金額が理想的かどうかを、年齢別・収入別の一般的な目安と比較して評価してください。
-
-### 2. 🎯 貯蓄を増やす具体的な方法（3つ）
-家計データに基づき、今すぐ実践できる貯蓄増加のアクションを3つ提案してください。
-
-### 3. 📈 短期・長期の貯蓄目標
-現在のペースを続けた場合の1年後・5年後の貯蓄見通しと、改善した場合との比較を示してください。
-
-### 4. ⚠️ 注意すべきリスク
-家計バランスを見て、将来の貯蓄を脅かす可能性のある支出パターンを指摘してください。
-"""
-    elif analysis_type == 'budget':
-        prompt += """
-
-## 📝 分析依頼内容
-予算計画に特化した分析をMarkdown形式で出力してください。
 
-### 1. 📊 カテゴリー別予算配分の評価
-各カテゴリーの支出比率が家計の理想的な配分（50-30-20ルール等）と比較してどうかを評価してください。
-
-### 2. 💡 推奨予算配分（月額）
-現在の収入に基づき、各カテゴリーの推奨月次予算を具体的な金額で提示してください。
-
-### 3. 🔧 予算管理の改善ポイント
-支出パターンから読み取れる予算管理上の課題と、改善するための具体的なアドバイスを3つ提示してください。
-
-### 4. 🌟 うまくできていること
-現在の予算管理で評価できる点を挙げてください。
-"""
-    elif analysis_type == 'focus' and focus_category:
-        prompt += f"""
-
-## 📝 分析依頼内容
-「**{focus_category}**」カテゴリーに特化した深掘り分析をMarkdown形式で出力してください。
-
-### 1. 🔍 このカテゴリーの支出パターン分析
-金額・頻度・割合から見た現状の詳細な評価をしてください。
-
-### 2. 💡 このカテゴリーを改善する具体的な方法（3つ）
-実際に削減・最適化できる具体的なアクションを提案してください。
-
-### 3. 💰 削減目標と期待効果
-翌月の具体的な目標金額と、それを達成した場合の年間での貯蓄改善効果を計算してください。
-
-### 4. 🌟 このカテゴリーで評価できる点
-ポジティブな面も忘れずに指摘してください。
-"""
-    elif analysis_type == 'custom' and custom_question:
-        prompt += f"""
-
-## 📝 ユーザーからの質問
-以下の質問に、上記の家計データを参考にしながら、Markdown形式で丁寧に回答してください。
-
-**質問:** {custom_question}
-
-回答には以下を含めてください：
-- データに基づいた具体的な数字や根拠
-- 実行可能な具体的なアドバイス
-- ポジティブな視点とリスクの両面からの評価
-"""
-    else:
-        # Default: general analysis
-        prompt += """
-
-## 📝 分析依頼内容
-以下のフォーマットに従って、Markdown形式で出力してください。
-トーンは「親身で、かつ論理的」にお願いします。
-
-### 1. 🔍 現状分析（3つのポイント）
-数字に基づいた客観的な分析を3点挙げてください。
-
-### 2. 💡 具体的な改善提案（3つのステップ）
-「少し頑張れば実行できる」レベルの具体的なアクションを3つ提案してください。
-
-### 3. 💰 今すぐ見直すべき項目（節約ターゲット）
-最も削減効果が高いカテゴリーを1つ選び、翌月の具体的な削減目標金額とその理由を提示してください。
-
-### 4. 🌟 素晴らしい点（Goodポイント）
-家計管理の中で評価できる点を1つ褒めてください。
-"""
-
-    try:
-        model = genai.GenerativeModel("gemini-2.5-flash")
-        response = model.generate_content(prompt)
-        ai_raw = extract_text(response)
-        if not ai_raw:
-            ai_raw = _("⚠️ AIが有効なテキストを返しませんでした。（safety / 空の応答）")
-        ai_analysis = mark_safe(markdown.markdown(ai_raw))
-    except Exception as e:
-        ai_analysis = mark_safe(f"<p class='text-red-600'>⚠️ {_('AI分析エラー')}: {str(e)}</p>")
+    local_insights = insights.analyze(
+        family, category_totals, months, since_date, today, focus_category=focus_category
+    )
 
     # Analysis type label for display
     analysis_labels = {
@@ -963,7 +919,9 @@ Based on the following household budget data (actual results for the past {month
     analysis_label = analysis_labels.get(analysis_type, _('総合支出分析'))
 
     context = {
-        'ai_analysis': ai_analysis,
+        'insights': local_insights,
+        # A custom question can only be answered by the AI
+        'use_ai': 'use_ai' in request.POST or analysis_type == 'custom',
         'total_income': total_income,
         'total_expense': total_expense,
         'balance': balance,
@@ -973,23 +931,35 @@ Based on the following household budget data (actual results for the past {month
         'months': months,
         'analysis_type': analysis_type,
         'analysis_label': analysis_label,
-        'custom_question': custom_question,
+        'custom_question': options['custom_question'],
         'focus_category': focus_category,
     }
 
     return render(request, 'budget/ai_analysis.html', context)
 
-# --- Safe extraction of Gemini response ---
-def extract_text(resp):
-    if not resp:
-        return ""
-    if hasattr(resp, "text") and resp.text:
-        return resp.text
-    # Fallback: extract from candidates manually
-    if resp.candidates:
-        for c in resp.candidates:
-            if c.content and c.content.parts:
-                return "".join(
-                    p.text for p in c.content.parts if hasattr(p, "text") and p.text
-                )
-    return ""
+@login_required
+@family_required
+@require_POST
+def ai_narrative(request):
+    """Gemini のアドバイス（分析結果ページから非同期で読み込む HTML 断片）"""
+    member = request.member
+    family = request.family
+
+    # Use the member's personal API key if set, otherwise fall back to global key
+    api_key = member.gemini_api_key.strip() or settings.GEMINI_API_KEY
+
+    options = _ai_request_options(request)
+    category_totals = insights.category_totals(family, _analysis_since_date(options['months']))
+    prompt = ai.build_prompt(family, category_totals, **options)
+
+    try:
+        ai_analysis = ai.generate_analysis(prompt, api_key, family.pk)
+    except AIBusy as e:
+        message = _('⏳ AI分析が混み合っています。%(seconds)s秒後にもう一度お試しください') % {
+            'seconds': e.retry_after
+        }
+        response = HttpResponse(format_html("<p class='text-yellow-700'>{}</p>", message), status=429)
+        response['Retry-After'] = str(e.retry_after)
+        return response
+
+    return HttpResponse(ai_analysis)
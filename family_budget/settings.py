@@ -55,6 +55,7 @@ LANGUAGE_COOKIE_AGE = 365 * 24 * 60 * 60  # 1 year, keeps language preference
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "whitenoise.middleware.WhiteNoiseMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     'django.middleware.locale.LocaleMiddleware',
     "django.middleware.common.CommonMiddleware",
@@ -141,7 +142,19 @@ LOCALE_PATHS = [
 
 STATIC_URL = '/static/'
 # STATICFILES_DIRS = BASE_DIR / 'static'
-STATIC_ROOT = BASE_DIR / 'static'
+STATIC_ROOT = BASE_DIR / 'staticfiles'
+
+# collectstatic writes content-hashed copies plus .gz/.br variants;
+# WhiteNoise serves the hashed files with far-future cache headers
+STORAGES = {
+    "default": {
+        "BACKEND": "django.core.files.storage.FileSystemStorage",
+    },
+    "staticfiles": {
+        "BACKEND": "budget.storage.ManifestStaticFilesStorage",
+    },
+}
+WHITENOISE_MANIFEST_STRICT = False
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
@@ -166,9 +179,25 @@ EMAIL_HOST_PASSWORD = 'your-app-password'
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 SERVER_EMAIL = EMAIL_HOST_USER # For error reports
 
+# Sync API: deletions are remembered this long; older cursors get a full resync
+SYNC_TOMBSTONE_RETENTION_DAYS = 90
+
 # Gemini API Key (ensure this is set in your .env file)
 GEMINI_API_KEY ='your-api-key-here-or-in-.env'
 
+# AI analysis admission control (see budget/ai_limits.py)
+AI_MAX_CONCURRENT_CALLS = 4          # Gemini calls in flight per worker process
+AI_QUEUE_TIMEOUT = 5                 # seconds to wait for a free slot before answering 429
+AI_CALL_TIMEOUT = 60                 # seconds before a Gemini call is abandoned
+AI_FAMILY_RATE = (5, 60 * 60)        # analyses per family: 5 per hour
+AI_KEY_RATE = (30, 60 * 60)          # calls per API key: 30 per hour
+AI_RESULT_CACHE_SECONDS = 10 * 60    # identical analyses reuse the result this long
+
+# AI backend. 'budget.ai_backends.FakeBackend' answers offline (load tests, development);
+# tune it with AI_FAKE_BACKEND = {'latency': 1.0, 'jitter': 0.2, 'chunk_delay': 0.02,
+#                                 'failure_rate': 0.0, 'timeout_rate': 0.0, 'seed': 0}
+AI_BACKEND = 'budget.ai_backends.GeminiBackend'
+
 # PWA settings
 PWA_APP_NAME = '家計簿アプリ'
 PWA_APP_DESCRIPTION = '家族で使える家計簿管理アプリ'
@@ -229,4 +258,5 @@ PWA_APP_ICONS = [
     }
 ]
 
-PWA_SERVICE_WORKER_PATH = '/static/serviceworker.js'
+# Served at /serviceworker.js by django-pwa so its scope covers the whole site
+PWA_SERVICE_WORKER_PATH = BASE_DIR / 'static' / 'serviceworker.js'
@@ -1,85 +1,61 @@
 // Service Worker for Budget App PWA
-const CACHE_NAME = 'budget-app-v1';
-const urlsToCache = [
-  '/',
-  '/dashboard/',
-  '/quick-add/',
-  '/savings/',
-  '/transactions/',
-  '/settings/',
-
-  '/setup/',
-  '/family/',
-  '/categories/',
-  '/payment-methods/',
-  '/budgets/',
-  '/transaction/',
-  '/recurring/',
-];
-
-// Install - cache assets
-self.addEventListener('install', event => {
-  event.waitUntil(
-    caches.open(CACHE_NAME)
-      .then(cache => {
-        console.log('Opened cache');
-        return cache.addAll(urlsToCache);
-      })
-  );
-  self.skipWaiting();
-});
+//
+// Route-aware caching:
+//   - /static/ assets (content-hashed)  -> cache-first
+//   - HTML pages and JSON responses     -> stale-while-revalidate (ETag validated)
+//   - everything else                   -> network only
+//
+// Bump CACHE_VERSION whenever the caching rules change; caches from older
+// versions are purged on activate.
+const CACHE_VERSION = 'v2';
+const CACHE_PREFIX = 'budget-app-';
 
-// Fetch - serve from cache, fallback to network
-self.addEventListener('fetch', event => {
-  // Skip cache for API calls or POST requests
-  if (event.request.method !== 'GET') {
-    return;
-  }
+const CACHES = {
+  static: {
+    name: `${CACHE_PREFIX}static-${CACHE_VERSION}`,
+    maxEntries: 100,
+    maxAgeSeconds: 30 * 24 * 60 * 60,  // 30 days
+  },
+  pages: {
+    name: `${CACHE_PREFIX}pages-${CACHE_VERSION}`,
+    maxEntries: 30,
+    maxAgeSeconds: 24 * 60 * 60,  // 1 day
+  },
+  data: {
+    name: `${CACHE_PREFIX}data-${CACHE_VERSION}`,
+    maxEntries: 50,
+    maxAgeSeconds: 24 * 60 * 60,  // 1 day
+  },
+};
 
-  event.respondWith(
-    caches.match(event.request)
-      .then(response => {
-        // Cache hit - return response
-        if (response) {
-          return response;
-        }
-
-        // Clone the request
-        const fetchRequest = event.request.clone();
-
-        return fetch(fetchRequest).then(response => {
-          // Check if valid response
-          if (!response || response.status !== 200 || response.type !== 'basic') {
-            return response;
-          }
+// Only the offline fallback is pre-cached; dynamic pages are cached on first visit.
+const OFFLINE_URL = '/offline/';
+
+// Header used to remember when an entry was stored (the Cache API has no TTL).
+const FETCHED_AT_HEADER = 'sw-fetched-at';
 
-          // Clone the response
-          const responseToCache = response.clone();
-
-          caches.open(CACHE_NAME)
-            .then(cache => {
-              cache.put(event.request, responseToCache);
-            });
-
-          return response;
-        });
-      })
-      .catch(() => {
-        // Offline fallback page
-        return caches.match('/offline.html');
-      })
+// Session changes make cached pages (and their CSRF tokens) invalid.
+const SESSION_PATHS = /\/(login|logout|signup)\/$/;
+
+// Install - pre-cache the offline page
+self.addEventListener('install', event => {
+  event.waitUntil(
+    caches.open(CACHES.pages.name)
+      .then(cache => cache.add(OFFLINE_URL))
+      .catch(error => console.log('Offline page not cached:', error))
   );
+  self.skipWaiting();
 });
 
-// Activate - clean old caches
+// Activate - purge caches from older versions
 self.addEventListener('activate', event => {
-  const cacheWhitelist = [CACHE_NAME];
+  const current = Object.values(CACHES).map(config => config.name);
 
   event.waitUntil(
     caches.keys().then(cacheNames => {
       return Promise.all(
         cacheNames.map(cacheName => {
-          if (!cacheWhitelist.includes(cacheName)) {
+          if (!current.includes(cacheName)) {
             console.log('Deleting old cache:', cacheName);
             return caches.delete(cacheName);
           }
@@ -90,3 +66,192 @@ self.addEventListener('activate', event => {
 
   self.clients.claim();
 });
+
+// Fetch - dispatch by route
+self.addEventListener('fetch', event => {
+  const request = event.request;
+  const url = new URL(request.url);
+
+  if (url.origin !== self.location.origin) {
+    return;
+  }
+
+  // Any write may change what the pages show, so drop cached pages and data.
+  // The request itself always goes to the network.
+  if (request.method !== 'GET') {
+    event.waitUntil(purgeDynamicCaches());
+    return;
+  }
+
+  if (url.pathname.startsWith('/static/')) {
+    event.respondWith(cacheFirst(request, CACHES.static));
+  } else if (request.mode === 'navigate' || acceptsHtml(request)) {
+    if (SESSION_PATHS.test(url.pathname)) {
+      return;
+    }
+    event.respondWith(staleWhileRevalidate(event, CACHES.pages));
+  } else if (acceptsJson(request)) {
+    event.respondWith(staleWhileRevalidate(event, CACHES.data));
+  }
+});
+
+function acceptsHtml(request) {
+  return (request.headers.get('Accept') || '').includes('text/html');
+}
+
+function acceptsJson(request) {
+  const accept = request.headers.get('Accept') || '';
+  return accept.includes('application/json') || new URL(request.url).pathname.startsWith('/api/');
+}
+
+function isCacheable(response) {
+  return response && response.status === 200 && response.type === 'basic' && !response.redirected;
+}
+
+function isExpired(response, config) {
+  const fetchedAt = Number(response.headers.get(FETCHED_AT_HEADER) || 0);
+  return Date.now() - fetchedAt > config.maxAgeSeconds * 1000;
+}
+
+// Hashed assets never change under the same URL, so the cache is authoritative.
+async function cacheFirst(request, config) {
+  const cache = await caches.open(config.name);
+  const cached = await cache.match(request);
+  if (cached && !isExpired(cached, config)) {
+    return cached;
+  }
+
+  try {
+    const response = await fetch(request);
+    if (isCacheable(response)) {
+      await put(cache, request, response.clone(), config);
+    }
+    return response;
+  } catch (error) {
+    if (cached) {
+      return cached;
+    }
+    throw error;
+  }
+}
+
+// Answer from the cache immediately, then revalidate in the background.
+async function staleWhileRevalidate(event, config) {
+  const request = event.request;
+  const cache = await caches.open(config.name);
+  const cached = await cache.match(request, { ignoreVary: true });
+  const fresh = Boolean(cached) && !isExpired(cached, config);
+
+  // Even an expired entry is worth sending as a validator.
+  const revalidation = revalidate(request, cache, cached ? cached.clone() : null, config, fresh);
+
+  if (fresh) {
+    event.waitUntil(revalidation.catch(() => {}));
+    return cached;
+  }
+
+  try {
+    return await revalidation;
+  } catch (error) {
+    if (cached) {
+      return cached;
+    }
+    if (request.mode === 'navigate') {
+      const offline = await caches.match(OFFLINE_URL);
+      if (offline) {
+        return offline;
+      }
+    }
+    throw error;
+  }
+}
+
+async function revalidate(request, cache, cached, config, shown) {
+  const etag = cached ? cached.headers.get('ETag') : null;
+  const headers = new Headers(request.headers);
+  if (etag) {
+    headers.set('If-None-Match', etag);
+  }
+
+  const response = await fetch(request.url, {
+    headers,
+    credentials: 'same-origin',
+    redirect: 'follow',
+  });
+
+  // Unchanged - keep the cached body and restart its age.
+  if (response.status === 304 && cached) {
+    await put(cache, request, cached.clone(), config);
+    return cached;
+  }
+
+  if (response.redirected) {
+    // Redirects usually mean the session or the data changed (e.g. login, toggle).
+    await purgeDynamicCaches();
+    return response;
+  }
+
+  if (isCacheable(response)) {
+    await put(cache, request, response.clone(), config);
+    const newEtag = response.headers.get('ETag');
+    if (shown && etag && newEtag && newEtag !== etag) {
+      notifyClients(request.url);
+    }
+  }
+  return response;
+}
+
+async function put(cache, request, response, config) {
+  const headers = new Headers(response.headers);
+  headers.set(FETCHED_AT_HEADER, String(Date.now()));
+  const body = await response.blob();
+
+  await cache.put(request, new Response(body, {
+    status: response.status,
+    statusText: response.statusText,
+    headers,
+  }));
+  await trimCache(cache, config);
+}
+
+// Keep at most maxEntries (oldest first) and drop anything past maxAgeSeconds.
+async function trimCache(cache, config) {
+  const requests = await cache.keys();
+  const entries = await Promise.all(requests.map(async req => {
+    const res = await cache.match(req);
+    return {
+      request: req,
+      fetchedAt: Number((res && res.headers.get(FETCHED_AT_HEADER)) || 0),
+      expired: !res || isExpired(res, config),
+    };
+  }));
+
+  const live = entries
+    .filter(entry => !entry.expired || entry.request.url.endsWith(OFFLINE_URL))
+    .sort((a, b) => b.fetchedAt - a.fetchedAt);
+  const keep = new Set(live.slice(0, config.maxEntries).map(entry => entry.request.url));
+
+  await Promise.all(
+    entries
+      .filter(entry => !keep.has(entry.request.url) && !entry.request.url.endsWith(OFFLINE_URL))
+      .map(entry => cache.delete(entry.request))
+  );
+}
+
+async function purgeDynamicCaches() {
+  for (const config of [CACHES.pages, CACHES.data]) {
+    const cache = await caches.open(config.name);
+    const requests = await cache.keys();
+    await Promise.all(
+      requests
+        .filter(req => !req.url.endsWith(OFFLINE_URL))
+        .map(req => cache.delete(req))
+    );
+  }
+}
+
+// Tell open pages that a newer version of a URL they may be showing is cached.
+async function notifyClients(url) {
+  const clients = await self.clients.matchAll({ type: 'window' });
+  clients.forEach(client => client.postMessage({ type: 'page-updated', url }));
+}